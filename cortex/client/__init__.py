@@ -1,2 +1,4 @@
 from .client import upload_sample
+from .bulk import upload_samples
+from .sample import iter_snapshots
 from .cortex_pb2 import *
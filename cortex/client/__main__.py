@@ -1,9 +1,32 @@
 import click
 from click.exceptions import UsageError
-from .client import upload_sample
+from .client import upload_sample, DEFAULT_WORKERS, DEFAULT_WINDOW, DEFAULT_RETRIES
+from .bulk import upload_samples, print_report, DEFAULT_PROCESSES, DEFAULT_MAX_CONNECTIONS
+from .sample import convert_sample, DEFAULT_BLOCK_SNAPSHOTS, DEFAULT_READ_AHEAD
+from .benchmark import benchmark, generate_sample, DEFAULT_SNAPSHOTS, DEFAULT_COLOR_SIZE, DEFAULT_DEPTH_SIZE
+from .inspector import inspect_sample, print_inspection
+import json
 import sys
 
-USAGE_ERROR = "Usage Error: python -m cortex.client -h/--host <SERVER_HOST> -p/--port <PORT_NUMBER> <PATH_TO_FILE>"
+USAGE_ERROR = "Usage Error: python -m cortex.client upload-sample " \
+              "(-h/--host <SERVER_HOST> -p/--port <PORT_NUMBER> | " \
+              "-e/--endpoint <HOST:PORT> [-e/--endpoint <HOST:PORT> ...] [--sticky]) " \
+              "[-w/--workers <THREADS>] [--window <REQUESTS_IN_FLIGHT>] [--batch-size <SNAPSHOTS>] " \
+              "[--batch-bytes <BYTES>] [-t/--transport http/grpc] [--resume] [--passthrough] " \
+              "[--read-ahead <SNAPSHOTS>] [--retries <RETRIES>] " \
+              "[--stats <PATH or ->] [--stats-interval <SECONDS>] [--dry-run] " \
+              "[--compression deflate/xz] [--compression-level <LEVEL>] [--dedup] [--depth-delta] " \
+              "<PATH_TO_FILE>\n" \
+              "             python -m cortex.client convert [--block-snapshots <SNAPSHOTS>] <PATH_TO_FILE> " \
+              "<PATH_TO_INDEXED_FILE>\n" \
+              "             python -m cortex.client bulk-upload <server options> " \
+              "[-P/--processes <PROCESSES>] [--max-connections <CONNECTIONS>] [<upload-sample options>] " \
+              "<DIRECTORY_OR_GLOB>\n" \
+              "             python -m cortex.client generate-sample [--snapshots <SNAPSHOTS>] " \
+              "[--color-size <WIDTHxHEIGHT>] [--depth-size <WIDTHxHEIGHT>] [--seed <SEED>] <PATH_TO_FILE>\n" \
+              "             python -m cortex.client benchmark [--mode sink/http] [<upload-sample options>] " \
+              "<PATH_TO_FILE>\n" \
+              "             python -m cortex.client inspect [--json] <PATH_TO_FILE>"
 
 
 def _show_usage_error(self):
@@ -13,14 +36,97 @@ def _show_usage_error(self):
 UsageError.show = _show_usage_error
 
 
+def _image_size(ctx, param, value):
+    try:
+        width, height = (int(dimension) for dimension in value.lower().split("x"))
+    except ValueError:
+        raise click.BadParameter(value)
+    return width, height
+
+
 @click.command()
 @click.argument('action', required=True)
-@click.option('-h', '--host', required=True)
-@click.option('-p', '--port', required=True)
-@click.argument('path')
-def parser(action, host, port, path):
-    if action == "upload-sample":
-        upload_sample(host, int(port), path)
+@click.option('-h', '--host')
+@click.option('-p', '--port')
+@click.option('-e', '--endpoint', 'endpoints', multiple=True)
+@click.option('--sticky', is_flag=True)
+@click.option('-w', '--workers', default=DEFAULT_WORKERS, type=int)
+@click.option('--window', default=DEFAULT_WINDOW, type=int)
+@click.option('--batch-size', default=None, type=int)
+@click.option('--batch-bytes', default=None, type=int)
+@click.option('-t', '--transport', default="http")
+@click.option('--resume', is_flag=True)
+@click.option('--passthrough', is_flag=True)
+@click.option('--read-ahead', default=DEFAULT_READ_AHEAD, type=int)
+@click.option('--retries', default=DEFAULT_RETRIES, type=int)
+@click.option('--stats', 'stats_path', default=None)
+@click.option('--stats-interval', default=None, type=float)
+@click.option('--dry-run', is_flag=True)
+@click.option('--compression', default=None)
+@click.option('--compression-level', default=None, type=click.IntRange(0, 9))
+@click.option('--dedup', is_flag=True)
+@click.option('--depth-delta', is_flag=True)
+@click.option('--mode', default="sink")
+@click.option('--snapshots', default=DEFAULT_SNAPSHOTS, type=int)
+@click.option('--color-size', default="{}x{}".format(*DEFAULT_COLOR_SIZE), callback=_image_size)
+@click.option('--depth-size', default="{}x{}".format(*DEFAULT_DEPTH_SIZE), callback=_image_size)
+@click.option('--seed', default=0, type=int)
+@click.option('--block-snapshots', default=DEFAULT_BLOCK_SNAPSHOTS, type=int)
+@click.option('--json', 'as_json', is_flag=True)
+@click.option('-P', '--processes', default=DEFAULT_PROCESSES, type=int)
+@click.option('--max-connections', default=DEFAULT_MAX_CONNECTIONS, type=int)
+@click.argument('paths', nargs=-1, required=True)
+def parser(action, host, port, endpoints, sticky, workers, window, batch_size, batch_bytes, transport, resume,
+           passthrough, read_ahead, retries, stats_path, stats_interval, dry_run, compression, compression_level,
+           dedup, depth_delta, mode, snapshots, color_size, depth_size, seed, block_snapshots, as_json,
+           processes, max_connections, paths):
+    has_server = (host and port) or endpoints
+    if action == "upload-sample" and (has_server or dry_run) and len(paths) == 1:
+        upload_sample(host, int(port) if port else None, paths[0], workers=workers, window=window,
+                      batch_size=batch_size, batch_bytes=batch_bytes, transport=transport, resume=resume,
+                      passthrough=passthrough, read_ahead=read_ahead, retries=retries, stats_path=stats_path,
+                      stats_interval=stats_interval, dry_run=dry_run, endpoints=endpoints, sticky=sticky,
+                      compression=compression, compression_level=compression_level, dedup=dedup,
+                      depth_delta=depth_delta)
+    elif action == "convert" and len(paths) == 2 and block_snapshots > 0:
+        try:
+            count = convert_sample(paths[0], paths[1], block_snapshots)
+        except (OSError, ValueError) as e:
+            print("Error encountered:")
+            print("Could not convert {}: {}".format(paths[0], e))
+            sys.exit(1)
+        print("Converted {} snapshots into {}".format(count, paths[1]))
+    elif action == "bulk-upload" and has_server and len(paths) == 1:
+        report = upload_samples(host, int(port) if port else None, paths[0], processes=processes,
+                                max_connections=max_connections,
+                                workers=workers, window=window, batch_size=batch_size, batch_bytes=batch_bytes,
+                                transport=transport, resume=resume, passthrough=passthrough,
+                                read_ahead=read_ahead, retries=retries, endpoints=endpoints, sticky=sticky,
+                                compression=compression, compression_level=compression_level, dedup=dedup,
+                                depth_delta=depth_delta)
+        print_report(report)
+        if report["failed"]:
+            sys.exit(1)
+    elif action == "generate-sample" and len(paths) == 1 and snapshots >= 0:
+        generate_sample(paths[0], snapshots, color_size, depth_size, seed=seed)
+        print("Generated {} snapshots into {}".format(snapshots, paths[0]))
+    elif action == "benchmark" and len(paths) == 1:
+        summary = benchmark(paths[0], mode, workers=workers, window=window, batch_size=batch_size,
+                            batch_bytes=batch_bytes, passthrough=passthrough, read_ahead=read_ahead,
+                            stats_path=stats_path, stats_interval=stats_interval, compression=compression,
+                            compression_level=compression_level, dedup=dedup, depth_delta=depth_delta)
+        print(json.dumps(summary["stats"], indent=4))
+    elif action == "inspect" and len(paths) == 1:
+        try:
+            report = inspect_sample(paths[0], read_ahead)
+        except (OSError, ValueError) as e:
+            print("Error encountered:")
+            print("Could not inspect {}: {}".format(paths[0], e))
+            sys.exit(1)
+        if as_json:
+            print(json.dumps(report, indent=4))
+        else:
+            print_inspection(report)
     else:
         print(USAGE_ERROR)
         sys.exit(1)
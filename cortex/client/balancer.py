@@ -0,0 +1,108 @@
+import hashlib
+import logging
+import requests
+import threading
+import time
+
+EJECT_FAILURES = 3  # consecutive failures after which an endpoint is ejected
+EJECT_COOLDOWN = 10.0  # seconds an ejected endpoint is left alone before it is tried again
+THROTTLE_STATUSES = (429, 503)  # answers of an endpoint which sheds load, rather than of one which failed
+
+
+class EndpointPool:
+    """
+    This class spreads requests across several server endpoints ("host:port").
+    by default every request goes to the next healthy endpoint (round-robin). if `sticky` is True, all requests
+    with the same key (a user id) go to the same endpoint, chosen by rendezvous hashing: when an endpoint is
+    ejected or added, only the keys placed on it move, and every client places a key on the same endpoint.
+    an endpoint which fails `failures` times in a row (connection errors, timeouts or 5xx answers other than 503)
+    is ejected for `cooldown` seconds, and then tried again. if all endpoints are ejected, the one which returns
+    first is used. throttling answers (THROTTLE_STATUSES) are not failures: the endpoint is shedding load as
+    designed, and moving the request elsewhere would break sticky placement.
+    the pool is shared by the sending threads, so its state is locked.
+    """
+    def __init__(self, endpoints, sticky=False, failures=EJECT_FAILURES, cooldown=EJECT_COOLDOWN):
+        self.endpoints = list(endpoints)
+        self.sticky = sticky
+        self.failures = failures
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failed_in_row = {endpoint: 0 for endpoint in self.endpoints}
+        self.ejected_until = {endpoint: 0.0 for endpoint in self.endpoints}
+        self.next = 0
+
+    def healthy(self):
+        """
+        returns the endpoints which are not ejected, or the one which returns first if all of them are.
+        """
+        with self.lock:
+            return self._healthy()
+
+    def choose(self, key=None, exclude=()):
+        """
+        returns the endpoint for the next request with `key`, avoiding the endpoints in `exclude` (which already
+        failed it) while there are others.
+        """
+        with self.lock:
+            candidates = [endpoint for endpoint in self._healthy() if endpoint not in exclude] or self._healthy()
+            if self.sticky and key is not None:
+                return max(candidates, key=lambda endpoint: rendezvous_score(key, endpoint))
+            self.next += 1
+            return candidates[self.next % len(candidates)]
+
+    def request(self, send, key=None):
+        """
+        sends a request with `send(endpoint)`, which returns a response or raises a connection error.
+        if it fails (see failed), the request is sent to another endpoint, until every endpoint was tried.
+        throttling answers are returned as they are.
+        returns the last response, or raises the last connection error.
+        """
+        tried = []
+        while True:
+            endpoint = self.choose(key, tried)
+            tried.append(endpoint)
+            last = len(tried) >= len(self.endpoints)
+            try:
+                response = send(endpoint)
+            except (requests.ConnectionError, requests.Timeout):
+                self.failed(endpoint)
+                if last:
+                    raise
+                continue
+            if response.status_code in THROTTLE_STATUSES:
+                return response
+            if response.status_code < 500:
+                self.succeeded(endpoint)
+                return response
+            self.failed(endpoint)
+            if last:
+                return response
+
+    def succeeded(self, endpoint):
+        with self.lock:
+            self.failed_in_row[endpoint] = 0
+
+    def failed(self, endpoint):
+        """
+        counts a failure of `endpoint`, and ejects it for the cooldown if it failed too many times in a row.
+        """
+        with self.lock:
+            self.failed_in_row[endpoint] += 1
+            if self.failed_in_row[endpoint] >= self.failures:
+                self.failed_in_row[endpoint] = 0
+                self.ejected_until[endpoint] = time.monotonic() + self.cooldown
+                logging.warning("Ejected endpoint {} for {}s".format(endpoint, self.cooldown))
+
+    def _healthy(self):
+        now = time.monotonic()
+        healthy = [endpoint for endpoint in self.endpoints if self.ejected_until[endpoint] <= now]
+        return healthy or [min(self.endpoints, key=self.ejected_until.get)]
+
+
+def rendezvous_score(key, endpoint):
+    """
+    returns the rendezvous (highest random weight) score of an endpoint for a key. the hash is stable across
+    processes and machines, unlike the builtin hash of strings.
+    """
+    digest = hashlib.md5("{}/{}".format(key, endpoint).encode()).digest()
+    return int.from_bytes(digest[:8], "big")
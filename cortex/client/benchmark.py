@@ -0,0 +1,112 @@
+from .client import upload_sample, exit_run
+from .cortex_pb2 import *
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import gzip
+import json
+import random
+import struct
+import threading
+
+DEFAULT_SNAPSHOTS = 100
+DEFAULT_COLOR_SIZE = (1920, 1080)  # width, height of synthetic color images (the size of real samples)
+DEFAULT_DEPTH_SIZE = (224, 172)  # width, height of synthetic depth images (the size of real samples)
+SNAPSHOT_INTERVAL = 40  # milliseconds between synthetic snapshots
+DEPTH_RANGE = (0.5, 7.0)  # meters; the range of the synthetic scene, like real depth images
+DEPTH_NOISE = 0.003  # meters; synthetic depth values vary by up to this much between snapshots
+DEPTH_DROPOUT = 0.05  # the fraction of depth values which are missing (0.0) in every snapshot
+FIRST_DATETIME = 1575446887339
+BENCHMARK_MODES = ["sink", "http"]
+
+
+def generate_sample(path, snapshots=DEFAULT_SNAPSHOTS, color_size=DEFAULT_COLOR_SIZE, depth_size=DEFAULT_DEPTH_SIZE,
+                    user_id=42, seed=0):
+    """
+    writes a synthetic gzip sample file of `snapshots` snapshots, with color images of `color_size` and depth images
+    of `depth_size` (width, height). the content is pseudo-random but reproducible for a given `seed`: every color
+    image row is a shifted copy of a random row, so images compress about as well as real ones. depth images are
+    a static scene with sensor noise and missing values, so consecutive depth images are as close as real ones.
+    returns the number of snapshots written.
+    """
+    rng = random.Random(seed)
+    user_message = User()
+    user_message.user_id = user_id
+    user_message.username = "Synthetic User"
+    user_message.birthday = 699746400
+    user_message.gender = User.OTHER
+    color_width, color_height = color_size
+    depth_width, depth_height = depth_size
+    row_size = color_width * 3
+    base_row = rng.getrandbits(8 * row_size * 2).to_bytes(row_size * 2, "little")
+    scene = [rng.uniform(*DEPTH_RANGE) for _ in range(depth_width * depth_height)]
+
+    with gzip.open(path, "wb") as f:
+        serialized = user_message.SerializeToString()
+        f.write(struct.pack('I', len(serialized)) + serialized)
+        for index in range(snapshots):
+            snapshot = Snapshot()
+            snapshot.datetime = FIRST_DATETIME + index * SNAPSHOT_INTERVAL
+            snapshot.pose.translation.x, snapshot.pose.translation.y, snapshot.pose.translation.z = \
+                rng.random(), rng.random(), rng.random()
+            snapshot.pose.rotation.x, snapshot.pose.rotation.y, snapshot.pose.rotation.z, snapshot.pose.rotation.w = \
+                rng.random(), rng.random(), rng.random(), rng.random()
+            snapshot.color_image.width = color_width
+            snapshot.color_image.height = color_height
+            snapshot.color_image.data = b"".join(base_row[(shift := rng.randrange(row_size)):shift + row_size]
+                                                 for _ in range(color_height))
+            snapshot.depth_image.width = depth_width
+            snapshot.depth_image.height = depth_height
+            snapshot.depth_image.data.extend(0.0 if rng.random() < DEPTH_DROPOUT
+                                             else depth + rng.uniform(-DEPTH_NOISE, DEPTH_NOISE) for depth in scene)
+            snapshot.feelings.hunger, snapshot.feelings.thirst = rng.uniform(-1, 1), rng.uniform(-1, 1)
+            snapshot.feelings.exhaustion, snapshot.feelings.happiness = rng.uniform(-1, 1), rng.uniform(-1, 1)
+            serialized = snapshot.SerializeToString()
+            f.write(struct.pack('I', len(serialized)) + serialized)
+    return snapshots
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    a stand-in for the servers' REST API: acknowledges every user message, snapshot and batch without processing
+    it, and holds no snapshots.
+    """
+    protocol_version = "HTTP/1.1"  # keep-alive, like the Flask server behind a production WSGI server
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        body = json.dumps({"user_id": self.path.split("/")[-1].split("?")[0], "datetimes": []}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def benchmark(path, mode="sink", **options):
+    """
+    measures the client pipeline on a sample file, without a real server.
+    in "sink" mode snapshots are read and re-serialized, and then dropped (upload_sample with dry_run).
+    in "http" mode they are uploaded to a local stand-in server (StandInHandler), so the cost of HTTP is included.
+    the remaining keyword `options` are passed to upload_sample.
+    returns the upload summary, whose 'stats' hold the throughput and per-stage timings.
+    """
+    if mode not in BENCHMARK_MODES:
+        exit_run("Attempted use of unknown benchmark mode: {}".format(mode))
+    if mode == "sink":
+        return upload_sample(None, None, path, dry_run=True, **options)
+
+    stand_in = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    stand_in.daemon_threads = True
+    threading.Thread(target=stand_in.serve_forever, daemon=True).start()
+    try:
+        return upload_sample("127.0.0.1", stand_in.server_address[1], path, **options)
+    finally:
+        stand_in.shutdown()
+        stand_in.server_close()
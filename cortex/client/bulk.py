@@ -0,0 +1,113 @@
+from . import client
+from .client import upload_sample
+from .stats import STAGES
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import multiprocessing
+import os
+import time
+
+SAMPLE_PATTERNS = ["*.mind.gz", "*.mind"]  # sample files picked up from a directory
+DEFAULT_PROCESSES = os.cpu_count() or 1
+DEFAULT_MAX_CONNECTIONS = 32  # maximal number of connections to the server in use at once, by all processes
+
+
+def upload_samples(host, port, source, processes=DEFAULT_PROCESSES, max_connections=DEFAULT_MAX_CONNECTIONS,
+                   **options):
+    """
+    This function uploads many sample files (one per user) to the server.
+    `source` is a directory, whose sample files (SAMPLE_PATTERNS) are uploaded, or a glob pattern.
+    files are spread over a pool of `processes` processes, so decompression and parsing run on all cores.
+    every process uploads one file at a time with upload_sample, and the remaining keyword `options`
+    (workers, window, transport, etc.) are passed to it.
+    all processes share a semaphore of `max_connections` connections: a request (or a whole gRPC stream) is sent
+    only while it holds one, so the server never sees more than `max_connections` concurrent requests.
+    a progress line is printed as every file finishes, and an aggregated report is returned (see bulk_report).
+    """
+    paths = find_samples(source)
+    if not paths:
+        client.exit_run("No sample files found in {}".format(source))
+    if processes < 1 or max_connections < 1:
+        client.exit_run("Processes and connections must be positive: processes={}, max_connections={}"
+                        .format(processes, max_connections))
+
+    started_at = time.monotonic()
+    summaries = []
+    semaphore = multiprocessing.BoundedSemaphore(max_connections)
+    with ProcessPoolExecutor(max_workers=min(processes, len(paths)), initializer=init_process,
+                             initargs=(semaphore,)) as executor:
+        futures = [executor.submit(upload_file, host, port, path, options) for path in paths]
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries.append(summary)
+            if summary.get("failed"):
+                print("[{}/{}] {}: failed".format(len(summaries), len(paths), summary["path"]))
+            else:
+                print("[{}/{}] {}: {} snapshots in {:.2f}s".format(len(summaries), len(paths), summary["path"],
+                                                                   summary["snapshots"], summary["seconds"]))
+    return bulk_report(summaries, time.monotonic() - started_at)
+
+
+def find_samples(source):
+    """
+    returns the sorted paths of the sample files in directory `source`, or matching the glob pattern `source`.
+    """
+    if os.path.isdir(source):
+        paths = {path for pattern in SAMPLE_PATTERNS for path in glob.glob(os.path.join(source, pattern))}
+    else:
+        paths = set(glob.glob(source))
+    return sorted(path for path in paths if os.path.isfile(path))
+
+
+def init_process(semaphore):
+    """
+    initializes a bulk upload process: its uploads share the connection semaphore with all other processes.
+    """
+    client.CONNECTION_LIMIT = semaphore
+
+
+def upload_file(host, port, path, options):
+    """
+    uploads a single sample file in a bulk upload process. a failed upload exits through exit_run (which logs
+    the reason); it is reported as failed instead of stopping the process.
+    """
+    started_at = time.monotonic()
+    try:
+        return upload_sample(host, port, path, **options)
+    except SystemExit:
+        return {"path": path, "failed": True, "seconds": time.monotonic() - started_at}
+
+
+def bulk_report(summaries, seconds):
+    """
+    aggregates the upload summaries of a bulk upload that took `seconds` seconds: file, snapshot and byte counts,
+    the failed files, the snapshot and byte throughput, and the total time all processes spent in every stage.
+    """
+    uploaded = [summary for summary in summaries if not summary.get("failed")]
+    snapshots = sum(summary["snapshots"] for summary in uploaded)
+    sample_bytes = sum(summary["bytes"] for summary in uploaded)
+    return {
+        "files": len(summaries),
+        "uploaded": len(uploaded),
+        "failed": sorted(summary["path"] for summary in summaries if summary.get("failed")),
+        "snapshots": snapshots,
+        "skipped": sum(summary["skipped"] for summary in uploaded),
+        "bytes": sample_bytes,
+        "seconds": seconds,
+        "snapshots_per_second": snapshots / seconds if seconds else 0,
+        "megabytes_per_second": sample_bytes / 1e6 / seconds if seconds else 0,
+        "stage_seconds": {stage: sum(summary["stats"]["stages"][stage]["total_seconds"] for summary in uploaded)
+                          for stage in STAGES},
+    }
+
+
+def print_report(report):
+    print("Uploaded {} of {} files: {} snapshots ({} already on server), {:.1f} MB in {:.2f}s"
+          .format(report["uploaded"], report["files"], report["snapshots"], report["skipped"],
+                  report["bytes"] / 1e6, report["seconds"]))
+    print("Throughput: {:.1f} snapshots/s, {:.2f} MB/s".format(report["snapshots_per_second"],
+                                                                report["megabytes_per_second"]))
+    print("Time per stage: {}".format(", ".join("{} {:.2f}s".format(stage, seconds)
+                                                for stage, seconds in report["stage_seconds"].items())))
+    for path in report["failed"]:
+        print("Failed: {}".format(path))
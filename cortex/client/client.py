@@ -1,11 +1,26 @@
 from .cortex_pb2 import *
-from datetime import datetime
-import gzip
+from .cortex_pb2_grpc import CortexStub
+from .balancer import EndpointPool
+from .compression import RequestCompressor, ENCODINGS, LEVELS
+from .encoding import ColorDeduplicator, DepthDeltaEncoder, split_snapshot
+from .sample import open_sample, prefetch, validate_snapshot, DEFAULT_READ_AHEAD
+from .stats import UploadStats
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import contextlib
+import grpc
+import json
 import logging
 import os
+import random
 import requests
+import requests.adapters
 import struct
 import sys
+import threading
+import time
 
 
 def init_logger():
@@ -25,78 +40,705 @@ def init_logger():
 
 
 PROTOCOLS = ["ProtoBuf"]
+TRANSPORTS = ["http", "grpc"]
 USER_MESSAGE_API = "api/user_message"
 SNAPSHOT_MESSAGE_API = "api/snapshot_message"
+SNAPSHOT_BATCH_API = "api/snapshot_batch"
+HEADERS = {'Content-Type': 'application/octet-stream'}
+REQUEST_TIMEOUT = (1.5, 30.0)  # seconds to wait for a connection to the server, and for its answer to a request
+RETRY_STATUSES = {429, 502, 503, 504}  # the server (or a proxy in front of it) is overloaded: retry the request
+DEFAULT_RETRIES = 5  # number of times a request is retried before the upload fails
+BACKOFF_BASE = 0.1  # seconds; before retry n the client waits a random time between 0 and BACKOFF_BASE * 2^n
+BACKOFF_MAX = 30.0  # maximal number of seconds to wait before a retry, including the servers' Retry-After
+DEFAULT_WORKERS = 4  # number of threads posting snapshots concurrently
+DEFAULT_WINDOW = 16  # maximal number of snapshots sent to the server and not yet acknowledged
+GRPC_MAX_MESSAGE_LENGTH = 64 * 1024 * 1024  # snapshots with full color images exceed the 4MB gRPC default
+GRPC_OPTIONS = [('grpc.max_receive_message_length', GRPC_MAX_MESSAGE_LENGTH),
+                ('grpc.max_send_message_length', GRPC_MAX_MESSAGE_LENGTH)]
+CHECKPOINT_SUFFIX = ".checkpoint"  # checkpoints are saved next to the sample file, with this suffix
+CHECKPOINT_INTERVAL = 1.0  # minimal number of seconds between checkpoint saves
+CONNECTION_LIMIT = None  # a semaphore capping the connections in use at once, shared by bulk upload processes
 
+# a snapshot read from a sample file: its serialized data and datetime, and the position right after it.
+# for gzip sample files these are the uncompressed and compressed file offsets, and for indexed sample files
+# the offset inside the decompressed block and the offset of the block.
+# when snapshots are encoded (see cortex/client/encoding.py), it also holds their SnapshotParts.
+SnapshotRecord = namedtuple("SnapshotRecord", ["data", "datetime", "offset", "compressed_offset", "parts"],
+                            defaults=[None])
 
-def upload_sample(host, port, path, protocol="ProtoBuf"):
+
+def upload_sample(host, port, path, protocol="ProtoBuf", workers=DEFAULT_WORKERS, window=DEFAULT_WINDOW,
+                  batch_size=None, batch_bytes=None, transport="http", resume=False, passthrough=False,
+                  read_ahead=DEFAULT_READ_AHEAD, retries=DEFAULT_RETRIES, stats_path=None, stats_interval=None,
+                  dry_run=False, endpoints=None, sticky=False, compression=None, compression_level=None,
+                  dedup=False, depth_delta=False):
     """
     This function gets server details (host, port),
     a path to sample file, and a protocol.
+    instead of a single server, `endpoints` may list several servers ("host:port"): requests are then spread across
+    them, and failing endpoints are ejected for a while (see EndpointPool). if `sticky` is True, all the requests
+    of a user go to the same endpoint (while it is healthy); otherwise they go round-robin.
     the function deserializes the data according to the procotol, re-serializes it to the Cortex ProtoBuf format,
-    and sends it to the server. it operated on a single message each time, never reading more than one message
-    or snapshot from the file into the memory.
+    and sends it to the server. it reads a single message from the file each time.
     it sends the user message first and then loops over all snapshots.
+    all requests go through a single keep-alive HTTP session. snapshots are posted by `workers` threads,
+    with at most `window` requests in flight at once.
+    requests which time out, can't connect or are throttled by the server (RETRY_STATUSES) are retried up to
+    `retries` times, after the servers' Retry-After or a jittered exponential backoff (see send_request).
+    while the server is throttling, the window shrinks, and it grows back as requests succeed (see SnapshotUploader).
+    if `batch_size` or `batch_bytes` is given, snapshots are sent in batches of up to `batch_size` snapshots
+    or about `batch_bytes` bytes, one batch per request.
+    if `transport` is "grpc", the user message and all snapshots are streamed to the servers' gRPC endpoint
+    over a single call instead (workers, window and batches do not apply).
+    if `compression` ("deflate" or "xz") is given, request bodies are compressed at `compression_level` and sent
+    with a Content-Encoding header. compression turns itself off while it does not pay off (see RequestCompressor).
+    over gRPC, messages are compressed by gRPC itself, with deflate.
+    if `dedup` is True, a color image identical to the color image of an earlier snapshot which the server already
+    holds is not sent again: the snapshot references that earlier snapshot instead (see ColorDeduplicator).
+    if `depth_delta` is True, depth images are sent as quantized deltas against the previous depth image the server
+    holds (see DepthDeltaEncoder).
+    if `resume` is True, the upload continues from the checkpoint saved by a previous upload of the same file,
+    and snapshots the server already holds are not sent again (HTTP transport only).
+    if `passthrough` is True, snapshots are not re-serialized: since the ProtoBuf file format is the wire format,
+    only their framing and required fields are validated (see validate_snapshot) and their raw bytes are sent.
+    the sample file may be either a gzip sample file or an indexed one (see cortex/client/sample.py).
+    snapshots are read, decompressed and re-serialized on a background thread, up to `read_ahead` snapshots
+    ahead of sending (see prefetch), so the network does not wait for the next snapshot to be inflated and parsed.
+    if `read_ahead` is 0, snapshots are read on the sending thread.
+    the time spent reading, parsing, re-serializing and sending snapshots is measured (see UploadStats). a JSON
+    summary of it is printed every `stats_interval` seconds if given, and written to `stats_path` at the end
+    if given ("-" prints it).
+    if `dry_run` is True, snapshots are read and re-serialized as usual, but dropped instead of sent (host and port
+    are not needed), to measure the client pipeline without a server (see cortex/client/benchmark.py).
+    returns a summary of the upload: the path, user id, number of snapshots uploaded and skipped,
+    the sample file size, the number of seconds it took and its stats summary.
     """
     init_logger()
-    if host is None or port is None or path is None:
+    started_at = time.monotonic()
+    stats = UploadStats(stats_interval)
+    if path is None or (not dry_run and not endpoints and (host is None or port is None)):
         exit_run("Parameters can't be None: host={}, port={}, path={}".format(host, port, path))
+
     if protocol not in PROTOCOLS:
         exit_run("Attempted use of unknown protocol: {}".format(protocol))
 
+    if transport not in TRANSPORTS:
+        exit_run("Attempted use of unknown transport: {}".format(transport))
+
+    if workers < 1 or window < 1:
+        exit_run("Workers and window must be positive: workers={}, window={}".format(workers, window))
+
+    if (batch_size is not None and batch_size < 1) or (batch_bytes is not None and batch_bytes < 1):
+        exit_run("Batch limits must be positive: batch_size={}, batch_bytes={}".format(batch_size, batch_bytes))
+
+    if read_ahead < 0 or retries < 0:
+        exit_run("Read-ahead and retries can't be negative: read_ahead={}, retries={}".format(read_ahead, retries))
+
+    if compression is not None and compression not in ENCODINGS:
+        exit_run("Attempted use of unknown compression: {}".format(compression))
+
+    if compression_level is not None and compression_level not in LEVELS:
+        exit_run("Compression level must be between {} and {}: {}".format(LEVELS[0], LEVELS[-1], compression_level))
+
+    if (dedup or depth_delta) and passthrough:
+        exit_run("Snapshots can't be encoded (dedup, depth_delta) in passthrough mode")
+
+    if (dedup or depth_delta) and endpoints and len(endpoints) > 1 and not sticky:
+        exit_run("Snapshots can only be encoded (dedup, depth_delta) across several endpoints with sticky placement")
+
+    if resume and transport != "http":
+        exit_run("Resumable uploads are only supported over HTTP")
+
     if protocol == "ProtoBuf":
-        sample_file = ""
         try:
-            sample_file = gzip.open(path, 'rb')
+            sample = open_sample(path)
         except FileNotFoundError as e:
             exit_run("Sample file not found: {}".format(path))
+        except ValueError as e:
+            exit_run("Malformed sample file {}: {}".format(path, e))
 
         # deserialize user data from sample file, and reserialize it into a new ProtoBuf User() message
-        user_message_size = struct.unpack('I', sample_file.read(4))[0]
-
-        raw_message = sample_file.read(user_message_size)
+        raw_message = sample.user
         new_serialized_message = reserialize_user(raw_message, protocol)
         new_user_message = User()
         new_user_message.ParseFromString(new_serialized_message)
 
-        # send user message data to server
-        user_message_url = "http://{}:{}/{}/{}".format(host, port, USER_MESSAGE_API, new_user_message.user_id)
-        headers = {'Content-Type': 'application/octet-stream'}
+        compressor = RequestCompressor(compression, compression_level) if compression else None
+        encoders = ([ColorDeduplicator()] if dedup else []) + ([DepthDeltaEncoder()] if depth_delta else [])
+        if dry_run:
+            count = 0
+            snapshots = read_snapshots(sample.frames(), protocol, passthrough, stats, bool(encoders))
+            for record in prefetch(snapshots, read_ahead) if read_ahead else snapshots:
+                record = encode_snapshot(record, encoders, stats)
+                for encoder in encoders:
+                    encoder.held(record)
+                data = record.data
+                if compressor:
+                    with stats.timer("compress"):
+                        data, _ = compressor.encode(data, HEADERS)
+                # the sink accepts every snapshot at once
+                stats.add("send", 0.0, 1, len(data))
+                count += 1
+            sample.close()
+            return upload_summary(path, new_user_message.user_id, count, 0, started_at, stats, stats_path, compressor,
+                                  encoders)
+
+        endpoints = EndpointPool(endpoints or ["{}:{}".format(host, port)], sticky)
+        if transport == "grpc":
+            # a stream is a single call, so it goes to a single endpoint
+            host, _, port = endpoints.choose(new_user_message.user_id).rpartition(":")
+            snapshots = read_snapshots(sample.frames(), protocol, passthrough, stats, bool(encoders))
+            count = stream_sample(host, port, new_serialized_message,
+                                  prefetch(snapshots, read_ahead) if read_ahead else snapshots, stats,
+                                  compression is not None, encoders)
+            sample.close()
+            logging.debug("Finished uploading snapshots for user {}. Number of snapshots: {}"
+                          .format(new_user_message.user_id, count))
+            return upload_summary(path, new_user_message.user_id, count, 0, started_at, stats, stats_path, None,
+                                  encoders)
+
+        # send user message data to server. it is sent before any snapshot, and must be acknowledged first.
+        session = create_session(workers, len(endpoints.endpoints))
+        user_message_path = "{}/{}".format(USER_MESSAGE_API, new_user_message.user_id)
+        user_body, user_headers = compressor.encode(new_serialized_message, HEADERS) if compressor \
+            else (new_serialized_message, HEADERS)
         try:
-            send = requests.post(user_message_url, data=new_serialized_message, headers=headers, timeout=1.5)
+            send = endpoints.request(lambda endpoint: send_request(session, "POST",
+                                                                   endpoint_url(endpoint, user_message_path),
+                                                                   retries, data=user_body, headers=user_headers),
+                                     new_user_message.user_id)
             logging.debug("Sent user message ({}, {}): return code {}".format(new_user_message.username,
                                                                               new_user_message.user_id,
                                                                               send.status_code))
         except Exception as e:
             exit_run("Could not send user message to server: {}".format(e))
 
-        count = 1
-        while len(snapshot_size_bin := sample_file.read(4)) > 0:
-
-            # read snapshot, re-serialize it to the ProtoBuf, and send it to the server
-            snapshot_size = struct.unpack('I', snapshot_size_bin)[0]
-            raw_message = sample_file.read(snapshot_size)
-            new_serialized_snapshot = reserialize_snapshot(raw_message, protocol)
-            new_snapshot = Snapshot()
-            new_snapshot.ParseFromString(new_serialized_snapshot)
-            snapshot_message_url = "http://{}:{}/{}/{}".format(host, port, SNAPSHOT_MESSAGE_API,
-                                                               new_user_message.user_id)
-            headers = {'Content-Type': 'application/octet-stream'}
-            try:
-                send = requests.post(snapshot_message_url, data=new_serialized_snapshot, headers=headers, timeout=1.5)
-                logging.debug("Sent user {} ({}) Snapshot #{}: return code {}".format(new_user_message.username,
-                                                                                      new_user_message.user_id,
-                                                                                      new_snapshot.datetime,
-                                                                                      send.status_code))
-
-                print("Snapshot {} uploaded ({}, {})".format(count, new_user_message.username,
-                                                             new_user_message.user_id))
-            except Exception as e:
-                exit_run("Could not send snapshot message to server: {}".format(e))
+        # every acknowledged snapshot advances the checkpoint, so a failed upload can be resumed later
+        checkpoint = Checkpoint(path, new_user_message.user_id)
+        held = set()
+        offset = compressed_offset = 0
+        if resume:
+            if checkpoint.load():
+                logging.debug("Resuming upload of {} after snapshot {} (offset {})"
+                              .format(path, checkpoint.datetime, checkpoint.offset))
+                offset, compressed_offset = checkpoint.offset, checkpoint.compressed_offset
+            held = held_datetimes(session, endpoints, new_user_message.user_id, checkpoint.datetime or 0, retries)
+
+        uploader = SnapshotUploader(session, endpoints, new_user_message, workers, window, batch_size, batch_bytes,
+                                    checkpoint, retries, stats, compressor, encoders)
+        snapshots = read_snapshots(sample.frames(offset, compressed_offset), protocol, passthrough, stats,
+                                   bool(encoders))
+        try:
+            for record in prefetch(snapshots, read_ahead) if read_ahead else snapshots:
+                if record.datetime in held:
+                    uploader.skip(record)
+                else:
+                    uploader.submit(record)
+        except ValueError as e:
+            uploader.close()
+            sample.close()
+            checkpoint.save()
+            exit_run("Malformed sample file {}: {}".format(path, e))
+
+        uploader.close()
+        sample.close()
+        session.close()
+        checkpoint.remove()
+        logging.debug("Finished uploading snapshots for user {}. Number of snapshots: {} ({} already on server, "
+                      "{} throttled requests)".format(new_user_message.user_id, uploader.count, uploader.skipped,
+                                                      uploader.throttled))
+        return upload_summary(path, new_user_message.user_id, uploader.count, uploader.skipped, started_at, stats,
+                              stats_path, compressor, encoders)
+
+
+def upload_summary(path, user_id, snapshots, skipped, started_at, stats, stats_path=None, compressor=None,
+                   encoders=()):
+    """
+    summarizes a finished upload, as returned by upload_sample. the stats summary (with the summaries of the
+    compression and the snapshot encoders, if they were used) is logged, and written as JSON to `stats_path`
+    if given ("-" prints it).
+    """
+    stats_summary = stats.summary()
+    if compressor:
+        stats_summary["compression"] = compressor.summary()
+    for encoder in encoders:
+        stats_summary[encoder.name] = encoder.summary()
+    logging.debug("Upload stats of {}: {}".format(path, json.dumps(stats_summary)))
+    if stats_path == "-":
+        print(json.dumps(stats_summary, indent=4))
+    elif stats_path:
+        try:
+            with open(stats_path, "w") as f:
+                json.dump(stats_summary, f, indent=4)
+        except OSError as e:
+            logging.error("Could not write upload stats to {}: {}".format(stats_path, e))
+    return {
+        "path": path,
+        "user_id": user_id,
+        "snapshots": snapshots,
+        "skipped": skipped,
+        "bytes": os.path.getsize(path),
+        "seconds": time.monotonic() - started_at,
+        "stats": stats_summary,
+    }
+
+
+def send_request(session, method, url, retries=DEFAULT_RETRIES, on_throttle=None, **kwargs):
+    """
+    sends a request over the session, and retries it up to `retries` times if it times out, can't connect,
+    or the server answers with one of RETRY_STATUSES. before every retry the client waits for the servers'
+    Retry-After if it sent one, and otherwise for a jittered exponential backoff (see backoff), so many clients
+    throttled at once do not retry in lockstep. a connection (see connection_slot) is held only while sending.
+    `on_throttle` is called whenever the server signals overload: a throttling status or a timeout.
+    returns the last response, or raises the last connection error once the retries are exhausted.
+    """
+    for attempt in range(retries + 1):
+        try:
+            with connection_slot():
+                response = session.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries:
+                raise
+            if on_throttle and isinstance(e, requests.Timeout):
+                on_throttle()
+            delay = backoff(attempt)
+            logging.debug("{} {} failed ({}), retrying in {:.2f}s".format(method, url, e, delay))
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            if on_throttle:
+                on_throttle()
+            delay = retry_after(response)
+            if delay is None:
+                delay = backoff(attempt)
+            logging.debug("{} {} returned {}, retrying in {:.2f}s".format(method, url, response.status_code, delay))
+        time.sleep(delay)
+
+
+def backoff(attempt):
+    """
+    returns the number of seconds to wait before retry number `attempt` (starting at 0): a random time between 0
+    and an exponentially growing limit, capped at BACKOFF_MAX ("full jitter").
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def retry_after(response):
+    """
+    returns the number of seconds the server asked to wait in the Retry-After header of a response (either seconds
+    or an HTTP date), capped at BACKOFF_MAX. returns None if there is no valid Retry-After header.
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), BACKOFF_MAX)
+
+
+def connection_slot():
+    """
+    returns a context which holds one of the connections allowed by CONNECTION_LIMIT while it is entered.
+    without a limit, the context does nothing.
+    """
+    return CONNECTION_LIMIT or contextlib.nullcontext()
+
+
+def read_snapshots(frames, protocol="ProtoBuf", passthrough=False, stats=None, split=False):
+    """
+    a generator which turns the (serialized snapshot, offset, compressed offset) frames read from a sample file
+    (see GzipSample.frames and IndexedSample.frames) into SnapshotRecords.
+    every snapshot is re-serialized to the Cortex ProtoBuf format.
+    in passthrough mode, snapshots are validated and yielded as read from the file.
+    if `split` is True, records also hold the snapshot split into SnapshotParts, for the snapshot encoders
+    (see cortex/client/encoding.py), so the splitting and hashing is done here, off the sending thread.
+    the time spent reading, parsing and re-serializing is added to `stats` (UploadStats), if given.
+    raises ValueError if the file is truncated or a snapshot is malformed.
+    """
+    stats = stats or UploadStats()
+    frames = iter(frames)
+    while True:
+        with stats.timer("read"):
+            item = next(frames, None)
+        if item is None:
+            return
+        raw_message, offset, compressed_offset = item
+
+        if passthrough:
+            with stats.timer("parse"):
+                snapshot_datetime = validate_snapshot(raw_message)
+            yield SnapshotRecord(raw_message, snapshot_datetime, offset, compressed_offset)
+            continue
+
+        with stats.timer("parse"):
+            old_snapshot = parse_snapshot(raw_message, protocol)
+        with stats.timer("reserialize"):
+            new_snapshot = convert_snapshot(old_snapshot)
+            if split:
+                parts = split_snapshot(new_snapshot)
+                record = SnapshotRecord(parts.base + parts.color + parts.depth, new_snapshot.datetime, offset,
+                                        compressed_offset, parts)
+            else:
+                record = SnapshotRecord(new_snapshot.SerializeToString(), new_snapshot.datetime, offset,
+                                        compressed_offset)
+        yield record
+
+
+def encode_snapshot(record, encoders, stats):
+    """
+    returns a snapshot record encoded by all `encoders` (see cortex/client/encoding.py), timing the encoding.
+    """
+    if not encoders:
+        return record
+    with stats.timer("encode"):
+        for encoder in encoders:
+            record = encoder.encode(record)
+    return record
+
+
+def held_datetimes(session, endpoints, user_id, since=0, retries=DEFAULT_RETRIES):
+    """
+    asks the server which snapshots (datetimes) of the user it already holds, starting at datetime `since`.
+    `endpoints` is a server URL or an EndpointPool: snapshots may have been sent to any of the endpoints,
+    so every healthy endpoint is asked. returns them as a set.
+    """
+    if not isinstance(endpoints, EndpointPool):
+        endpoints = EndpointPool([endpoints])
+    held = set()
+    for endpoint in endpoints.healthy():
+        url = endpoint_url(endpoint, "{}/{}".format(SNAPSHOT_MESSAGE_API, user_id))
+        try:
+            response = send_request(session, "GET", url, retries, params={"since": since})
+            response.raise_for_status()
+            held.update(response.json()["datetimes"])
+        except Exception as e:
+            exit_run("Could not get stored snapshots of user {} from server {}: {}".format(user_id, endpoint, e))
+    return held
+
+
+def endpoint_url(endpoint, path):
+    """
+    returns the URL of an API path on an endpoint ("host:port", or a server URL).
+    """
+    if "://" not in endpoint:
+        endpoint = "http://{}".format(endpoint)
+    return "{}/{}".format(endpoint, path)
+
+
+class Checkpoint:
+    """
+    This class persists the progress of an upload next to the sample file (<path>.checkpoint, as JSON).
+    it holds the uncompressed and compressed file offsets right after the last acknowledged snapshot,
+    along with that snapshots' datetime. since snapshots are acknowledged in file order, every snapshot before
+    the checkpoint reached the server.
+    gzip streams can only be resumed by uncompressed offset (inflating, but not parsing or sending, the data up to
+    it), while indexed sample files are resumed at the exact block (compressed offset) and position inside it.
+    """
+    def __init__(self, sample_path, user_id):
+        self.path = "{}{}".format(sample_path, CHECKPOINT_SUFFIX)
+        self.sample_size = os.path.getsize(sample_path)
+        self.user_id = user_id
+        self.offset = 0
+        self.compressed_offset = 0
+        self.datetime = None
+        self.count = 0
+        self.saved_at = 0
+
+    def load(self):
+        """
+        loads a saved checkpoint. returns False if there is none, or if it was saved for a different file.
+        """
+        try:
+            with open(self.path, "r") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if saved.get("user_id") != self.user_id or saved.get("sample_size") != self.sample_size:
+            logging.debug("Ignoring checkpoint {}: it does not match the sample file".format(self.path))
+            return False
+        self.offset = saved["offset"]
+        self.compressed_offset = saved["compressed_offset"]
+        self.datetime = saved["datetime"]
+        self.count = saved["count"]
+        return True
+
+    def advance(self, record):
+        """
+        moves the checkpoint past an acknowledged snapshot. saves it at most once every CHECKPOINT_INTERVAL seconds.
+        """
+        self.offset = record.offset
+        self.compressed_offset = record.compressed_offset
+        self.datetime = record.datetime
+        self.count += 1
+        if time.monotonic() - self.saved_at >= CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self):
+        saved = {
+            "user_id": self.user_id,
+            "sample_size": self.sample_size,
+            "offset": self.offset,
+            "compressed_offset": self.compressed_offset,
+            "datetime": self.datetime,
+            "count": self.count,
+        }
+        try:
+            with open("{}.tmp".format(self.path), "w") as f:
+                json.dump(saved, f)
+            os.replace("{}.tmp".format(self.path), self.path)
+            self.saved_at = time.monotonic()
+        except OSError as e:
+            logging.error("Could not save checkpoint {}: {}".format(self.path, e))
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def stream_sample(host, port, serialized_user, snapshots, stats=None, compress=False, encoders=()):
+    """
+    uploads a serialized user message, followed by the snapshots (SnapshotRecord) from `snapshots`,
+    over a single gRPC client-streaming call to the server. gRPC pulls the next snapshot only after the previous
+    one was written to the stream, so the file is read no faster than the server (HTTP/2 flow control) accepts it.
+    the time gRPC takes to accept every snapshot is added to `stats` (UploadStats) as its send time, if given.
+    if `compress` is True, gRPC compresses the messages with deflate.
+    snapshots are encoded by the `encoders` (see cortex/client/encoding.py), if given. the server handles the
+    messages of a stream in order, so every snapshot streamed before is already held when the next one arrives.
+    returns the number of snapshots the server reports it received.
+    """
+    stats = stats or UploadStats()
+    user_message = User()
+    user_message.ParseFromString(serialized_user)
+
+    def messages():
+        yield UploadMessage(user=serialized_user)
+        count = 0
+        for record in snapshots:
+            record = encode_snapshot(record, encoders, stats)
+            for encoder in encoders:
+                encoder.held(record)
+            started = time.perf_counter()
+            yield UploadMessage(snapshot=record.data)
+            stats.add("send", time.perf_counter() - started, 1, len(record.data))
             count += 1
+            logging.debug("Streamed user {} ({}) Snapshot #{}".format(user_message.username, user_message.user_id,
+                                                                      record.datetime))
+            print("Snapshot {} uploaded ({}, {})".format(count, user_message.username, user_message.user_id))
+
+    channel = grpc.insecure_channel("{}:{}".format(host, port), options=GRPC_OPTIONS,
+                                    compression=grpc.Compression.Deflate if compress else None)
+    try:
+        with connection_slot():
+            summary = CortexStub(channel).UploadSample(messages())
+    except grpc.RpcError as e:
+        exit_run("Could not stream sample to server: {}".format(e))
+    finally:
+        channel.close()
+    return summary.snapshots
+
+
+def create_session(pool_size, servers=1):
+    """
+    creates a keep-alive HTTP session which holds up to `pool_size` open connections to each of `servers` servers.
+    the session is shared by all sending threads, so every request reuses an established TCP connection
+    instead of paying for a new handshake.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=servers, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    return session
+
+
+class SnapshotUploader:
+    """
+    This class posts the snapshots of a single user to the server.
+    `endpoints` is the server URL, or an EndpointPool which picks the endpoint of every request (see
+    EndpointPool.request), keyed by the user id.
+    snapshots are sent concurrently by a pool of threads over a shared session, while at most `window` requests
+    are in flight. acknowledgements are collected in submission order, so snapshots are reported as uploaded
+    in the same order they appear in the sample file, and a failure always stops the upload at the earliest
+    snapshot that did not arrive. every acknowledged snapshot advances the checkpoint, if one is given.
+    only acknowledgements are ordered: requests complete in any order, so the server receives (and stores and
+    publishes) the snapshots in flight in any order, and consumers must not rely on their arrival order.
+    if `batch_size` (snapshots) or `batch_bytes` (bytes) is given, snapshots are grouped into batches,
+    each sent in a single request to the batch API, and closed as soon as either limit is reached.
+    requests are retried up to `retries` times (see send_request), and their send times are added to `stats`.
+    if a `compressor` (RequestCompressor) is given, request bodies are compressed by the sending threads.
+    snapshots are encoded by the `encoders` (see cortex/client/encoding.py), if given, against the snapshots the
+    server acknowledged.
+    the number of requests in flight adapts to the server load (additive increase, multiplicative decrease):
+    it is halved when the server throttles a request, at most once per window of requests, and grows by about
+    one request per window of successful requests, up to `window`. a fleet of uploaders thus converges on the
+    throughput the server can sustain.
+    """
+    def __init__(self, session, endpoints, user_message, workers=DEFAULT_WORKERS, window=DEFAULT_WINDOW,
+                 batch_size=None, batch_bytes=None, checkpoint=None, retries=DEFAULT_RETRIES, stats=None,
+                 compressor=None, encoders=()):
+        self.session = session
+        self.endpoints = endpoints if isinstance(endpoints, EndpointPool) else EndpointPool([endpoints])
+        self.snapshot_path = "{}/{}".format(SNAPSHOT_MESSAGE_API, user_message.user_id)
+        self.batch_path = "{}/{}".format(SNAPSHOT_BATCH_API, user_message.user_id)
+        self.user_message = user_message
+        self.window = window
+        self.limit = float(window)  # the adaptive window: number of requests currently allowed in flight
+        self.retries = retries
+        self.stats = stats or UploadStats()
+        self.compressor = compressor
+        self.encoders = encoders
+        self.lock = threading.Lock()  # guards the adaptive window, which is updated by the sending threads
+        self.sequence = 0  # number of requests sent so far
+        self.recovery = 0  # requests sent up to this one were in flight when the window was last shrunk
+        self.throttled = 0
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.checkpoint = checkpoint
+        self.batch = []  # frames of the batch being built
+        self.batch_records = []  # records of the batch being built, including skipped ones
+        self.batch_length = 0
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.in_flight = deque()  # (future, records in the request), in submission order
+        self.count = checkpoint.count if checkpoint else 0
+        self.skipped = 0
 
-        logging.debug("Finished uploading snapshots for user {}. Number of snapshots: {}"
-                      .format(new_user_message.user_id, count))
+    def submit(self, record):
+        """
+        schedules a snapshot (SnapshotRecord) for sending. blocks while the window is full.
+        """
+        if self.encoders:
+            # acknowledge finished requests first, so their snapshots can be referenced
+            while self.in_flight and (self.in_flight[0][0] is None or self.in_flight[0][0].done()):
+                self._acknowledge()
+            record = encode_snapshot(record, self.encoders, self.stats)
+        if not self.batch_size and not self.batch_bytes:
+            self._send(self.snapshot_path, record.data, [record])
+            return
+
+        self.batch.append(frame(record.data))
+        self.batch_records.append(record)
+        self.batch_length += len(self.batch[-1])
+        if (self.batch_size and len(self.batch) >= self.batch_size) or \
+                (self.batch_bytes and self.batch_length >= self.batch_bytes):
+            self._flush()
+
+    def skip(self, record):
+        """
+        marks a snapshot the server already holds. it is acknowledged in turn, without being sent.
+        """
+        record = record._replace(data=None)
+        if self.batch_records:
+            self.batch_records.append(record)
+        else:
+            self.in_flight.append((None, [record]))
+
+    def close(self):
+        """
+        sends the last partial batch, and waits for all requests in flight to be acknowledged.
+        """
+        self._flush()
+        while self.in_flight:
+            self._acknowledge()
+        self.executor.shutdown()
+
+    def _flush(self):
+        if self.batch:
+            self._send(self.batch_path, b"".join(self.batch), self.batch_records)
+        elif self.batch_records:
+            self.in_flight.append((None, self.batch_records))
+        self.batch = []
+        self.batch_records = []
+        self.batch_length = 0
+
+    def _send(self, path, data, records):
+        while len(self.in_flight) >= int(self.limit):
+            self._acknowledge()
+        self.sequence += 1
+        future = self.executor.submit(self._post, path, data, self.sequence, len(records))
+        self.in_flight.append((future, records))
+
+    def _post(self, path, data, sequence, snapshots):
+        headers = HEADERS
+        if self.compressor:
+            with self.stats.timer("compress"):
+                data, headers = self.compressor.encode(data, headers)
+        started = time.perf_counter()
+
+        def post(endpoint):
+            return send_request(self.session, "POST", endpoint_url(endpoint, path), self.retries,
+                                lambda: self._throttle(sequence), data=data, headers=headers)
+
+        send = self.endpoints.request(post, self.user_message.user_id)
+        if send.ok:
+            self.stats.add("send", time.perf_counter() - started, snapshots, len(data))
+            self._grow()
+        return send
+
+    def _throttle(self, sequence):
+        with self.lock:
+            self.throttled += 1
+            # requests sent before the last decrease report the same congestion, so they do not shrink it again
+            if sequence > self.recovery:
+                self.limit = max(1.0, self.limit / 2)
+                self.recovery = self.sequence
+                logging.debug("Server is throttling, window shrunk to {}".format(int(self.limit)))
+
+    def _grow(self):
+        with self.lock:
+            self.limit = min(float(self.window), self.limit + 1 / self.limit)
+
+    def _acknowledge(self):
+        future, records = self.in_flight.popleft()
+        if future is None:
+            for record in records:
+                self._advance(record)
+                self.skipped += 1
+                logging.debug("Snapshot {} of user {} is already on the server".format(record.datetime,
+                                                                                        self.user_message.user_id))
+            return
+
+        try:
+            send = future.result()
+            if not send.ok:
+                raise requests.HTTPError("server returned {} for snapshots {}"
+                                         .format(send.status_code, [record.datetime for record in records]))
+        except Exception as e:
+            self._abort()
+            exit_run("Could not send snapshot message to server: {}".format(e))
+        for record in records:
+            self._advance(record)
+            logging.debug("Sent user {} ({}) Snapshot #{}: return code {}".format(self.user_message.username,
+                                                                                  self.user_message.user_id,
+                                                                                  record.datetime,
+                                                                                  send.status_code))
+            print("Snapshot {} uploaded ({}, {})".format(self.count, self.user_message.username,
+                                                         self.user_message.user_id))
+
+    def _advance(self, record):
+        self.count += 1
+        for encoder in self.encoders:
+            encoder.held(record)
+        if self.checkpoint:
+            self.checkpoint.advance(record)
+
+    def _abort(self):
+        if self.checkpoint:
+            self.checkpoint.save()
+        for future, _ in self.in_flight:
+            if future:
+                future.cancel()
+        self.in_flight.clear()
+        self.executor.shutdown(wait=False)
+
+
+def frame(message):
+    """
+    prefixes a serialized message with its size, the way messages are framed inside sample files and batches.
+    """
+    return struct.pack('I', len(message)) + message
 
 
 def reserialize_user(raw_message, protocol="ProtoBuf"):
@@ -124,38 +766,50 @@ def reserialize_snapshot(raw_message, protocol="ProtoBuf"):
     it deserializes the snapshot according to the mentioned protocol, spreads it to memory,
     and produces a new serialized snapshot according to the Cortex ProtoBuf format.
     """
+    return convert_snapshot(parse_snapshot(raw_message, protocol)).SerializeToString()
 
-    if protocol == "ProtoBuf":
 
+def parse_snapshot(raw_message, protocol="ProtoBuf"):
+    """
+    deserializes a snapshot according to the mentioned protocol.
+    """
+    if protocol == "ProtoBuf":
         old_snapshot = Snapshot()
         old_snapshot.ParseFromString(raw_message)
-        snapshot_message = Snapshot()
+        return old_snapshot
+
+
+def convert_snapshot(old_snapshot):
+    """
+    copies a deserialized snapshot into a new Cortex ProtoBuf Snapshot() message.
+    """
+    snapshot_message = Snapshot()
 
-        snapshot_message.datetime = old_snapshot.datetime
+    snapshot_message.datetime = old_snapshot.datetime
 
-        snapshot_message.pose.translation.x = old_snapshot.pose.translation.x
-        snapshot_message.pose.translation.y = old_snapshot.pose.translation.y
-        snapshot_message.pose.translation.z = old_snapshot.pose.translation.z
+    snapshot_message.pose.translation.x = old_snapshot.pose.translation.x
+    snapshot_message.pose.translation.y = old_snapshot.pose.translation.y
+    snapshot_message.pose.translation.z = old_snapshot.pose.translation.z
 
-        snapshot_message.pose.rotation.x = old_snapshot.pose.rotation.x
-        snapshot_message.pose.rotation.y = old_snapshot.pose.rotation.y
-        snapshot_message.pose.rotation.z = old_snapshot.pose.rotation.z
-        snapshot_message.pose.rotation.w = old_snapshot.pose.rotation.w
+    snapshot_message.pose.rotation.x = old_snapshot.pose.rotation.x
+    snapshot_message.pose.rotation.y = old_snapshot.pose.rotation.y
+    snapshot_message.pose.rotation.z = old_snapshot.pose.rotation.z
+    snapshot_message.pose.rotation.w = old_snapshot.pose.rotation.w
 
-        snapshot_message.color_image.width = old_snapshot.color_image.width
-        snapshot_message.color_image.height = old_snapshot.color_image.height
-        snapshot_message.color_image.data = old_snapshot.color_image.data
+    snapshot_message.color_image.width = old_snapshot.color_image.width
+    snapshot_message.color_image.height = old_snapshot.color_image.height
+    snapshot_message.color_image.data = old_snapshot.color_image.data
 
-        snapshot_message.depth_image.width = old_snapshot.depth_image.width
-        snapshot_message.depth_image.height = old_snapshot.depth_image.height
-        snapshot_message.depth_image.data.extend(old_snapshot.depth_image.data)
+    snapshot_message.depth_image.width = old_snapshot.depth_image.width
+    snapshot_message.depth_image.height = old_snapshot.depth_image.height
+    snapshot_message.depth_image.data.extend(old_snapshot.depth_image.data)
 
-        snapshot_message.feelings.hunger = old_snapshot.feelings.hunger
-        snapshot_message.feelings.thirst = old_snapshot.feelings.thirst
-        snapshot_message.feelings.exhaustion = old_snapshot.feelings.exhaustion
-        snapshot_message.feelings.happiness = old_snapshot.feelings.happiness
+    snapshot_message.feelings.hunger = old_snapshot.feelings.hunger
+    snapshot_message.feelings.thirst = old_snapshot.feelings.thirst
+    snapshot_message.feelings.exhaustion = old_snapshot.feelings.exhaustion
+    snapshot_message.feelings.happiness = old_snapshot.feelings.happiness
 
-        return snapshot_message.SerializeToString()
+    return snapshot_message
 
 
 def exit_run(message):
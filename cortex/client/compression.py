@@ -0,0 +1,78 @@
+import logging
+import lzma
+import threading
+import zlib
+
+# Content-Encoding name: (compress function, default level)
+ENCODINGS = {
+    "deflate": (lambda data, level: zlib.compress(data, level), 6),
+    "xz": (lambda data, level: lzma.compress(data, preset=level), 1),
+}
+LEVELS = range(10)  # compression levels of zlib, and presets of lzma
+MAX_RATIO = 0.9  # compression pays off only if it saves more than 10% of the bytes
+RATIO_WEIGHT = 0.2  # weight of the newest request in the moving average of the compression ratio
+PROBE_INTERVAL = 50  # while compression is off, every PROBE_INTERVAL-th request is still compressed, to re-measure
+
+
+class RequestCompressor:
+    """
+    This class compresses request bodies with a Content-Encoding of ENCODINGS ("deflate" is zlib, "xz" is lzma),
+    at compression `level` (or the encodings' default).
+    it keeps a moving average of the compression ratio (compressed size / original size). while the ratio is above
+    MAX_RATIO, compression does not pay for its CPU time, so bodies are sent as they are; one request in every
+    PROBE_INTERVAL is still compressed to follow the ratio, and compression turns back on once it pays off again.
+    bodies are compressed by the sending threads, so the ratio is locked.
+    """
+    def __init__(self, encoding, level=None):
+        if encoding not in ENCODINGS:
+            raise ValueError("unsupported encoding: {}".format(encoding))
+        if level is not None and level not in LEVELS:
+            raise ValueError("compression level must be between {} and {}: {}".format(LEVELS[0], LEVELS[-1], level))
+        self.encoding = encoding
+        self.compress, default_level = ENCODINGS[encoding]
+        self.level = default_level if level is None else level
+        self.lock = threading.Lock()
+        self.ratio = 0.0  # optimistic until measured
+        self.requests = 0
+        self.original_bytes = 0
+        self.compressed_bytes = 0
+
+    @property
+    def enabled(self):
+        return self.ratio <= MAX_RATIO
+
+    def encode(self, data, headers):
+        """
+        returns the body to send and its headers: compressed with Content-Encoding, or as they are.
+        """
+        with self.lock:
+            self.requests += 1
+            probe = self.enabled or self.requests % PROBE_INTERVAL == 0
+        if not probe or not data:
+            return data, headers
+
+        compressed = self.compress(data, self.level)
+        with self.lock:
+            was_enabled = self.enabled
+            self.ratio = (1 - RATIO_WEIGHT) * self.ratio + RATIO_WEIGHT * len(compressed) / len(data) \
+                if self.original_bytes else len(compressed) / len(data)
+            self.original_bytes += len(data)
+            self.compressed_bytes += len(compressed)
+            if was_enabled != self.enabled:
+                logging.debug("{} compression turned {} (ratio {:.2f})".format(self.encoding,
+                                                                              "on" if self.enabled else "off",
+                                                                              self.ratio))
+        if len(compressed) >= len(data):
+            return data, headers
+        return compressed, dict(headers, **{"Content-Encoding": self.encoding})
+
+    def summary(self):
+        with self.lock:
+            return {
+                "encoding": self.encoding,
+                "level": self.level,
+                "enabled": self.enabled,
+                "ratio": self.ratio,
+                "original_bytes": self.original_bytes,
+                "compressed_bytes": self.compressed_bytes,
+            }
@@ -20,7 +20,7 @@ DESCRIPTOR = _descriptor.FileDescriptor(
   package='',
   syntax='proto3',
   serialized_options=None,
-  serialized_pb=_b('\n\x0c\x63ortex.proto\"\x84\x01\n\x04User\x12\x0f\n\x07user_id\x18\x01 \x01(\x04\x12\x10\n\x08username\x18\x02 \x01(\t\x12\x10\n\x08\x62irthday\x18\x03 \x01(\r\x12\x1c\n\x06gender\x18\x04 \x01(\x0e\x32\x0c.User.Gender\")\n\x06Gender\x12\x08\n\x04MALE\x10\x00\x12\n\n\x06\x46\x45MALE\x10\x01\x12\t\n\x05OTHER\x10\x02\"\x92\x01\n\x08Snapshot\x12\x10\n\x08\x64\x61tetime\x18\x01 \x01(\x04\x12\x13\n\x04pose\x18\x02 \x01(\x0b\x32\x05.Pose\x12 \n\x0b\x63olor_image\x18\x03 \x01(\x0b\x32\x0b.ColorImage\x12 \n\x0b\x64\x65pth_image\x18\x04 \x01(\x0b\x32\x0b.DepthImage\x12\x1b\n\x08\x66\x65\x65lings\x18\x05 \x01(\x0b\x32\t.Feelings\"\xb8\x01\n\x04Pose\x12&\n\x0btranslation\x18\x01 \x01(\x0b\x32\x11.Pose.Translation\x12 \n\x08rotation\x18\x02 \x01(\x0b\x32\x0e.Pose.Rotation\x1a.\n\x0bTranslation\x12\t\n\x01x\x18\x01 \x01(\x01\x12\t\n\x01y\x18\x02 \x01(\x01\x12\t\n\x01z\x18\x03 \x01(\x01\x1a\x36\n\x08Rotation\x12\t\n\x01x\x18\x01 \x01(\x01\x12\t\n\x01y\x18\x02 \x01(\x01\x12\t\n\x01z\x18\x03 \x01(\x01\x12\t\n\x01w\x18\x04 \x01(\x01\"9\n\nColorImage\x12\r\n\x05width\x18\x01 \x01(\r\x12\x0e\n\x06height\x18\x02 \x01(\r\x12\x0c\n\x04\x64\x61ta\x18\x03 \x01(\x0c\"9\n\nDepthImage\x12\r\n\x05width\x18\x01 \x01(\r\x12\x0e\n\x06height\x18\x02 \x01(\r\x12\x0c\n\x04\x64\x61ta\x18\x03 \x03(\x02\"Q\n\x08\x46\x65\x65lings\x12\x0e\n\x06hunger\x18\x01 \x01(\x02\x12\x0e\n\x06thirst\x18\x02 \x01(\x02\x12\x12\n\nexhaustion\x18\x03 \x01(\x02\x12\x11\n\thappiness\x18\x04 \x01(\x02\x62\x06proto3')
+  serialized_pb=_b('\n\x0c\x63ortex.proto\"\x84\x01\n\x04User\x12\x0f\n\x07user_id\x18\x01 \x01(\x04\x12\x10\n\x08username\x18\x02 \x01(\t\x12\x10\n\x08\x62irthday\x18\x03 \x01(\r\x12\x1c\n\x06gender\x18\x04 \x01(\x0e\x32\x0c.User.Gender\")\n\x06Gender\x12\x08\n\x04MALE\x10\x00\x12\n\n\x06\x46\x45MALE\x10\x01\x12\t\n\x05OTHER\x10\x02\"\x92\x01\n\x08Snapshot\x12\x10\n\x08\x64\x61tetime\x18\x01 \x01(\x04\x12\x13\n\x04pose\x18\x02 \x01(\x0b\x32\x05.Pose\x12 \n\x0b\x63olor_image\x18\x03 \x01(\x0b\x32\x0b.ColorImage\x12 \n\x0b\x64\x65pth_image\x18\x04 \x01(\x0b\x32\x0b.DepthImage\x12\x1b\n\x08\x66\x65\x65lings\x18\x05 \x01(\x0b\x32\t.Feelings\"\xb8\x01\n\x04Pose\x12&\n\x0btranslation\x18\x01 \x01(\x0b\x32\x11.Pose.Translation\x12 \n\x08rotation\x18\x02 \x01(\x0b\x32\x0e.Pose.Rotation\x1a.\n\x0bTranslation\x12\t\n\x01x\x18\x01 \x01(\x01\x12\t\n\x01y\x18\x02 \x01(\x01\x12\t\n\x01z\x18\x03 \x01(\x01\x1a\x36\n\x08Rotation\x12\t\n\x01x\x18\x01 \x01(\x01\x12\t\n\x01y\x18\x02 \x01(\x01\x12\t\n\x01z\x18\x03 \x01(\x01\x12\t\n\x01w\x18\x04 \x01(\x01\"L\n\nColorImage\x12\r\n\x05width\x18\x01 \x01(\r\x12\x0e\n\x06height\x18\x02 \x01(\r\x12\x0c\n\x04\x64\x61ta\x18\x03 \x01(\x0c\x12\x11\n\treference\x18\x04 \x01(\x04\"j\n\nDepthImage\x12\r\n\x05width\x18\x01 \x01(\r\x12\x0e\n\x06height\x18\x02 \x01(\r\x12\x0c\n\x04\x64\x61ta\x18\x03 \x03(\x02\x12\x11\n\treference\x18\x04 \x01(\x04\x12\r\n\x05scale\x18\x05 \x01(\x02\x12\r\n\x05\x64\x65lta\x18\x06 \x03(\x11\"Q\n\x08\x46\x65\x65lings\x12\x0e\n\x06hunger\x18\x01 \x01(\x02\x12\x0e\n\x06thirst\x18\x02 \x01(\x02\x12\x12\n\nexhaustion\x18\x03 \x01(\x02\x12\x11\n\thappiness\x18\x04 \x01(\x02\">\n\rUploadMessage\x12\x0e\n\x04user\x18\x01 \x01(\x0cH\x00\x12\x12\n\x08snapshot\x18\x02 \x01(\x0cH\x00\x42\t\n\x07message\"3\n\rUploadSummary\x12\x0f\n\x07user_id\x18\x01 \x01(\x04\x12\x11\n\tsnapshots\x18\x02 \x01(\x04\"\xca\x01\n\x08\x45nvelope\x12\x1f\n\x06\x66ields\x18\x01 \x03(\x0b\x32\x0f.Envelope.Field\x1a\x9c\x01\n\x05\x46ield\x12\x0b\n\x03key\x18\x01 \x01(\r\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\x13\n\tint_value\x18\x03 \x01(\x12H\x00\x12\x15\n\x0b\x66loat_value\x18\x04 \x01(\x01H\x00\x12\x16\n\x0cstring_value\x18\x05 \x01(\tH\x00\x12\x15\n\x0b\x62ytes_value\x18\x06 \x01(\x0cH\x00\x12\x14\n\nbool_value\x18\x07 \x01(\x08H\x00\x42\x07\n\x05value2:\n\x06\x43ortex\x12\x30\n\x0cUploadSample\x12\x0e.UploadMessage\x1a\x0e.UploadSummary(\x01\x62\x06proto3')
 )
 
 
@@ -325,6 +325,13 @@ _COLORIMAGE = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='reference', full_name='ColorImage.reference', index=3,
+      number=4, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
   ],
   extensions=[
   ],
@@ -338,7 +345,7 @@ _COLORIMAGE = _descriptor.Descriptor(
   oneofs=[
   ],
   serialized_start=487,
-  serialized_end=544,
+  serialized_end=563,
 )
 
 
@@ -370,6 +377,27 @@ _DEPTHIMAGE = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='reference', full_name='DepthImage.reference', index=3,
+      number=4, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='scale', full_name='DepthImage.scale', index=4,
+      number=5, type=2, cpp_type=6, label=1,
+      has_default_value=False, default_value=float(0),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='delta', full_name='DepthImage.delta', index=5,
+      number=6, type=17, cpp_type=1, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
   ],
   extensions=[
   ],
@@ -382,8 +410,8 @@ _DEPTHIMAGE = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=546,
-  serialized_end=603,
+  serialized_start=565,
+  serialized_end=671,
 )
 
 
@@ -434,8 +462,193 @@ _FEELINGS = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=605,
-  serialized_end=686,
+  serialized_start=673,
+  serialized_end=754,
+)
+
+
+_UPLOADMESSAGE = _descriptor.Descriptor(
+  name='UploadMessage',
+  full_name='UploadMessage',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='user', full_name='UploadMessage.user', index=0,
+      number=1, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b(""),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='snapshot', full_name='UploadMessage.snapshot', index=1,
+      number=2, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b(""),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+    _descriptor.OneofDescriptor(
+      name='message', full_name='UploadMessage.message',
+      index=0, containing_type=None, fields=[]),
+  ],
+  serialized_start=756,
+  serialized_end=818,
+)
+
+
+_UPLOADSUMMARY = _descriptor.Descriptor(
+  name='UploadSummary',
+  full_name='UploadSummary',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='user_id', full_name='UploadSummary.user_id', index=0,
+      number=1, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='snapshots', full_name='UploadSummary.snapshots', index=1,
+      number=2, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=820,
+  serialized_end=871,
+)
+
+
+_ENVELOPE_FIELD = _descriptor.Descriptor(
+  name='Field',
+  full_name='Envelope.Field',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='key', full_name='Envelope.Field.key', index=0,
+      number=1, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='name', full_name='Envelope.Field.name', index=1,
+      number=2, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='int_value', full_name='Envelope.Field.int_value', index=2,
+      number=3, type=18, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='float_value', full_name='Envelope.Field.float_value', index=3,
+      number=4, type=1, cpp_type=5, label=1,
+      has_default_value=False, default_value=float(0),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='string_value', full_name='Envelope.Field.string_value', index=4,
+      number=5, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='bytes_value', full_name='Envelope.Field.bytes_value', index=5,
+      number=6, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b(""),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='bool_value', full_name='Envelope.Field.bool_value', index=6,
+      number=7, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+    _descriptor.OneofDescriptor(
+      name='value', full_name='Envelope.Field.value',
+      index=0, containing_type=None, fields=[]),
+  ],
+  serialized_start=920,
+  serialized_end=1076,
+)
+
+_ENVELOPE = _descriptor.Descriptor(
+  name='Envelope',
+  full_name='Envelope',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='fields', full_name='Envelope.fields', index=0,
+      number=1, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[_ENVELOPE_FIELD, ],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=874,
+  serialized_end=1076,
 )
 
 _USER.fields_by_name['gender'].enum_type = _USER_GENDER
@@ -448,12 +661,38 @@ _POSE_TRANSLATION.containing_type = _POSE
 _POSE_ROTATION.containing_type = _POSE
 _POSE.fields_by_name['translation'].message_type = _POSE_TRANSLATION
 _POSE.fields_by_name['rotation'].message_type = _POSE_ROTATION
+_UPLOADMESSAGE.oneofs_by_name['message'].fields.append(
+  _UPLOADMESSAGE.fields_by_name['user'])
+_UPLOADMESSAGE.fields_by_name['user'].containing_oneof = _UPLOADMESSAGE.oneofs_by_name['message']
+_UPLOADMESSAGE.oneofs_by_name['message'].fields.append(
+  _UPLOADMESSAGE.fields_by_name['snapshot'])
+_UPLOADMESSAGE.fields_by_name['snapshot'].containing_oneof = _UPLOADMESSAGE.oneofs_by_name['message']
+_ENVELOPE_FIELD.containing_type = _ENVELOPE
+_ENVELOPE_FIELD.oneofs_by_name['value'].fields.append(
+  _ENVELOPE_FIELD.fields_by_name['int_value'])
+_ENVELOPE_FIELD.fields_by_name['int_value'].containing_oneof = _ENVELOPE_FIELD.oneofs_by_name['value']
+_ENVELOPE_FIELD.oneofs_by_name['value'].fields.append(
+  _ENVELOPE_FIELD.fields_by_name['float_value'])
+_ENVELOPE_FIELD.fields_by_name['float_value'].containing_oneof = _ENVELOPE_FIELD.oneofs_by_name['value']
+_ENVELOPE_FIELD.oneofs_by_name['value'].fields.append(
+  _ENVELOPE_FIELD.fields_by_name['string_value'])
+_ENVELOPE_FIELD.fields_by_name['string_value'].containing_oneof = _ENVELOPE_FIELD.oneofs_by_name['value']
+_ENVELOPE_FIELD.oneofs_by_name['value'].fields.append(
+  _ENVELOPE_FIELD.fields_by_name['bytes_value'])
+_ENVELOPE_FIELD.fields_by_name['bytes_value'].containing_oneof = _ENVELOPE_FIELD.oneofs_by_name['value']
+_ENVELOPE_FIELD.oneofs_by_name['value'].fields.append(
+  _ENVELOPE_FIELD.fields_by_name['bool_value'])
+_ENVELOPE_FIELD.fields_by_name['bool_value'].containing_oneof = _ENVELOPE_FIELD.oneofs_by_name['value']
+_ENVELOPE.fields_by_name['fields'].message_type = _ENVELOPE_FIELD
 DESCRIPTOR.message_types_by_name['User'] = _USER
 DESCRIPTOR.message_types_by_name['Snapshot'] = _SNAPSHOT
 DESCRIPTOR.message_types_by_name['Pose'] = _POSE
 DESCRIPTOR.message_types_by_name['ColorImage'] = _COLORIMAGE
 DESCRIPTOR.message_types_by_name['DepthImage'] = _DEPTHIMAGE
 DESCRIPTOR.message_types_by_name['Feelings'] = _FEELINGS
+DESCRIPTOR.message_types_by_name['UploadMessage'] = _UPLOADMESSAGE
+DESCRIPTOR.message_types_by_name['UploadSummary'] = _UPLOADSUMMARY
+DESCRIPTOR.message_types_by_name['Envelope'] = _ENVELOPE
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
 User = _reflection.GeneratedProtocolMessageType('User', (_message.Message,), {
@@ -514,5 +753,58 @@ Feelings = _reflection.GeneratedProtocolMessageType('Feelings', (_message.Messag
   })
 _sym_db.RegisterMessage(Feelings)
 
+UploadMessage = _reflection.GeneratedProtocolMessageType('UploadMessage', (_message.Message,), {
+  'DESCRIPTOR' : _UPLOADMESSAGE,
+  '__module__' : 'cortex_pb2'
+  # @@protoc_insertion_point(class_scope:UploadMessage)
+  })
+_sym_db.RegisterMessage(UploadMessage)
+
+UploadSummary = _reflection.GeneratedProtocolMessageType('UploadSummary', (_message.Message,), {
+  'DESCRIPTOR' : _UPLOADSUMMARY,
+  '__module__' : 'cortex_pb2'
+  # @@protoc_insertion_point(class_scope:UploadSummary)
+  })
+_sym_db.RegisterMessage(UploadSummary)
+
+Envelope = _reflection.GeneratedProtocolMessageType('Envelope', (_message.Message,), {
+
+  'Field' : _reflection.GeneratedProtocolMessageType('Field', (_message.Message,), {
+    'DESCRIPTOR' : _ENVELOPE_FIELD,
+    '__module__' : 'cortex_pb2'
+    # @@protoc_insertion_point(class_scope:Envelope.Field)
+    })
+  ,
+  'DESCRIPTOR' : _ENVELOPE,
+  '__module__' : 'cortex_pb2'
+  # @@protoc_insertion_point(class_scope:Envelope)
+  })
+_sym_db.RegisterMessage(Envelope)
+_sym_db.RegisterMessage(Envelope.Field)
+
+
+
+_CORTEX = _descriptor.ServiceDescriptor(
+  name='Cortex',
+  full_name='Cortex',
+  file=DESCRIPTOR,
+  index=0,
+  serialized_options=None,
+  serialized_start=1078,
+  serialized_end=1136,
+  methods=[
+  _descriptor.MethodDescriptor(
+    name='UploadSample',
+    full_name='Cortex.UploadSample',
+    index=0,
+    containing_service=None,
+    input_type=_UPLOADMESSAGE,
+    output_type=_UPLOADSUMMARY,
+    serialized_options=None,
+  ),
+])
+_sym_db.RegisterServiceDescriptor(_CORTEX)
+
+DESCRIPTOR.services_by_name['Cortex'] = _CORTEX
 
 # @@protoc_insertion_point(module_scope)
@@ -1,3 +1,46 @@
 # Generated by the gRPC Python protocol compiler plugin. DO NOT EDIT!
 import grpc
 
+from . import cortex_pb2 as cortex__pb2
+
+
+class CortexStub(object):
+  # missing associated documentation comment in .proto file
+  pass
+
+  def __init__(self, channel):
+    """Constructor.
+
+    Args:
+      channel: A grpc.Channel.
+    """
+    self.UploadSample = channel.stream_unary(
+        '/Cortex/UploadSample',
+        request_serializer=cortex__pb2.UploadMessage.SerializeToString,
+        response_deserializer=cortex__pb2.UploadSummary.FromString,
+        )
+
+
+class CortexServicer(object):
+  # missing associated documentation comment in .proto file
+  pass
+
+  def UploadSample(self, request_iterator, context):
+    """Uploads a User followed by its Snapshots over a single stream, and returns a summary once the stream ends.
+    """
+    context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+    context.set_details('Method not implemented!')
+    raise NotImplementedError('Method not implemented!')
+
+
+def add_CortexServicer_to_server(servicer, server):
+  rpc_method_handlers = {
+      'UploadSample': grpc.stream_unary_rpc_method_handler(
+          servicer.UploadSample,
+          request_deserializer=cortex__pb2.UploadMessage.FromString,
+          response_serializer=cortex__pb2.UploadSummary.SerializeToString,
+      ),
+  }
+  generic_handler = grpc.method_handlers_generic_handler(
+      'Cortex', rpc_method_handlers)
+  server.add_generic_rpc_handlers((generic_handler,))
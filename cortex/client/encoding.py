@@ -0,0 +1,186 @@
+from .cortex_pb2 import *
+from ..common.wire import write_varint
+from collections import namedtuple
+import hashlib
+import numpy as np
+
+DEPTH_DELTA_SCALE = 0.001  # quantization step of depth deltas (1mm, as depth images are in meters)
+MAX_DEPTH_DELTA = 2 ** 31 - 1  # deltas are sint32
+SNAPSHOT_DEPTH_IMAGE_FIELD = 4
+DEPTH_DATA_FIELD = 3
+DEPTH_DELTA_FIELD = 6
+
+# a snapshot split into separately serialized parts, which are concatenated into the snapshot sent to the server
+# (ProtoBuf merges the messages of concatenated serializations): the snapshot without image data, its color image
+# data and its depth image data, along with the hash of the color image and the depth values (float32).
+# encoders replace the color or depth part of a snapshot with a smaller encoding of it.
+SnapshotParts = namedtuple("SnapshotParts", ["base", "color", "depth", "color_hash", "depth_values"])
+
+
+def split_snapshot(snapshot):
+    """
+    splits a Snapshot message into SnapshotParts. the image data of `snapshot` is cleared.
+    """
+    color = Snapshot()
+    color.color_image.data = snapshot.color_image.data
+    depth_values = np.array(snapshot.depth_image.data, dtype=np.float32)
+    depth = b""
+    if len(depth_values):
+        depth = packed_field(SNAPSHOT_DEPTH_IMAGE_FIELD,
+                             packed_field(DEPTH_DATA_FIELD, depth_values.astype("<f4").tobytes()))
+    color_hash = hashlib.blake2b(snapshot.color_image.data, digest_size=16).digest()
+    snapshot.color_image.ClearField("data")
+    snapshot.depth_image.ClearField("data")
+    return SnapshotParts(snapshot.SerializeToString(), color.SerializeToString(), depth, color_hash, depth_values)
+
+
+def packed_field(field_number, payload):
+    """
+    returns a serialized length-delimited protobuf field: a nested message or a packed repeated field.
+    large repeated fields (depth images) are packed with numpy, instead of one value at a time by ProtoBuf.
+    """
+    return write_varint(field_number << 3 | 2) + write_varint(len(payload)) + payload
+
+
+def zigzag_varints(values):
+    """
+    returns the payload of a packed sint32 field holding `values` (integers within the sint32 range): every value
+    zigzag encoded, and written as a varint of 7 bits per byte, with the high bit set on all but its last byte.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    zigzag = ((values << 1) ^ (values >> 63)).astype(np.uint64)
+    shifts = np.arange(5, dtype=np.uint64) * np.uint64(7)  # a 32 bit value takes up to 5 bytes
+    groups = (zigzag[:, None] >> shifts) & np.uint64(0x7f)
+    lengths = np.maximum(1, 5 - (groups[:, ::-1].cumsum(axis=1) == 0).sum(axis=1))
+    groups[np.arange(5) < lengths[:, None] - 1] |= np.uint64(0x80)
+    return groups.astype(np.uint8)[np.arange(5) < lengths[:, None]].tobytes()
+
+
+def with_parts(record, **parts):
+    """
+    returns a snapshot record (SnapshotRecord) with some of its parts replaced, and its data reassembled from them.
+    """
+    new_parts = record.parts._replace(**parts)
+    return record._replace(data=new_parts.base + new_parts.color + new_parts.depth, parts=new_parts)
+
+
+class ColorDeduplicator:
+    """
+    This class replaces repeated color images (of static scenes) with references.
+    it remembers the hash of every color image the server holds, along with the datetime of the first snapshot
+    which carried it. a snapshot whose color image is already held is sent without the image data, with a
+    reference to that snapshot (ColorImage.reference), which the server resolves against its stored images.
+    only images the server acknowledged are referenced, so references never point at snapshots still in flight.
+    """
+    name = "deduplication"
+
+    def __init__(self):
+        self.frames = {}  # color image hash: datetime of the first snapshot held by the server with that image
+        self.deduplicated = 0
+        self.saved_bytes = 0
+
+    def encode(self, record):
+        """
+        returns the record to send: with a reference instead of its color image data, if that image is held.
+        """
+        reference = self.frames.get(record.parts.color_hash)
+        if reference is None or reference == record.datetime:
+            return record
+        color = color_reference(reference)
+        self.deduplicated += 1
+        self.saved_bytes += len(record.parts.color) - len(color)
+        return with_parts(record, color=color)
+
+    def held(self, record):
+        """
+        marks the color image of a record as held by the server.
+        """
+        self.frames.setdefault(record.parts.color_hash, record.datetime)
+
+    def summary(self):
+        return {"deduplicated": self.deduplicated, "saved_bytes": self.saved_bytes}
+
+
+def color_reference(reference):
+    """
+    returns a serialized Snapshot which holds only a color image reference.
+    """
+    snapshot = Snapshot()
+    snapshot.color_image.reference = reference
+    return snapshot.SerializeToString()
+
+
+class DepthDeltaEncoder:
+    """
+    This class sends depth images as quantized deltas against the previous depth image of the user.
+    a delta is the difference from the reference image, in steps of `scale` (DepthImage.delta, zigzag varints,
+    mostly a single byte instead of a 4 byte float), and the server adds it to the reference image it holds.
+    the encoding is lossy, but the error does not build up: deltas are taken against the image the server
+    reconstructed (which the encoder computes the same way), not against the original one, so every value is within
+    half a step of the original. images are sent in full when there is no acknowledged reference yet, when their
+    size changes, or when the deltas would not be smaller.
+    """
+    name = "depth_delta"
+
+    def __init__(self, scale=DEPTH_DELTA_SCALE):
+        self.scale = float(np.float32(scale))  # the scale is sent as a float, and both sides must use the same one
+        self.reference = None  # (datetime, values) of the last depth image acknowledged by the server
+        self.pending = {}  # datetime: values the server will reconstruct, for depth images in flight
+        self.deltas = 0
+        self.full = 0
+        self.original_bytes = 0
+        self.encoded_bytes = 0
+
+    def encode(self, record):
+        """
+        returns the record to send: with a delta instead of its depth image data, if it is smaller.
+        """
+        values = record.parts.depth_values
+        self.original_bytes += len(record.parts.depth)
+        if self.reference is not None and len(values) and len(values) == len(self.reference[1]):
+            reference_datetime, reference_values = self.reference
+            with np.errstate(invalid="ignore", over="ignore"):
+                deltas = np.rint((values.astype(np.float64) - reference_values) / self.scale)
+            # NaN or infinite values, or deltas out of range, are sent in full
+            if np.isfinite(deltas).all() and np.abs(deltas).max() <= MAX_DEPTH_DELTA:
+                snapshot = Snapshot()
+                snapshot.depth_image.reference = reference_datetime
+                snapshot.depth_image.scale = self.scale
+                depth = snapshot.SerializeToString() + \
+                    packed_field(SNAPSHOT_DEPTH_IMAGE_FIELD, packed_field(DEPTH_DELTA_FIELD, zigzag_varints(deltas)))
+                if len(depth) < len(record.parts.depth):
+                    self.pending[record.datetime] = apply_depth_delta(reference_values, deltas, self.scale)
+                    self.deltas += 1
+                    self.encoded_bytes += len(depth)
+                    return with_parts(record, depth=depth)
+
+        self.pending[record.datetime] = values
+        self.full += 1
+        self.encoded_bytes += len(record.parts.depth)
+        return record
+
+    def held(self, record):
+        """
+        makes the depth image of an acknowledged record the reference of the next ones.
+        """
+        values = self.pending.pop(record.datetime, None)
+        if values is not None:
+            self.reference = (record.datetime, values)
+
+    def summary(self):
+        return {
+            "deltas": self.deltas,
+            "full": self.full,
+            "original_bytes": self.original_bytes,
+            "encoded_bytes": self.encoded_bytes,
+            "ratio": self.encoded_bytes / self.original_bytes if self.original_bytes else 0,
+        }
+
+
+def apply_depth_delta(reference_values, deltas, scale):
+    """
+    returns the depth values (float32) a delta reconstructs from the reference values. the server reconstructs
+    images with the same (float64) operations, so both sides hold the same values.
+    """
+    return (np.asarray(reference_values, dtype=np.float64) + np.asarray(deltas, dtype=np.float64) * scale) \
+        .astype(np.float32)
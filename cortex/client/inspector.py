@@ -0,0 +1,76 @@
+from .cortex_pb2 import *
+from .sample import (open_sample, prefetch, read_footer, read_frame, SampleStats, DEFAULT_READ_AHEAD, INDEXED_MAGIC,
+                     USER_HEADER)
+from datetime import datetime, timezone
+import os
+
+
+def inspect_sample(path, read_ahead=DEFAULT_READ_AHEAD):
+    """
+    returns the statistics of a sample file without uploading it: its format, size and user, and the aggregate
+    statistics of its snapshots (see SampleStats) - count, time span, snapshot sizes, bytes per field and image sizes.
+    indexed sample files hold these statistics in their footer, so they are answered without reading any block.
+    other files are streamed once, read `read_ahead` snapshots ahead (see prefetch), in bounded memory.
+    raises FileNotFoundError if there is no such file, and ValueError if the file is malformed.
+    """
+    with open(path, "rb") as f:
+        indexed = f.read(len(INDEXED_MAGIC)) == INDEXED_MAGIC
+        if indexed:
+            serialized_user = read_frame(f, USER_HEADER)
+            _, _, metadata = read_footer(f)
+            if "stats" in metadata:
+                return inspection(path, "indexed", "footer", serialized_user, metadata["stats"])
+
+    sample = open_sample(path)
+    try:
+        stats = SampleStats()
+        for raw_message, _, _ in prefetch(sample.frames(), read_ahead):
+            stats.add(raw_message)
+        return inspection(path, "indexed" if indexed else "gzip", "stream", sample.user, stats.summary())
+    finally:
+        sample.close()
+
+
+def inspection(path, sample_format, source, serialized_user, stats):
+    user = User()
+    user.ParseFromString(serialized_user or b"")
+    return dict({
+        "path": path,
+        "format": sample_format,
+        "source": source,  # "footer" if the statistics were read from an indexed sample files' footer
+        "file_bytes": os.path.getsize(path),
+        "user": {
+            "user_id": user.user_id,
+            "username": user.username,
+            "birthday": user.birthday,
+            "gender": User.Gender.Name(user.gender),
+        },
+    }, **stats)
+
+
+def print_inspection(report):
+    user = report["user"]
+    print("{} ({} sample file, {:.1f} MB)".format(report["path"], report["format"], report["file_bytes"] / 1e6))
+    print("User: {} ({}), born {}, {}".format(user["username"], user["user_id"],
+                                             datetime.fromtimestamp(user["birthday"], timezone.utc).date(),
+                                             user["gender"].lower()))
+    print("Snapshots: {}".format(report["snapshots"]))
+    if report["snapshots"]:
+        print("Time span: {} - {} ({:.1f}s)".format(format_datetime(report["first_datetime"] / 1000),
+                                                   format_datetime(report["last_datetime"] / 1000),
+                                                   report["span_seconds"]))
+        print("Snapshot size: {:.1f} MB total, {} - {} bytes, {:.0f} bytes on average"
+              .format(report["snapshot_bytes"] / 1e6, report["min_snapshot_bytes"], report["max_snapshot_bytes"],
+                      report["mean_snapshot_bytes"]))
+        total = sum(report["field_bytes"].values())
+        print("Bytes per field: {}".format(", ".join("{} {} bytes ({:.1f}%)".format(field, size, 100 * size / total)
+                                                     for field, size in report["field_bytes"].items() if size)))
+        for image, sizes in report["image_sizes"].items():
+            if sizes:
+                print("{} sizes: {}".format(image.replace("_", " ").capitalize(),
+                                            ", ".join("{} ({} snapshots)".format(size, count)
+                                                      for size, count in sizes.items())))
+
+
+def format_datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
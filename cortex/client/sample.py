@@ -0,0 +1,402 @@
+"""
+Sample files come in two formats:
+
+1. gzip (.mind.gz): a single gzip stream of (message size)(message) frames, the user message first and then
+   the snapshots. it can only be read sequentially.
+
+2. indexed (version 2): a seekable container of independently compressed blocks.
+   - header: INDEXED_MAGIC, (user message size)(user message)
+   - blocks: each block is a zlib-compressed sequence of up to `block_snapshots` snapshot frames,
+     framed exactly like the snapshots of a gzip sample file.
+   - footer: (metadata size)(metadata, JSON) followed by an index entry (INDEX_ENTRY) per snapshot:
+     (datetime, block offset, offset of the snapshot frame inside the decompressed block).
+     the metadata holds the snapshot count, the time span and the aggregate statistics of the snapshots
+     (see SampleStats), so a file can be inspected without reading its blocks.
+   - trailer: (footer offset)(INDEXED_MAGIC)
+   blocks can be decompressed in parallel, and a time range can be read without touching other blocks.
+"""
+
+from ..common.wire import walk_fields
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import gzip
+import json
+import os
+import queue
+import struct
+import threading
+import zlib
+
+INDEXED_MAGIC = b"CTXMIND2"
+INDEXED_VERSION = 2
+FRAME_HEADER = 'I'  # snapshot frames inside blocks are framed like in gzip sample files
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER)
+USER_HEADER = '<I'
+METADATA_HEADER = '<I'
+INDEX_ENTRY = '<QQI'  # datetime, block offset, in-block offset
+INDEX_ENTRY_SIZE = struct.calcsize(INDEX_ENTRY)
+TRAILER = '<Q8s'  # footer offset, magic
+TRAILER_SIZE = struct.calcsize(TRAILER)
+DEFAULT_BLOCK_SNAPSHOTS = 32  # snapshots per compressed block
+COMPRESSION_LEVEL = 6
+DECOMPRESS_THREADS = os.cpu_count() or 1  # zlib releases the GIL, so blocks are inflated in parallel threads
+DEFAULT_READ_AHEAD = 64  # number of messages read, decompressed and framed ahead of their consumer
+END_OF_SAMPLE = object()  # marks the end of a prefetched iterable
+SNAPSHOT_WIRE_TYPES = {1: 0, 2: 2, 3: 2, 4: 2, 5: 2}  # protobuf wire type of each Snapshot field, by field number
+SNAPSHOT_DATETIME_FIELD = 1
+SNAPSHOT_FIELDS = {1: "datetime", 2: "pose", 3: "color_image", 4: "depth_image", 5: "feelings"}
+IMAGE_FIELDS = {3: "color_image", 4: "depth_image"}  # image messages start with their width (1) and height (2)
+
+
+def open_sample(path):
+    """
+    opens a sample file of either format, according to its first bytes.
+    raises FileNotFoundError if there is no such file, and ValueError if the file is malformed.
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(INDEXED_MAGIC))
+    if magic == INDEXED_MAGIC:
+        return IndexedSample(path)
+    return GzipSample(path)
+
+
+def iter_snapshots(path, offset=0, compressed_offset=0, read_ahead=DEFAULT_READ_AHEAD):
+    """
+    a generator of the (serialized snapshot, offset, compressed offset) frames of a sample file of either format,
+    starting at the given position (see GzipSample.frames and IndexedSample.frames).
+    the file is read, decompressed and framed on a background thread, up to `read_ahead` snapshots ahead of the
+    consumer (see prefetch), so the consumer does not wait for the next snapshot to be inflated.
+    raises FileNotFoundError if there is no such file, and ValueError if the file is malformed.
+    """
+    sample = open_sample(path)
+    try:
+        yield from prefetch(sample.frames(offset, compressed_offset), read_ahead)
+    finally:
+        sample.close()
+
+
+def prefetch(iterable, size=DEFAULT_READ_AHEAD):
+    """
+    a generator which yields the items of `iterable`, produced by a background thread into a queue of up to `size`
+    items. the producer blocks while the queue is full, so memory stays bounded. an exception raised by `iterable`
+    is raised by the generator after the items preceding it. if the generator is closed early, the producer stops
+    after its current item.
+    """
+    items = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stopped.is_set():
+                    return
+                items.put((item, None))
+            items.put((END_OF_SAMPLE, None))
+        except Exception as e:
+            items.put((END_OF_SAMPLE, e))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is END_OF_SAMPLE:
+                return
+            yield item
+    finally:
+        # unblock the producer, in case it waits for room in the queue
+        stopped.set()
+        while producer.is_alive():
+            try:
+                items.get(timeout=0.05)
+            except queue.Empty:
+                pass
+
+
+class GzipSample:
+    """
+    This class reads a gzip sample file sequentially.
+    `user` holds the serialized user message, and `frames` iterates over the serialized snapshots.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, 'rb')
+        try:
+            self.user = read_frame(self.file)
+        except OSError as e:
+            raise ValueError("not a sample file: {}".format(e))
+        if self.user is None:
+            raise ValueError("sample file has no user message")
+
+    def frames(self, offset=0, compressed_offset=0):
+        """
+        a generator of (serialized snapshot, uncompressed offset after it, compressed offset after it).
+        reading starts at the uncompressed `offset` if given: a gzip stream can not be entered in the middle,
+        so the data before it is inflated and dropped, but not parsed.
+        the compressed offset is the position of the underlying file, which reads ahead of the stream.
+        raises ValueError if the file is truncated.
+        """
+        if offset:
+            self.file.seek(offset)
+        while (raw_message := read_frame(self.file)) is not None:
+            yield raw_message, self.file.tell(), self.file.fileobj.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class IndexedSample:
+    """
+    This class reads an indexed (version 2) sample file.
+    `user` holds the serialized user message, `metadata` the footer metadata and `index` the index entries.
+    blocks are read with pread and inflated by a pool of `threads` threads, at most `2 * threads` blocks ahead.
+    """
+    def __init__(self, path, threads=DECOMPRESS_THREADS):
+        self.path = path
+        self.threads = threads
+        self.file = open(path, "rb")
+        if self.file.read(len(INDEXED_MAGIC)) != INDEXED_MAGIC:
+            raise ValueError("not an indexed sample file")
+        self.user = read_frame(self.file, USER_HEADER)
+
+        self.footer_offset, trailer_offset, self.metadata = read_footer(self.file)
+        index_size = trailer_offset - self.file.tell()
+        if index_size % INDEX_ENTRY_SIZE:
+            raise ValueError("indexed sample file has a truncated index")
+        self.index = list(struct.iter_unpack(INDEX_ENTRY, self.file.read(index_size)))
+
+        # blocks are contiguous, so each block ends where the next one (or the footer) starts
+        offsets = sorted({block_offset for _, block_offset, _ in self.index})
+        ends = offsets[1:] + [self.footer_offset]
+        self.blocks = {start: end - start for start, end in zip(offsets, ends)}
+
+    def frames(self, offset=0, compressed_offset=0):
+        """
+        a generator of (serialized snapshot, in-block offset after it, block offset).
+        reading starts at block `compressed_offset`, at in-block `offset`, so no earlier block is read.
+        """
+        block_offsets = [block_offset for block_offset in self.blocks if block_offset >= compressed_offset]
+        for block_offset, block in zip(block_offsets, self._read_blocks(block_offsets)):
+            position = offset if block_offset == compressed_offset else 0
+            while position < len(block):
+                raw_message, position = unpack_frame(block, position)
+                yield raw_message, position, block_offset
+
+    def between(self, start=None, end=None):
+        """
+        a generator of (serialized snapshot, datetime) for the snapshots with start <= datetime <= end,
+        in file order. only the blocks holding these snapshots are read.
+        """
+        entries = [entry for entry in self.index
+                   if (start is None or entry[0] >= start) and (end is None or entry[0] <= end)]
+        block_offsets = sorted({block_offset for _, block_offset, _ in entries})
+        blocks = dict(zip(block_offsets, self._read_blocks(block_offsets)))
+        for snapshot_datetime, block_offset, position in entries:
+            yield unpack_frame(blocks[block_offset], position)[0], snapshot_datetime
+
+    def _read_blocks(self, block_offsets):
+        """
+        a generator of the decompressed blocks at `block_offsets`, in order, inflated in parallel.
+        """
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            pending = deque()
+            for block_offset in block_offsets:
+                pending.append(executor.submit(self._read_block, block_offset))
+                if len(pending) >= 2 * self.threads:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _read_block(self, block_offset):
+        compressed = os.pread(self.file.fileno(), self.blocks[block_offset], block_offset)
+        try:
+            return zlib.decompress(compressed)
+        except zlib.error as e:
+            raise ValueError("corrupt block at offset {}: {}".format(block_offset, e))
+
+    def close(self):
+        self.file.close()
+
+
+def read_footer(f):
+    """
+    reads the trailer and the footer metadata of an indexed sample file, leaving the file at the start of the index.
+    returns the footer offset, the trailer offset and the metadata, and raises ValueError if the trailer is invalid.
+    """
+    f.seek(-TRAILER_SIZE, os.SEEK_END)
+    trailer_offset = f.tell()
+    footer_offset, magic = struct.unpack(TRAILER, f.read(TRAILER_SIZE))
+    if magic != INDEXED_MAGIC or footer_offset > trailer_offset:
+        raise ValueError("indexed sample file has no valid trailer")
+    f.seek(footer_offset)
+    return footer_offset, trailer_offset, json.loads(read_frame(f, METADATA_HEADER))
+
+
+class SampleStats:
+    """
+    This class aggregates statistics of the snapshots of a sample file, in a single pass and bounded memory:
+    the snapshot count, the first and last datetimes, the snapshot sizes, the bytes taken by every Snapshot field
+    (including its key and length) and by the frame headers, and the number of snapshots of every image size.
+    snapshots are walked at the wire level (see walk_fields), so their image data is never parsed or copied.
+    """
+    def __init__(self):
+        self.count = 0
+        self.first_datetime = None
+        self.last_datetime = None
+        self.bytes = 0
+        self.min_bytes = None
+        self.max_bytes = 0
+        self.field_bytes = {name: 0 for name in SNAPSHOT_FIELDS.values()}
+        self.field_bytes.update(unknown=0, framing=0)
+        self.image_sizes = {name: {} for name in IMAGE_FIELDS.values()}
+
+    def add(self, raw_message):
+        """
+        adds a serialized snapshot. raises ValueError if it is malformed.
+        """
+        snapshot_datetime = None
+        for field_number, wire_type, value, start, end in walk_fields(raw_message):
+            if SNAPSHOT_WIRE_TYPES.get(field_number, wire_type) != wire_type:
+                raise ValueError("snapshot field {} has wire type {}".format(field_number, wire_type))
+            self.field_bytes[SNAPSHOT_FIELDS.get(field_number, "unknown")] += end - start
+            if field_number == SNAPSHOT_DATETIME_FIELD:
+                snapshot_datetime = value
+            elif field_number in IMAGE_FIELDS:
+                image = {number: size for number, _, size, _, _ in walk_fields(raw_message, *value) if number in (1, 2)}
+                size = "{}x{}".format(image.get(1, 0), image.get(2, 0))
+                sizes = self.image_sizes[IMAGE_FIELDS[field_number]]
+                sizes[size] = sizes.get(size, 0) + 1
+        if snapshot_datetime is None:
+            raise ValueError("snapshot has no datetime")
+
+        self.count += 1
+        self.first_datetime = snapshot_datetime if self.first_datetime is None \
+            else min(self.first_datetime, snapshot_datetime)
+        self.last_datetime = max(self.last_datetime or 0, snapshot_datetime)
+        self.bytes += len(raw_message)
+        self.min_bytes = len(raw_message) if self.min_bytes is None else min(self.min_bytes, len(raw_message))
+        self.max_bytes = max(self.max_bytes, len(raw_message))
+        self.field_bytes["framing"] += FRAME_HEADER_SIZE
+
+    def summary(self):
+        return {
+            "snapshots": self.count,
+            "first_datetime": self.first_datetime,
+            "last_datetime": self.last_datetime,
+            "span_seconds": (self.last_datetime - self.first_datetime) / 1000 if self.count else 0,
+            "snapshot_bytes": self.bytes,
+            "min_snapshot_bytes": self.min_bytes or 0,
+            "max_snapshot_bytes": self.max_bytes,
+            "mean_snapshot_bytes": self.bytes / self.count if self.count else 0,
+            "field_bytes": dict(self.field_bytes),
+            "image_sizes": {name: dict(sizes) for name, sizes in self.image_sizes.items()},
+        }
+
+
+def write_indexed_sample(path, serialized_user, snapshots, block_snapshots=DEFAULT_BLOCK_SNAPSHOTS,
+                         level=COMPRESSION_LEVEL):
+    """
+    writes an indexed (version 2) sample file from a serialized user message and an iterable of serialized
+    snapshots, compressing every `block_snapshots` snapshots into a block.
+    returns the number of snapshots written.
+    """
+    index = []
+    stats = SampleStats()
+    with open(path, "wb") as f:
+        f.write(INDEXED_MAGIC + struct.pack(USER_HEADER, len(serialized_user)) + serialized_user)
+        block = []
+        block_length = 0
+        for raw_message in snapshots:
+            # the block is written only when it is full, so the current position is where it will start
+            index.append((validate_snapshot(raw_message), f.tell(), block_length))
+            stats.add(raw_message)
+            block.append(struct.pack(FRAME_HEADER, len(raw_message)) + raw_message)
+            block_length += len(block[-1])
+            if len(block) == block_snapshots:
+                f.write(zlib.compress(b"".join(block), level))
+                block = []
+                block_length = 0
+        if block:
+            f.write(zlib.compress(b"".join(block), level))
+
+        footer_offset = f.tell()
+        datetimes = [snapshot_datetime for snapshot_datetime, _, _ in index]
+        metadata = {
+            "version": INDEXED_VERSION,
+            "count": len(index),
+            "first_datetime": min(datetimes, default=None),
+            "last_datetime": max(datetimes, default=None),
+            "block_snapshots": block_snapshots,
+            "stats": stats.summary(),
+        }
+        serialized_metadata = json.dumps(metadata).encode()
+        f.write(struct.pack(METADATA_HEADER, len(serialized_metadata)) + serialized_metadata)
+        f.write(b"".join(struct.pack(INDEX_ENTRY, *entry) for entry in index))
+        f.write(struct.pack(TRAILER, footer_offset, INDEXED_MAGIC))
+    return len(index)
+
+
+def convert_sample(source, destination, block_snapshots=DEFAULT_BLOCK_SNAPSHOTS, level=COMPRESSION_LEVEL):
+    """
+    converts a gzip sample file into an indexed (version 2) sample file. snapshots are copied as they are.
+    returns the number of snapshots converted.
+    """
+    sample = GzipSample(source)
+    try:
+        return write_indexed_sample(destination, sample.user,
+                                    (raw_message for raw_message, _, _ in sample.frames()), block_snapshots, level)
+    finally:
+        sample.close()
+
+
+def read_frame(f, header=FRAME_HEADER):
+    """
+    reads a single (message size)(message) frame from a file object.
+    returns None at the end of the file, and raises ValueError if the frame is truncated.
+    """
+    header_size = struct.calcsize(header)
+    size_bin = f.read(header_size)
+    if not size_bin:
+        return None
+    if len(size_bin) < header_size:
+        raise ValueError("truncated message size")
+    size = struct.unpack(header, size_bin)[0]
+    message = f.read(size)
+    if len(message) < size:
+        raise ValueError("truncated message: expected {} bytes, read {}".format(size, len(message)))
+    return message
+
+
+def unpack_frame(buffer, position):
+    """
+    reads a single (message size)(message) frame from a buffer at `position`.
+    returns the message and the position following it, and raises ValueError if the frame is truncated.
+    """
+    if position + FRAME_HEADER_SIZE > len(buffer):
+        raise ValueError("truncated message size")
+    size = struct.unpack_from(FRAME_HEADER, buffer, position)[0]
+    position += FRAME_HEADER_SIZE
+    if position + size > len(buffer):
+        raise ValueError("truncated message at block position {}".format(position))
+    return buffer[position:position + size], position + size
+
+
+def validate_snapshot(raw_message):
+    """
+    validates a serialized snapshot without deserializing it.
+    walks over the top-level fields of the message: every field must have the wire type of the Snapshot
+    field with that number, and fit inside the message. nested messages (pose, images, feelings) are skipped over
+    without being read or copied. the datetime is the only required field.
+    returns the snapshot datetime, and raises ValueError if the snapshot is malformed.
+    """
+    fields = {}
+    for field_number, wire_type, value, _, _ in walk_fields(raw_message):
+        if SNAPSHOT_WIRE_TYPES.get(field_number, wire_type) != wire_type:
+            raise ValueError("snapshot field {} has wire type {}".format(field_number, wire_type))
+        fields[field_number] = value
+
+    if SNAPSHOT_DATETIME_FIELD not in fields:
+        raise ValueError("snapshot has no datetime")
+    return fields[SNAPSHOT_DATETIME_FIELD]
@@ -0,0 +1,19 @@
+from ..common.stats import StageStats
+
+STAGES = ["read", "parse", "reserialize", "encode", "compress", "send"]
+
+
+class UploadStats(StageStats):
+    """
+    This class measures where an upload spends its time, per stage:
+    - read: reading a snapshot from the sample file (decompression and framing)
+    - parse: deserializing (or, in passthrough mode, validating) a snapshot
+    - reserialize: building and serializing the Cortex ProtoBuf snapshot
+    - encode: encoding a snapshot against the snapshots the server holds (see cortex/client/encoding.py)
+    - compress: compressing a request body (see RequestCompressor)
+    - send: sending a request (or a gRPC stream message), including retries, until it is answered
+    stages run on different threads (reader, senders).
+    if `interval` is given, a JSON summary is printed every `interval` seconds while the upload runs.
+    """
+    def __init__(self, interval=None):
+        super().__init__(STAGES, interval)
@@ -0,0 +1,30 @@
+import click
+from click.exceptions import UsageError
+from .benchmark import benchmark_codecs, DEFAULT_REPEAT
+import json
+import sys
+
+USAGE_ERROR = "Usage Error: python -m cortex.common benchmark-codecs [--repeat <TIMES>]"
+
+
+def _show_usage_error(self):
+    print(USAGE_ERROR)
+
+
+UsageError.show = _show_usage_error
+
+
+@click.command()
+@click.argument('action')
+@click.option('--repeat', default=DEFAULT_REPEAT, type=int)
+def parser(action, repeat):
+    if action == "benchmark-codecs":
+        print(json.dumps(benchmark_codecs(repeat), indent=4))
+
+    else:
+        print(USAGE_ERROR)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser()
@@ -0,0 +1,59 @@
+from .codec import CODECS
+import time
+
+DEFAULT_REPEAT = 10000
+RAW_PATH = "/cortex/files/raw/3f/a2/42_1575446887339_{}"
+PROCESSED_PATH = "/cortex/files/processed/42_1575446887339_{}.jpg"
+
+# a message of every hop, as the components build them: the server publishes snapshots to the parsers and users
+# to the saver, and every parser publishes its results to the saver
+MESSAGES = {
+    "snapshot": dict({
+        "user_id": "42",
+        "datetime": 1575446887339,
+        "color_image_path": RAW_PATH.format("color"),
+        "depth_image_path": RAW_PATH.format("depth"),
+        "color_image_height": 1080,
+        "color_image_width": 1920,
+        "depth_image_height": 172,
+        "depth_image_width": 224,
+    }, **{name: 0.4873152375221252 for name in [
+        "pose_rotation_x", "pose_rotation_y", "pose_rotation_z", "pose_rotation_w", "pose_translation_x",
+        "pose_translation_y", "pose_translation_z", "hunger", "thirst", "exhaustion", "happiness"]}),
+    "user": {"user_id": 42, "username": "Dan Gittik", "birthday": 699746400, "gender": 0},
+    "pose": dict({"user_id": "42", "datetime": 1575446887339, "translation_path": PROCESSED_PATH.format("translation")},
+                 **{name: -0.1230478063225746 for name in ["rotation_x", "rotation_y", "rotation_z", "rotation_w",
+                                                            "translation_x", "translation_y", "translation_z"]}),
+    "color_image": {"user_id": "42", "datetime": 1575446887339, "color_image_path": PROCESSED_PATH.format("color"),
+                    "height": 1080, "width": 1920},
+    "depth_image": {"user_id": "42", "datetime": 1575446887339, "depth_image_path": PROCESSED_PATH.format("depth"),
+                    "height": 172, "width": 224},
+    "feelings": {"user_id": "42", "datetime": 1575446887339, "hunger": 0.0, "thirst": 0.0, "exhaustion": 0.0,
+                 "happiness": 0.0},
+}
+
+
+def benchmark_codecs(repeat=DEFAULT_REPEAT):
+    """
+    measures every codec (see codec.py) on the messages of every hop between the components (MESSAGES).
+    returns {content type: {message: {"bytes", "encode_microseconds", "decode_microseconds"}}}, where the times
+    are the mean of `repeat` encodings and decodings.
+    """
+    results = {}
+    for content_type, codec in CODECS.items():
+        results[content_type] = {}
+        for name, message in MESSAGES.items():
+            started = time.perf_counter()
+            for _ in range(repeat):
+                body = codec.encode(message)
+            encode_seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            for _ in range(repeat):
+                codec.decode(body)
+            decode_seconds = time.perf_counter() - started
+            results[content_type][name] = {
+                "bytes": len(body),
+                "encode_microseconds": encode_seconds / repeat * 1e6,
+                "decode_microseconds": decode_seconds / repeat * 1e6,
+            }
+    return results
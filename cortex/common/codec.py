@@ -0,0 +1,168 @@
+"""
+Messages between the server, the parsers and the saver are flat dictionaries of ints, floats, strings, bytes and
+booleans. a codec encodes them for the MQ, and every AMQP message carries the content type of its codec, so
+components of different versions can exchange messages while they are rolled out: consumers decode every codec,
+and messages without a content type (published by earlier versions) are JSON.
+- ENVELOPE (the default): a binary ProtoBuf Envelope (see cortex.proto). the names of known fields are sent as
+  small integers (see KNOWN_KEYS), and numbers are sent as varints or 8-byte doubles instead of text.
+  envelopes are written and read at the wire level (see wire.py): they are simple enough, and building them
+  with the python implementation of ProtoBuf takes several times longer.
+- JSON: the JSON the components exchanged before, kept for compatibility. it can not hold bytes.
+"""
+
+from .wire import walk_fields, write_varint
+import json
+import struct
+
+JSON = "application/json"
+ENVELOPE = "application/x-cortex-envelope"
+DEFAULT_CONTENT_TYPE = ENVELOPE
+CONTENT_TYPES = {"json": JSON, "envelope": ENVELOPE}  # the content types by the names command lines use
+CODECS = {}  # content type: codec
+
+# field numbers of the Envelope message and its Field message, and their tags (field number and wire type)
+ENVELOPE_FIELDS = 1
+FIELD_KEY, FIELD_NAME, INT_VALUE, FLOAT_VALUE, STRING_VALUE, BYTES_VALUE, BOOL_VALUE = range(1, 8)
+FIELDS_TAG = bytes([ENVELOPE_FIELDS << 3 | 2])
+FIELD_KEY_TAG = bytes([FIELD_KEY << 3])
+FIELD_NAME_TAG = bytes([FIELD_NAME << 3 | 2])
+INT_VALUE_TAG = bytes([INT_VALUE << 3])
+FLOAT_VALUE_TAG = bytes([FLOAT_VALUE << 3 | 1])
+STRING_VALUE_TAG = bytes([STRING_VALUE << 3 | 2])
+BYTES_VALUE_TAG = bytes([BYTES_VALUE << 3 | 2])
+BOOL_VALUE_TAG = bytes([BOOL_VALUE << 3])
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+# the field names which the envelope sends as their index (starting at 1). names may only be appended, since
+# components of different versions must agree on the indexes; other names are sent as they are.
+KNOWN_KEYS = [
+    "user_id", "datetime", "username", "birthday", "gender",
+    "color_image_path", "depth_image_path",
+    "pose_rotation_x", "pose_rotation_y", "pose_rotation_z", "pose_rotation_w",
+    "pose_translation_x", "pose_translation_y", "pose_translation_z",
+    "color_image_height", "color_image_width", "depth_image_height", "depth_image_width",
+    "hunger", "thirst", "exhaustion", "happiness",
+    "rotation_x", "rotation_y", "rotation_z", "rotation_w",
+    "translation_x", "translation_y", "translation_z", "translation_path",
+    "height", "width",
+    "color_image_data", "depth_image_data",
+]
+
+
+def codec(cls):
+    """
+    a decorator which registers a codec class in the global dict CODECS, under its content type.
+    """
+    CODECS[cls.content_type] = cls()
+    return cls
+
+
+def get_codec(content_type=None):
+    """
+    returns the codec of `content_type`, or the JSON codec if it is None.
+    raises ValueError if there is no such codec.
+    """
+    try:
+        return CODECS[content_type or JSON]
+    except KeyError:
+        raise ValueError("unsupported content type: {}".format(content_type))
+
+
+def encode(message, content_type=DEFAULT_CONTENT_TYPE):
+    """
+    returns the bytes of a message dictionary, encoded by the codec of `content_type`.
+    raises TypeError if the message holds values the codec does not support.
+    """
+    return get_codec(content_type).encode(message)
+
+
+def decode(body, content_type=None):
+    """
+    returns the message dictionary of `body` (bytes or a string), decoded by the codec of `content_type`
+    (JSON if it is None). raises ValueError if the body is malformed or the content type is not supported.
+    """
+    return get_codec(content_type).decode(body)
+
+
+@codec
+class JSONCodec:
+    content_type = JSON
+    holds_bytes = False
+
+    def encode(self, message):
+        return json.dumps(message).encode()
+
+    def decode(self, body):
+        message = json.loads(body)
+        if not isinstance(message, dict):
+            raise ValueError("a message must be a JSON object")
+        return message
+
+
+@codec
+class EnvelopeCodec:
+    content_type = ENVELOPE
+    holds_bytes = True
+
+    def __init__(self):
+        self.keys = {name: write_varint(index) for index, name in enumerate(KNOWN_KEYS, 1)}
+
+    def encode(self, message):
+        envelope = bytearray()
+        for name, value in message.items():
+            key = self.keys.get(name)
+            if key:
+                field = bytearray(FIELD_KEY_TAG + key)
+            else:
+                field = bytearray(FIELD_NAME_TAG + length_delimited(name.encode()))
+            # bool is a subclass of int, so it is checked first
+            if isinstance(value, bool):
+                field += BOOL_VALUE_TAG + (b"\x01" if value else b"\x00")
+            elif isinstance(value, int):
+                if not INT64_MIN <= value <= INT64_MAX:
+                    raise TypeError("field {} does not fit in 64 bits".format(name))
+                field += INT_VALUE_TAG + write_varint(2 * value if value >= 0 else -2 * value - 1)  # zigzag
+            elif isinstance(value, float):
+                field += FLOAT_VALUE_TAG + struct.pack('<d', value)
+            elif isinstance(value, str):
+                field += STRING_VALUE_TAG + length_delimited(value.encode())
+            elif isinstance(value, (bytes, bytearray)):
+                field += BYTES_VALUE_TAG + length_delimited(value)
+            else:
+                raise TypeError("field {} of type {} is not supported".format(name, type(value).__name__))
+            envelope += FIELDS_TAG + length_delimited(field)
+        return bytes(envelope)
+
+    def decode(self, body):
+        if isinstance(body, str):
+            raise ValueError("an envelope is binary, not a string")
+        message = {}
+        for field_number, wire_type, value, _, _ in walk_fields(body):
+            if field_number != ENVELOPE_FIELDS or wire_type != 2:
+                continue
+            name, field_value = None, None
+            for number, field_wire_type, content, _, end in walk_fields(body, *value):
+                if number == FIELD_KEY and field_wire_type == 0:
+                    if not 1 <= content <= len(KNOWN_KEYS):
+                        raise ValueError("unknown field key {}".format(content))
+                    name = KNOWN_KEYS[content - 1]
+                elif number == FIELD_NAME and field_wire_type == 2:
+                    name = bytes(body[content[0]:content[1]]).decode()
+                elif number == INT_VALUE and field_wire_type == 0:
+                    field_value = (content >> 1) ^ -(content & 1)  # zigzag
+                elif number == FLOAT_VALUE and field_wire_type == 1:
+                    field_value = struct.unpack_from('<d', body, end - 8)[0]
+                elif number == STRING_VALUE and field_wire_type == 2:
+                    field_value = bytes(body[content[0]:content[1]]).decode()
+                elif number == BYTES_VALUE and field_wire_type == 2:
+                    field_value = bytes(body[content[0]:content[1]])
+                elif number == BOOL_VALUE and field_wire_type == 0:
+                    field_value = bool(content)
+            if name is None or field_value is None:
+                raise ValueError("envelope field {} has no {}".format(name, "value" if name else "name"))
+            message[name] = field_value
+        return message
+
+
+def length_delimited(data):
+    return write_varint(len(data)) + data
@@ -0,0 +1,91 @@
+"""
+Raw depth image files (<user_id>_<datetime>_depth in the raw store, see raw_store.py) are written by the server
+and read by the parsers:
+- header: DEPTH_MAGIC (which includes the format version), width, height (DEPTH_HEADER)
+- data: width * height little-endian float32 values, row by row - the layout of the packed DepthImage.data field,
+  so the server copies the field as it was sent, and readers map the file as it is with numpy.
+earlier servers wrote {"data": [values]} JSON files instead, which are still read.
+"""
+
+from .wire import walk_fields
+import json
+import numpy as np
+import os
+import struct
+
+DEPTH_MAGIC = b"CTXDEPT1"
+DEPTH_HEADER = '<8sII'  # magic, width, height
+DEPTH_HEADER_SIZE = struct.calcsize(DEPTH_HEADER)
+DEPTH_DTYPE = np.dtype('<f4')
+SNAPSHOT_DEPTH_IMAGE_FIELD = 4
+DEPTH_DATA_FIELD = 3
+
+
+def write_depth_image(path, data, width=0, height=0):
+    """
+    writes a raw depth image file (see depth_image_bytes).
+    """
+    with open(path, "wb") as f:
+        f.write(depth_image_bytes(data, width, height))
+
+
+def depth_image_bytes(data, width=0, height=0):
+    """
+    returns the content of a raw depth image file. `data` is either the bytes of little-endian float32 values
+    (such as the packed DepthImage.data field, see depth_data), or an array of values.
+    """
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        data = np.asarray(data, dtype=DEPTH_DTYPE).tobytes()
+    return struct.pack(DEPTH_HEADER, DEPTH_MAGIC, width, height) + data
+
+
+def read_depth_image(path, mmap=False):
+    """
+    returns the values of a raw depth image file as a float32 numpy array, of either the binary or the JSON format.
+    if `mmap` is True, binary files are memory-mapped (read-only) instead of read.
+    raises ValueError if the file is malformed.
+    """
+    with open(path, "rb") as f:
+        header = f.read(DEPTH_HEADER_SIZE)
+        if not header.startswith(DEPTH_MAGIC):
+            return np.array(json.loads(header + f.read())["data"], dtype=DEPTH_DTYPE)
+        if len(header) < DEPTH_HEADER_SIZE:
+            raise ValueError("truncated depth image header")
+        size = os.fstat(f.fileno()).st_size - DEPTH_HEADER_SIZE
+        if size % DEPTH_DTYPE.itemsize:
+            raise ValueError("truncated depth image data")
+        if mmap and size:
+            return np.memmap(f, dtype=DEPTH_DTYPE, mode="r", offset=DEPTH_HEADER_SIZE)
+        return depth_values(f.read())
+
+
+def depth_values(data):
+    """
+    returns the values of depth image data (the bytes of little-endian float32 values, without a header, as they
+    are embedded in messages to the parsers) as a float32 numpy array.
+    raises ValueError if the data is truncated.
+    """
+    if len(data) % DEPTH_DTYPE.itemsize:
+        raise ValueError("truncated depth image data")
+    return np.frombuffer(data, dtype=DEPTH_DTYPE)
+
+
+def depth_data(raw_snapshot):
+    """
+    returns the bytes of the depth image values of a serialized Snapshot, as little-endian float32 values, copied
+    from the message without deserializing it. values may be split across several depth image messages (they are
+    merged) and several packed fields, or not be packed at all.
+    raises ValueError if the snapshot is malformed.
+    """
+    data = []
+    for field_number, wire_type, value, _, _ in walk_fields(raw_snapshot):
+        if field_number != SNAPSHOT_DEPTH_IMAGE_FIELD or wire_type != 2:
+            continue
+        for image_field, image_wire_type, image_value, start, end in walk_fields(raw_snapshot, *value):
+            if image_field != DEPTH_DATA_FIELD:
+                continue
+            if image_wire_type == 2:
+                data.append(raw_snapshot[image_value[0]:image_value[1]])
+            elif image_wire_type == 5:
+                data.append(raw_snapshot[end - 4:end])
+    return b"".join(data)
@@ -0,0 +1,129 @@
+"""
+The raw store holds the raw files of snapshots (color and depth images) which the server writes and the parsers read.
+a file is named <user_id>_<datetime>_<kind>, and lives in a shard directory derived from a hash of its name:
+<root>/ab/cd/<user_id>_<datetime>_<kind>, so no directory holds more than a few dozen files even with millions of
+snapshots. the path of a file only depends on its name, so it is stable: MQ messages and stored results refer to it.
+in content-addressed stores the data of every file is stored once, as a blob named by its SHA-256 digest
+(<root>/blobs/ab/cd/<digest>), and the files are hard links to their blobs: identical images (of any snapshots and
+users) take the space of one. hard links keep the files where they are, so readers do not know about blobs.
+earlier servers wrote all files flat in <root>; they are still found, and can be moved into their shards (see
+RawStore.migrate, and locate for readers holding the old paths).
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import uuid
+
+SHARD_LEVELS = 2  # directory levels of a shard, each named by two hex digits of the hash of the file name
+BLOB_DIR = "blobs"
+RAW_FILE_MODE = 0o644  # readable by parsers running as other users, like files written with open()
+RAW_FILE_NAME = re.compile(r"^.+_\d+_(color|depth)$")  # files of snapshots, as opposed to the users' snapshot lists
+
+
+def shard(name):
+    digest = hashlib.sha1(name.encode()).hexdigest()
+    return os.path.join(*(digest[2 * level:2 * level + 2] for level in range(SHARD_LEVELS)))
+
+
+def locate(path):
+    """
+    returns the path of a raw file given the path it was published with: the path itself, unless the file was
+    written flat by an earlier server and moved into its shard since (see RawStore.migrate).
+    """
+    if os.path.exists(path):
+        return path
+    root, name = os.path.split(path)
+    sharded_path = os.path.join(root, shard(name), name)
+    return sharded_path if os.path.exists(sharded_path) else path
+
+
+class RawStore:
+    """
+    This class locates and writes the raw files of snapshots in the directory `root` (see above).
+    files are written atomically (to a temporary file which is then renamed), so readers never see partial files,
+    and a file which is written again never changes other files it shared data with.
+    """
+    def __init__(self, root, content_addressed=False):
+        self.root = root
+        self.content_addressed = content_addressed
+
+    def path(self, user_id, snapshot_datetime, kind):
+        """
+        returns the path of the raw file `kind` ("color" or "depth") of a snapshot, whether it exists or not.
+        """
+        name = "{}_{}_{}".format(user_id, snapshot_datetime, kind)
+        return os.path.join(self.root, shard(name), name)
+
+    def find(self, user_id, snapshot_datetime, kind):
+        """
+        returns the path of an existing raw file of a snapshot, either in its shard or written flat by an earlier
+        server. raises FileNotFoundError if there is no such file.
+        """
+        path = self.path(user_id, snapshot_datetime, kind)
+        flat_path = os.path.join(self.root, os.path.basename(path))
+        for candidate in (path, flat_path):
+            if os.path.exists(candidate):
+                return candidate
+        raise FileNotFoundError(path)
+
+    def write(self, path, data):
+        """
+        writes `data` (bytes) to the raw file at `path`. in content-addressed stores, `path` becomes a link to the
+        blob of `data`, which is only written if no other file holds the same data.
+        """
+        if not self.content_addressed:
+            self._write_file(path, data)
+            return
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = os.path.join(self.root, BLOB_DIR, shard(digest), digest)
+        if not os.path.exists(blob_path):
+            self._write_file(blob_path, data)
+        self.link(blob_path, path)
+
+    def link(self, source, path):
+        """
+        makes the raw file at `path` hold the same data as the one at `source`, by hard-linking it: no data is
+        written. falls back to copying on file systems without hard links.
+        raises FileNotFoundError if there is no file at `source`.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+        try:
+            os.link(source, temporary_path)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            shutil.copyfile(source, temporary_path)
+        os.replace(temporary_path, path)
+
+    def migrate(self):
+        """
+        moves the raw files which earlier servers wrote flat in the root directory into their shards.
+        returns the number of files moved.
+        """
+        moved = 0
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if not entry.is_file() or not RAW_FILE_NAME.match(entry.name):
+                    continue
+                path = os.path.join(self.root, shard(entry.name), entry.name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(entry.path, path)
+                moved += 1
+        return moved
+
+    def _write_file(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        try:
+            os.chmod(temporary_path, RAW_FILE_MODE)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
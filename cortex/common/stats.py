@@ -0,0 +1,100 @@
+import contextlib
+import json
+import random
+import threading
+import time
+
+PERCENTILES = [50, 90, 99]
+RESERVOIR_SIZE = 10000  # latency samples kept per stage for percentiles; later samples replace random ones
+
+
+class StageStats:
+    """
+    This class measures where a pipeline (such as a client upload, see cortex/client/stats.py, or the servers'
+    ingestion) spends its time, per stage, along with the snapshots and bytes it delivered.
+    every stage keeps its count, total and maximum time, and a reservoir of latency samples for percentiles.
+    stages run on different threads, so all updates are locked.
+    if `interval` is given, a JSON summary is printed every `interval` seconds while the pipeline runs.
+    """
+    def __init__(self, stages, interval=None):
+        self.stages = list(stages)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.reported_at = self.started_at
+        self.snapshots = 0
+        self.bytes = 0
+        self.counts = {stage: 0 for stage in self.stages}
+        self.totals = {stage: 0.0 for stage in self.stages}
+        self.maxima = {stage: 0.0 for stage in self.stages}  # kept apart, since the reservoir may evict the maximum
+        self.samples = {stage: [] for stage in self.stages}
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """
+        a context which adds the time spent inside it to `stage`.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def add(self, stage, seconds, snapshots=0, sent_bytes=0):
+        """
+        adds a measurement of `stage`. the stage which delivers snapshots (such as sending or publishing them)
+        also counts the snapshots and bytes it delivered.
+        """
+        with self.lock:
+            self.counts[stage] += 1
+            self.totals[stage] += seconds
+            self.maxima[stage] = max(self.maxima[stage], seconds)
+            samples = self.samples[stage]
+            if len(samples) < RESERVOIR_SIZE:
+                samples.append(seconds)
+            elif (index := random.randrange(self.counts[stage])) < RESERVOIR_SIZE:
+                samples[index] = seconds
+            self.snapshots += snapshots
+            self.bytes += sent_bytes
+            report = self.interval is not None and time.monotonic() - self.reported_at >= self.interval
+            if report:
+                self.reported_at = time.monotonic()
+        if report:
+            print(json.dumps(self.summary()))
+
+    def summary(self):
+        """
+        returns the measurements so far: the elapsed time, the snapshots and bytes sent and their throughput,
+        and for every stage its count, total and mean time, percentiles and maximum (seconds).
+        """
+        with self.lock:
+            seconds = time.monotonic() - self.started_at
+            stages = {}
+            for stage in self.stages:
+                samples = sorted(self.samples[stage])
+                stages[stage] = {
+                    "count": self.counts[stage],
+                    "total_seconds": self.totals[stage],
+                    "mean_seconds": self.totals[stage] / self.counts[stage] if self.counts[stage] else 0,
+                    "max_seconds": self.maxima[stage],
+                }
+                for percentile in PERCENTILES:
+                    stages[stage]["p{}_seconds".format(percentile)] = percentile_of(samples, percentile)
+            return {
+                "seconds": seconds,
+                "snapshots": self.snapshots,
+                "bytes": self.bytes,
+                "snapshots_per_second": self.snapshots / seconds if seconds else 0,
+                "megabytes_per_second": self.bytes / 1e6 / seconds if seconds else 0,
+                "stages": stages,
+            }
+
+
+def percentile_of(samples, percentile):
+    """
+    returns the `percentile` (nearest rank) of sorted `samples`, or 0 if there are none.
+    """
+    if not samples:
+        return 0
+    rank = max(1, -(-percentile * len(samples) // 100))
+    return samples[rank - 1]
@@ -0,0 +1,65 @@
+"""
+helpers for reading and writing the protobuf wire format directly, without deserializing messages.
+"""
+
+
+def walk_fields(data, offset=0, end=None):
+    """
+    a generator of the fields of a serialized protobuf message in data[offset:end], without deserializing them:
+    (field number, wire type, value, field start, field end), where the value of a varint field is its integer,
+    the value of a length-delimited field (a nested message, bytes or a packed field) is the (start, end) of its
+    content, and the value of a fixed size field is None. the start and end include the key of the field.
+    raises ValueError if a field is truncated or has an unsupported wire type.
+    """
+    end = len(data) if end is None else end
+    while offset < end:
+        start = offset
+        key, offset = read_varint(data, offset)
+        field_number, wire_type = key >> 3, key & 0x7
+        value = None
+        if wire_type == 0:
+            value, offset = read_varint(data, offset)
+        elif wire_type == 1:
+            offset += 8
+        elif wire_type == 2:
+            field_size, offset = read_varint(data, offset)
+            value = (offset, offset + field_size)
+            offset += field_size
+        elif wire_type == 5:
+            offset += 4
+        else:
+            raise ValueError("field {} has unsupported wire type {}".format(field_number, wire_type))
+        if offset > end:
+            raise ValueError("field {} exceeds the message size".format(field_number))
+        yield field_number, wire_type, value, start, offset
+
+
+def read_varint(data, offset):
+    """
+    decodes a protobuf varint starting at data[offset]. returns the value and the offset following it.
+    """
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise ValueError("truncated varint")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+        if shift >= 64:
+            raise ValueError("varint is too long")
+
+
+def write_varint(value):
+    """
+    encodes a non-negative integer as a protobuf varint.
+    """
+    data = bytearray()
+    while value > 0x7f:
+        data.append(value & 0x7f | 0x80)
+        value >>= 7
+    data.append(value)
+    return bytes(data)
@@ -1,10 +1,11 @@
 import click
 from click.exceptions import UsageError
 from .parsers import run_parser_wrapper
+from ..common.codec import CONTENT_TYPES
 import sys
 
 USAGE_ERROR = "Usage Error:\npython -m cortex.parsers parse '<parser_name>' '<data>' \n" \
-              "python -m cortex.parsers run-parser '<parser_name>' '<message_queue_url>'"
+              "python -m cortex.parsers run-parser [--codec envelope/json] '<parser_name>' '<message_queue_url>'"
 
 
 def _show_usage_error(self, file=None):
@@ -18,13 +19,14 @@ UsageError.show = _show_usage_error
 @click.argument('action', required=True)
 @click.argument('parser_name', required=True)
 @click.argument('arg2', required=True)  # can be data to parse or a message_queue URL
-def parser(action, parser_name, arg2):
+@click.option('--codec', 'codec_name', default="envelope", type=click.Choice(list(CONTENT_TYPES)))
+def parser(action, parser_name, arg2, codec_name):
     if action == "parse":
         return run_parser_wrapper(parser_name, data=arg2, action="once")
         # return run_parser(parser_name, data)
     if action == "run-parser":
         # run_parser_service(parser_name, arg2)
-        run_parser_wrapper(parser_name, mq=arg2, action="service")
+        run_parser_wrapper(parser_name, mq=arg2, action="service", content_type=CONTENT_TYPES[codec_name])
 
     else:
         print(USAGE_ERROR)
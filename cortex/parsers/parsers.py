@@ -1,7 +1,9 @@
 from .cortex_pb2 import *
+from ..common import codec
+from ..common.depth import depth_values, read_depth_image
+from ..common.raw_store import locate
 from datetime import datetime
 import os
-import json
 import logging
 import numpy as np
 import pika
@@ -33,11 +35,13 @@ def init_logger(parser_name):
     logging.getLogger("pika").setLevel(logging.WARNING)
 
 
-def run_parser_wrapper(parser_name, data=None, mq=None, action="once"):
+def run_parser_wrapper(parser_name, data=None, mq=None, action="once", content_type=codec.DEFAULT_CONTENT_TYPE):
     """
     will run a parser one time or as a service according to specified type.
     data will be used if running once.
     mq will be the MQ address if running as service.
+    content_type is the codec which the service publishes its results with when the message it parsed has no
+    content type (see cortex/common/codec.py); otherwise results are published in the codec of the message.
     """
     parser_name = parser_name.replace('-', '_')
 
@@ -66,10 +70,10 @@ def run_parser_wrapper(parser_name, data=None, mq=None, action="once"):
             exit_run("Unsupported MQ URL. \n Please use one of the following MQ Types: {} \n MQ URL: type://host:port"
                      .format(SUPPORTED_QUEUE))
 
-        run_parser_service(parser_name, mq_host, mq_port)
+        run_parser_service(parser_name, mq_host, mq_port, content_type)
 
 
-def run_parser_service(parser_name, mq_host, mq_port):
+def run_parser_service(parser_name, mq_host, mq_port, content_type=codec.DEFAULT_CONTENT_TYPE):
     """
     This function is called by __main__ whenever the user wants to start a parser indefinitely,
     without specific data to consume. the process connects to the MQ and starts consuming
@@ -90,17 +94,21 @@ def run_parser_service(parser_name, mq_host, mq_port):
             the data is forwarded to the appropriate parser which returns the results,
             and then the result is published to the MQ, exchange name EXCHANGE_PUBLISH,
             and the topic name is the parser name.
+            messages are decoded according to their content type, and results are encoded by the same codec, or by
+            the codec of `content_type` if the message has no content type. it is set as the content type of results.
             """
-            result = run_parser(parser_name, body)
+            result = parse_message(parser_name, body, properties.content_type)
             if result is None:
                 return
-            result_dict = json.loads(result)
+            result_content_type = properties.content_type or content_type
             publish_channel = connection.channel()
             publish_channel.exchange_declare(exchange=EXCHANGE_PUBLISH, exchange_type='topic')
             routing_key = parser_name
             logging.debug("Publishing Back to MQ Data processed by {}, user {}, Snapshot {}"
-                          .format(parser_name, result_dict["user_id"], result_dict["datetime"]))
-            publish_channel.basic_publish(exchange=EXCHANGE_PUBLISH, routing_key=routing_key, body=result)
+                          .format(parser_name, result["user_id"], result["datetime"]))
+            publish_channel.basic_publish(exchange=EXCHANGE_PUBLISH, routing_key=routing_key,
+                                          body=codec.encode(result, result_content_type),
+                                          properties=pika.BasicProperties(content_type=result_content_type))
 
         channel.basic_consume(queue=parser_name, on_message_callback=parser_callback, auto_ack=True)
         print("{}: Starting to consume".format(parser_name))
@@ -111,14 +119,30 @@ def run_parser_service(parser_name, mq_host, mq_port):
         exit_run("Error in run_parser_service: {}".format(e))
 
 
-def run_parser(parser_name, data):
+def run_parser(parser_name, data, content_type=None):
     """
     runs a parser one time on given data.
-    used by __main___ whenever a user wants to run a parser on data,
-    or by run_parser_service whenever a new message is consumed from some queue.
+    used by __main___ whenever a user wants to run a parser on data.
+    the data is a message encoded by the codec of `content_type` (JSON by default, see cortex/common/codec.py),
+    and the result is encoded by the same codec. returns None if the message is malformed or the parser failed.
     """
+    result = parse_message(parser_name, data, content_type)
+    return None if result is None else codec.encode(result, content_type or codec.JSON)
+
+
+def parse_message(parser_name, data, content_type=None):
+    """
+    decodes a message encoded by the codec of `content_type` (JSON by default), and runs a parser on it.
+    used by run_parser_service whenever a new message is consumed from some queue.
+    returns the result of the parser (a dictionary), or None if the message is malformed or the parser failed.
+    """
+    try:
+        message = codec.decode(data, content_type)
+    except ValueError as e:
+        logging.error("Received malformed message for parser {}: {}".format(parser_name, e))
+        return None
     parsers = globals()["PARSERS"]
-    return parsers[parser_name](data)
+    return parsers[parser_name](message)
 
 
 def error_list_parsers():
@@ -138,12 +162,33 @@ def parser(func):
     return func
 
 
+def color_image_data(snapshot_json):
+    """
+    returns the raw color image of a snapshot message: embedded in the message if the server inlined it,
+    or read from the raw file the message refers to.
+    """
+    if "color_image_data" in snapshot_json:
+        return snapshot_json["color_image_data"]
+    with open(locate(snapshot_json["color_image_path"]), "rb") as f:
+        return f.read()
+
+
+def depth_image_values(snapshot_json):
+    """
+    returns the values of the depth image of a snapshot message as a float32 numpy array: embedded in the message
+    if the server inlined it, or mapped from the raw file the message refers to.
+    raises ValueError if the image is malformed.
+    """
+    if "depth_image_data" in snapshot_json:
+        return depth_values(snapshot_json["depth_image_data"])
+    return read_depth_image(locate(snapshot_json["depth_image_path"]), mmap=True)
+
+
 @parser
-def pose(data):
+def pose(snapshot_json):
     """
-    pose parser. receives JSON string from the MQ, extracts the pose parameters and returns a JSON String.
+    pose parser. receives a snapshot message from the MQ, extracts the pose parameters and returns them.
     """
-    snapshot_json = json.loads(data)
     logging.debug("Received Snapshot from user {}, Snapshot {}"
                   .format(snapshot_json["user_id"], snapshot_json["datetime"]))
     try:
@@ -188,7 +233,7 @@ def pose(data):
             "translation_path": translation_path,
         }
 
-        return json.dumps(result)
+        return result
     except KeyError as e:
         logging.error("Snapshot {} from user {} did not contain necessary pose data: {}"
                       .format(snapshot_json["datetime"], snapshot_json["user_id"], e))
@@ -196,19 +241,17 @@ def pose(data):
 
 
 @parser
-def color_image(data):
+def color_image(snapshot_json):
     """
-    color image parser. receives JSON string from the MQ,
+    color image parser. receives a snapshot message from the MQ,
     saves the raw binary color image data as an actual image,
-    and publishes its new location and size as a JSON string.
+    and publishes its new location and size.
     """
-    snapshot_json = json.loads(data)
     logging.debug("Received Snapshot from user {}, Snapshot {}"
                   .format(snapshot_json["user_id"], snapshot_json["datetime"]))
 
     try:
-        with open(snapshot_json["color_image_path"], "rb") as f:
-            image_bytes = f.read()
+        image_bytes = color_image_data(snapshot_json)
         pathlib.Path(PROCESSED_DIRECTORY).mkdir(parents=True, exist_ok=True)
         final_path = "{}/{}_{}_color.jpg".format(PROCESSED_DIRECTORY, snapshot_json["user_id"],
                                                  snapshot_json["datetime"])
@@ -222,7 +265,7 @@ def color_image(data):
             "height": snapshot_json["color_image_height"],
             "width": snapshot_json["color_image_width"],
         }
-        return json.dumps(result)
+        return result
 
     except KeyError as e:
         logging.error("Error: Snapshot {} from user {} did not contain necessary color image data: {}"
@@ -235,20 +278,16 @@ def color_image(data):
 
 
 @parser
-def depth_image(data):
+def depth_image(snapshot_json):
     """
-    depth image parser. receives JSON string from the MQ,
+    depth image parser. receives a snapshot message from the MQ,
     saves the raw binary depth image data as an actual image,
-    and publishes its new location and size as a JSON string.
+    and publishes its new location and size.
     """
-    snapshot_json = json.loads(data)
     logging.debug("Received Snapshot from user {}, Snapshot {}"
                   .format(snapshot_json["user_id"], snapshot_json["datetime"]))
     try:
-        with open(snapshot_json["depth_image_path"], "r") as f:
-            serialized = f.read()
-            data_json = json.loads(serialized)
-            image_array = data_json["data"]
+        image_array = depth_image_values(snapshot_json)
 
         final_path = "{}/{}_{}_depth.jpg".format(PROCESSED_DIRECTORY, snapshot_json["user_id"],
                                                  snapshot_json["datetime"])
@@ -269,7 +308,7 @@ def depth_image(data):
             "width": snapshot_json["depth_image_width"],
             "depth_image_path": final_path,
         }
-        return json.dumps(result)
+        return result
     except KeyError as e:
         logging.error("Snapshot {} from user {} did not have necessary depth image data: {}"
                       .format(snapshot_json["datetime"], snapshot_json["user_id"], e))
@@ -280,13 +319,17 @@ def depth_image(data):
                       .format(snapshot_json["datetime"], snapshot_json["user_id"], e))
         None
 
+    except ValueError as e:
+        logging.error("Error: malformed depth image of snapshot {} by user {}: {}"
+                      .format(snapshot_json["datetime"], snapshot_json["user_id"], e))
+        return None
+
 
 @parser
-def feelings(data):
+def feelings(snapshot_json):
     """
-    feelings parser. receives JSON string data from the MQ, publishes back the feelings as JSON string.
+    feelings parser. receives a snapshot message from the MQ, publishes back the feelings.
     """
-    snapshot_json = json.loads(data)
     logging.debug("Received Snapshot from user {}, Snapshot {}"
                   .format(snapshot_json["user_id"], snapshot_json["datetime"]))
     try:
@@ -298,7 +341,7 @@ def feelings(data):
             "hunger": snapshot_json["hunger"],
             "exhaustion": snapshot_json["exhaustion"],
         }
-        return json.dumps(result)
+        return result
     except KeyError as e:
         logging.error("Snapshot {} by user {} did not contain all necessary feelings data: {}"
                       .format(snapshot_json["datetime"], snapshot_json["user_id"], e))
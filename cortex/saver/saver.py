@@ -1,6 +1,6 @@
+from ..common import codec
 from pymongo import MongoClient
 import pika
-import json
 from datetime import datetime
 import logging
 import os
@@ -42,10 +42,11 @@ class Saver:
         except Exception as e:
             exit_run("Error connecting to MongoDB: {}".format(e))
 
-    def save(self, topic, data):
+    def save(self, topic, data, content_type=None):
         """
         This function connects to the collection "topic" in self.db,
         checks if the message already exists, and if not - registers it in the topic.
+        the data is a message encoded by the codec of `content_type` (JSON by default, see cortex/common/codec.py).
         if the message is a parser result, the function will also reister the general snapshots in the "snapshots"
         collection.
         """
@@ -54,7 +55,7 @@ class Saver:
         try:
             collection = self.db[topic]
             try:
-                message_content = json.loads(data)
+                message_content = codec.decode(data, content_type)
             except ValueError as e:
                 logging.error("Received wrong data: {}".format(e))
                 return None
@@ -129,7 +130,7 @@ def run_saver_wrapper(database_url, mq_url):
 
         def callback(ch, method, properties, body):
             saver = Saver(database_url)
-            return saver.save(method.routing_key, body)
+            return saver.save(method.routing_key, body, properties.content_type)
 
         channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
         channel.start_consuming()
@@ -1 +1 @@
-from .server import run_server
+from .server import run_server, run_grpc_server, migrate_raw_store
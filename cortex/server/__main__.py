@@ -1,9 +1,15 @@
 import click
 from click.exceptions import UsageError
-from .server import run_server
+from .admission import ADMISSION_CONCURRENCY, ADMISSION_QUEUE_SIZE
+from .server import run_server, run_grpc_server, migrate_raw_store
+from ..common.codec import CONTENT_TYPES
 import sys
 
-USAGE_ERROR = "Usage Error: python -m cortex.server -h/--host <SERVER_HOST> -p/--port <PORT_NUMBER> <MESSAGE_QUEUE_URL>"
+USAGE_ERROR = "Usage Error: python -m cortex.server run-server/run-grpc-server -h/--host <SERVER_HOST> " \
+              "-p/--port <PORT_NUMBER> [--content-addressed] [--codec envelope/json] [--inline-threshold <BYTES>] " \
+              "[--concurrency <REQUESTS>] [--queue-size <REQUESTS>] [--workers <PROCESSES>] " \
+              "[--ack-after-write] <MESSAGE_QUEUE_URL>\n" \
+              "python -m cortex.server migrate-raw-store"
 
 
 def _show_usage_error(self):
@@ -17,10 +23,29 @@ UsageError.show = _show_usage_error
 @click.argument('action')
 @click.option('-h', '--host', default="127.0.0.1")
 @click.option('-p', '--port', default=8000)
+@click.option('--content-addressed', is_flag=True, default=False)
+@click.option('--codec', 'codec_name', default="envelope", type=click.Choice(list(CONTENT_TYPES)))
+@click.option('--inline-threshold', default=0, type=click.IntRange(min=0))
+@click.option('--concurrency', default=ADMISSION_CONCURRENCY, type=click.IntRange(min=1))
+@click.option('--queue-size', default=ADMISSION_QUEUE_SIZE, type=click.IntRange(min=0))
+@click.option('--workers', default=1, type=click.IntRange(min=1))
+@click.option('--ack-after-write', is_flag=True, default=False)
 @click.argument('message_queue', default="rabbitmq://127.0.0.1:5672/")
-def parser(action, host, port, message_queue):
+def parser(action, host, port, content_addressed, codec_name, inline_threshold, concurrency, queue_size, workers,
+           ack_after_write, message_queue):
     if action == "run-server":
-        run_server(host, port, message_queue, publish_method="message_queue")
+        run_server(host, port, message_queue, publish_method="message_queue", content_addressed=content_addressed,
+                   content_type=CONTENT_TYPES[codec_name], inline_threshold=inline_threshold,
+                   concurrency=concurrency, queue_size=queue_size, workers=workers,
+                   ack_after_write=ack_after_write)
+
+    elif action == "run-grpc-server":
+        run_grpc_server(host, port, message_queue, publish_method="message_queue",
+                        content_addressed=content_addressed, content_type=CONTENT_TYPES[codec_name],
+                        inline_threshold=inline_threshold)
+
+    elif action == "migrate-raw-store":
+        migrate_raw_store()
 
     else:
         print(USAGE_ERROR)
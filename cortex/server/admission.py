@@ -0,0 +1,88 @@
+from ..common.stats import StageStats
+import contextlib
+import threading
+import time
+
+ADMISSION_CONCURRENCY = 8  # requests handled at once
+ADMISSION_QUEUE_SIZE = 32  # requests waiting for their turn, beyond which new requests are rejected
+ADMISSION_TIMEOUT = 10  # seconds a request waits for its turn before it is rejected
+
+
+class Overloaded(Exception):
+	"""
+	raised when a request is not admitted: too many requests are waiting, or it waited too long.
+	"""
+
+
+class Admission:
+	"""
+	This class is the admission control of the server: up to `concurrency` requests are handled at once, and up to
+	`queue_size` more wait (up to `timeout` seconds) for one of them to complete. requests beyond that are rejected
+	right away, without reading their bodies, so a burst is answered with fast rejections which clients retry
+	later, instead of piling up requests (and their data) in memory until disk writes and the MQ time out.
+	it keeps metrics of its queue (see summary), and the time requests waited and were handled.
+	"""
+	def __init__(self, concurrency=ADMISSION_CONCURRENCY, queue_size=ADMISSION_QUEUE_SIZE, timeout=ADMISSION_TIMEOUT):
+		self.concurrency = concurrency
+		self.queue_size = queue_size
+		self.timeout = timeout
+		self.condition = threading.Condition()
+		self.running = 0
+		self.queued = 0
+		self.max_queued = 0  # the deepest the queue has been
+		self.admitted = 0
+		self.rejected = 0  # requests which found the queue full
+		self.timed_out = 0  # requests which waited longer than `timeout`
+		self.stats = StageStats(["wait", "handle"])
+
+	@contextlib.contextmanager
+	def admit(self):
+		"""
+		a context which is entered once the request is admitted, and handles it.
+		raises Overloaded if the request is not admitted.
+		"""
+		started = time.perf_counter()
+		with self.condition:
+			# requests which arrive while others are waiting join the queue, rather than overtaking them
+			if self.running >= self.concurrency or self.queued:
+				if self.queued >= self.queue_size:
+					self.rejected += 1
+					raise Overloaded("{} requests are waiting to be handled".format(self.queued))
+				self.queued += 1
+				self.max_queued = max(self.max_queued, self.queued)
+				try:
+					admitted = self.condition.wait_for(lambda: self.running < self.concurrency, self.timeout)
+				finally:
+					self.queued -= 1
+				if not admitted:
+					self.timed_out += 1
+					raise Overloaded("no request was handled for {} seconds".format(self.timeout))
+			self.running += 1
+			self.admitted += 1
+		self.stats.add("wait", time.perf_counter() - started)
+		try:
+			with self.stats.timer("handle"):
+				yield
+		finally:
+			with self.condition:
+				self.running -= 1
+				self.condition.notify()
+
+	def summary(self):
+		"""
+		returns the limits, the requests currently handled and waiting, the counts of requests admitted and
+		rejected, and the time requests waited and were handled (see StageStats.summary).
+		"""
+		with self.condition:
+			summary = {
+				"concurrency": self.concurrency,
+				"queue_size": self.queue_size,
+				"running": self.running,
+				"queued": self.queued,
+				"max_queued": self.max_queued,
+				"admitted": self.admitted,
+				"rejected": self.rejected,
+				"timed_out": self.timed_out,
+			}
+		summary.update(self.stats.summary()["stages"])
+		return summary
@@ -0,0 +1,165 @@
+import logging
+import os
+import select
+import signal
+import socket
+import time
+
+LISTEN_BACKLOG = 128  # connections waiting to be accepted by a worker
+RESPAWN_DELAY = 1  # seconds before a worker which exited unexpectedly is replaced
+READY_TIMEOUT = 30  # seconds the workers of a restart are given to accept connections before the old ones stop
+POLL_INTERVAL = 0.2  # seconds between checks of the workers by the master process
+
+
+class Prefork:
+	"""
+	This class runs a pre-forked server: a master process which forks `workers` worker processes, each running
+	serve(ready) until it is asked to stop with SIGTERM. serve calls ready() once it accepts connections.
+	workers bind their own listening sockets to the same port with SO_REUSEPORT (see listening_socket), so the
+	kernel spreads connections among them, and each of them parses, writes and publishes on its own interpreter.
+	the master holds no threads or connections: all a worker uses (such as its MQ publisher) is created in it.
+	- workers which exit unexpectedly are replaced.
+	- SIGHUP restarts the workers gracefully: a new generation of workers is forked, and once it accepts
+	  connections, the previous workers stop accepting them, complete the requests they are handling, and exit.
+	  workers are forked from the master, so they run the code the master started with.
+	- SIGTERM and SIGINT stop the workers gracefully, and then the master.
+	"""
+	def __init__(self, workers, serve):
+		self.workers = workers
+		self.serve = serve
+		self.pids = set()  # the current generation of workers
+		self.retiring = set()  # workers of previous generations, which are stopping
+		self.restarting = False
+		self.stopping = False
+
+	def run(self):
+		"""
+		forks the workers, and watches them until the master is stopped. this is blocking!
+		"""
+		signal.signal(signal.SIGHUP, self._restart)
+		signal.signal(signal.SIGTERM, self._stop)
+		signal.signal(signal.SIGINT, self._stop)
+		self._spawn(self.workers)
+		while not self.stopping:
+			if self.restarting:
+				self.restarting = False
+				logging.info("Restarting {} workers".format(self.workers))
+				self.retiring |= self.pids
+				self.pids = set()
+				self._wait_ready(self._spawn(self.workers))
+				self._signal(self.retiring, signal.SIGTERM)
+			self._reap()
+			time.sleep(POLL_INTERVAL)
+		logging.info("Stopping {} workers".format(len(self.pids | self.retiring)))
+		self._signal(self.pids | self.retiring, signal.SIGTERM)
+		self._reap(block=True)
+
+	def _restart(self, signum, frame):
+		self.restarting = True
+
+	def _stop(self, signum, frame):
+		self.stopping = True
+
+	def _spawn(self, count):
+		"""
+		forks `count` workers. returns the file descriptors which every worker writes to once it is ready.
+		"""
+		ready_fds = []
+		for _ in range(count):
+			read_fd, write_fd = os.pipe()
+			pid = os.fork()
+			if pid == 0:
+				os.close(read_fd)
+				self._run_worker(write_fd)
+			os.close(write_fd)
+			ready_fds.append(read_fd)
+			self.pids.add(pid)
+			logging.debug("Started worker {}".format(pid))
+		return ready_fds
+
+	def _run_worker(self, ready_fd):
+		"""
+		runs serve in a forked worker, and exits the worker once it returns.
+		"""
+		signal.signal(signal.SIGHUP, signal.SIG_IGN)
+		signal.signal(signal.SIGTERM, signal.SIG_DFL)
+		signal.signal(signal.SIGINT, signal.default_int_handler)
+		status = 0
+		try:
+			self.serve(lambda: os.write(ready_fd, b"\x01"))
+		except SystemExit as e:  # exit_run exits workers which can not serve
+			status = e.code if isinstance(e.code, int) else 1
+		except KeyboardInterrupt:  # Ctrl-C reaches the workers as well, and stops them like SIGTERM
+			status = 0
+		except BaseException as e:
+			logging.error("Worker {} failed: {}".format(os.getpid(), e))
+			status = 1
+		finally:
+			os._exit(status)
+
+	def _wait_ready(self, ready_fds):
+		"""
+		waits (up to READY_TIMEOUT seconds) until every worker of `ready_fds` is ready or exited.
+		"""
+		deadline = time.monotonic() + READY_TIMEOUT
+		while ready_fds and time.monotonic() < deadline:
+			readable, _, _ = select.select(ready_fds, [], [], deadline - time.monotonic())
+			for fd in readable:
+				os.read(fd, 1)  # a byte if the worker is ready, nothing if it exited
+				os.close(fd)
+				ready_fds.remove(fd)
+		for fd in ready_fds:
+			os.close(fd)
+
+	def _signal(self, pids, signum):
+		for pid in pids:
+			try:
+				os.kill(pid, signum)
+			except ProcessLookupError:
+				pass
+
+	def _reap(self, block=False):
+		"""
+		collects the workers which exited, and replaces the workers of the current generation which exited
+		unexpectedly. if `block` is True, waits until all workers exited.
+		"""
+		while self.pids or self.retiring:
+			try:
+				pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+			except ChildProcessError:
+				self.pids, self.retiring = set(), set()
+				return
+			if pid == 0:
+				return
+			self.retiring.discard(pid)
+			if pid in self.pids:
+				self.pids.discard(pid)
+				if not self.stopping:
+					code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+					logging.error("Worker {} exited with status {}, replacing it".format(pid, code))
+					time.sleep(RESPAWN_DELAY)
+					for fd in self._spawn(1):
+						os.close(fd)
+
+
+def listening_socket(host, port, listen=True):
+	"""
+	returns a TCP socket bound to host:port with SO_REUSEPORT, so the sockets of all workers share the port, and
+	listening unless `listen` is False (sockets which do not listen do not receive connections).
+	raises OSError if the port is taken by a process which did not set SO_REUSEPORT, or if the platform does not
+	support it.
+	"""
+	if not hasattr(socket, "SO_REUSEPORT"):
+		raise OSError("SO_REUSEPORT is not supported on this platform")
+	family, kind, protocol, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+	listener = socket.socket(family, kind, protocol)
+	try:
+		listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+		listener.bind(address)
+		if listen:
+			listener.listen(LISTEN_BACKLOG)
+	except OSError:
+		listener.close()
+		raise
+	return listener
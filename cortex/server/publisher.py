@@ -0,0 +1,221 @@
+from collections import deque
+from concurrent.futures import Future, wait
+import itertools
+import logging
+import pika
+import pika.exceptions
+import pika.spec
+import threading
+import time
+
+PUBLISHER_CONNECTIONS = 4  # long-lived connections to the MQ, each with its own I/O thread and channel
+CONNECT_TIMEOUT = 10.0  # seconds to wait for the connections at startup, before serving without them
+CONFIRM_TIMEOUT = 30.0  # seconds to wait for the MQ to confirm published messages
+RECONNECT_DELAY = 0.5  # seconds before reconnecting a lost connection; doubles with every failed attempt
+RECONNECT_DELAY_MAX = 10.0
+
+
+class Publisher:
+	"""
+	This class publishes messages to a RabbitMQ server over a pool of `connections` long-lived connections.
+	every connection declares the `exchanges` ({name: exchange type}) once, when it opens, and puts its channel in
+	confirm mode: the MQ acknowledges published messages asynchronously, usually many at once, so a batch of
+	messages costs a single wait for its confirms instead of a round trip per message.
+	lost connections are reconnected, and messages which were not confirmed yet are published again.
+	the publisher is shared by all the request handling threads: pika connections are not thread-safe, so every
+	connection is only touched by its own I/O thread, and other threads hand messages over to it.
+	"""
+	def __init__(self, host, port, exchanges, connections=PUBLISHER_CONNECTIONS):
+		self.connections = [PublisherConnection(host, port, exchanges) for _ in range(connections)]
+		self.next = itertools.count()
+
+	def start(self, timeout=CONNECT_TIMEOUT):
+		"""
+		starts all connections, and waits up to `timeout` seconds for them to be ready.
+		returns whether they all are; those which are not keep trying to connect.
+		"""
+		for connection in self.connections:
+			connection.start()
+		deadline = time.monotonic() + timeout
+		return all(connection.ready.wait(max(0.0, deadline - time.monotonic())) for connection in self.connections)
+
+	def publish(self, exchange, routing_key, messages, timeout=CONFIRM_TIMEOUT, content_type=None):
+		"""
+		publishes `messages` to `exchange` with `routing_key` over one of the connections (preferably a ready one),
+		and waits until the MQ confirmed all of them. `content_type` is set as the content type of the messages.
+		raises ConnectionError if the MQ rejected a message, and TimeoutError if they were not confirmed in time.
+		"""
+		ready = [connection for connection in self.connections if connection.ready.is_set()] or self.connections
+		connection = ready[next(self.next) % len(ready)]
+		futures = connection.publish(exchange, routing_key, messages, content_type)
+		_, not_confirmed = wait(futures, timeout)
+		if not_confirmed:
+			raise TimeoutError("{} of {} messages were not confirmed within {}s"
+							   .format(len(not_confirmed), len(futures), timeout))
+		for future in futures:
+			future.result()
+
+	def close(self):
+		for connection in self.connections:
+			connection.stop()
+		for connection in self.connections:
+			connection.join()
+
+
+class PublisherConnection(threading.Thread):
+	"""
+	a single connection of the Publisher, run by its own I/O thread (a pika SelectConnection and its ioloop).
+	messages wait in `queue` until the channel is ready, and then in `unconfirmed` (by delivery tag) until the MQ
+	confirms them. every message has a future, which is resolved when it is confirmed, or failed if it is rejected.
+	"""
+	def __init__(self, host, port, exchanges):
+		super().__init__(daemon=True)
+		self.parameters = pika.ConnectionParameters(host, port)
+		self.exchanges = dict(exchanges)
+		self.lock = threading.Lock()  # guards the queue and the connection, which other threads hand messages to
+		self.queue = deque()  # (exchange, routing key, body, properties, future) waiting to be published
+		self.unconfirmed = {}  # delivery tag: (exchange, routing key, body, properties, future), touched by the I/O
+		# thread only
+		self.delivery_tag = 0
+		self.connection = None
+		self.channel = None
+		self.ready = threading.Event()
+		self.stopping = False
+
+	def publish(self, exchange, routing_key, messages, content_type=None):
+		"""
+		hands messages over to the I/O thread. returns a future per message.
+		"""
+		futures = []
+		properties = pika.BasicProperties(content_type=content_type)
+		with self.lock:
+			for message in messages:
+				futures.append(Future())
+				self.queue.append((exchange, routing_key, message, properties, futures[-1]))
+			connection = self.connection
+		if connection is not None:
+			try:
+				connection.ioloop.add_callback_threadsafe(self._flush)
+			except pika.exceptions.AMQPError:
+				pass  # the connection is closing: the messages are published once it reconnects
+		return futures
+
+	def stop(self):
+		self.stopping = True
+		with self.lock:
+			connection = self.connection
+		if connection is not None:
+			connection.ioloop.add_callback_threadsafe(lambda: self._close(connection))
+
+	def run(self):
+		delay = RECONNECT_DELAY
+		while not self.stopping:
+			connection = pika.SelectConnection(self.parameters, on_open_callback=self._on_open,
+											   on_open_error_callback=self._on_open_error,
+											   on_close_callback=self._on_close)
+			with self.lock:
+				self.connection = connection
+			connection.ioloop.start()  # runs until the connection is closed
+			with self.lock:
+				self.connection = None
+			if self.stopping:
+				break
+			delay = RECONNECT_DELAY if self.ready.is_set() else min(2 * delay, RECONNECT_DELAY_MAX)
+			self.ready.clear()
+			time.sleep(delay)
+
+		with self.lock:
+			abandoned = list(self.queue)
+			self.queue.clear()
+		for _, _, _, _, future in abandoned:
+			future.set_exception(ConnectionError("the publisher was closed"))
+
+	def _on_open(self, connection):
+		connection.channel(on_open_callback=self._on_channel_open)
+
+	def _on_open_error(self, connection, error):
+		logging.warning("Could not connect to MQ at {}:{}: {}".format(self.parameters.host, self.parameters.port,
+																	   error))
+		connection.ioloop.stop()
+
+	def _on_close(self, connection, reason):
+		"""
+		messages which were published but not confirmed are queued again, ahead of the others, to be published
+		once the connection is back.
+		"""
+		if not self.stopping:
+			logging.warning("Connection to MQ closed: {}".format(reason))
+		self.channel = None
+		with self.lock:
+			self.queue.extendleft(reversed(list(self.unconfirmed.values())))
+		self.unconfirmed.clear()
+		connection.ioloop.stop()
+
+	def _on_channel_open(self, channel):
+		self.channel = channel
+		channel.add_on_close_callback(self._on_channel_closed)
+		self._declare(list(self.exchanges.items()))
+
+	def _on_channel_closed(self, channel, reason):
+		# a closed channel (such as an exchange declared with another type) is recovered with a new connection
+		if self.connection is not None and self.connection.is_open:
+			self.connection.close()
+
+	def _declare(self, exchanges):
+		if not exchanges:
+			self.channel.confirm_delivery(self._on_confirmation, callback=self._on_confirm_mode)
+			return
+		(exchange, exchange_type), remaining = exchanges[0], exchanges[1:]
+		self.channel.exchange_declare(exchange=exchange, exchange_type=exchange_type,
+									  callback=lambda _: self._declare(remaining))
+
+	def _on_confirm_mode(self, _):
+		self.delivery_tag = 0  # delivery tags are counted per channel
+		self.ready.set()
+		logging.debug("Connected to MQ at {}:{}".format(self.parameters.host, self.parameters.port))
+		self._flush()
+
+	def _flush(self):
+		"""
+		publishes the queued messages. runs on the I/O thread.
+		"""
+		if self.channel is None or not self.ready.is_set():
+			return
+		while True:
+			with self.lock:
+				if not self.queue:
+					return
+				message = self.queue.popleft()
+			exchange, routing_key, body, properties, _ = message
+			self.delivery_tag += 1
+			self.unconfirmed[self.delivery_tag] = message
+			try:
+				self.channel.basic_publish(exchange, routing_key, body, properties)
+			except pika.exceptions.AMQPError:
+				return  # the channel is closing: unconfirmed messages are queued again when the connection closes
+
+	def _on_confirmation(self, frame):
+		"""
+		resolves the futures of the messages the MQ acknowledged (or rejected): a single confirm covers all
+		messages up to its delivery tag if it is 'multiple'.
+		"""
+		method = frame.method
+		acknowledged = isinstance(method, pika.spec.Basic.Ack)
+		if method.multiple:
+			tags = [tag for tag in self.unconfirmed if tag <= method.delivery_tag]
+		else:
+			tags = [method.delivery_tag]
+		for tag in tags:
+			message = self.unconfirmed.pop(tag, None)
+			if message is None:
+				continue
+			if acknowledged:
+				message[-1].set_result(None)
+			else:
+				message[-1].set_exception(ConnectionError("the MQ rejected the message"))
+
+	def _close(self, connection):
+		if connection.is_open:
+			connection.close()
+		else:
+			connection.ioloop.stop()
@@ -1,13 +1,32 @@
 from flask import Flask
-from flask_restful import Resource, Api, request
+from flask_restful import Resource, Api, request, abort
 from .cortex_pb2 import *
+from . import cortex_pb2_grpc
+from .admission import Admission, Overloaded, ADMISSION_CONCURRENCY, ADMISSION_QUEUE_SIZE
+from .prefork import Prefork, listening_socket
+from .publisher import Publisher
+from .writer import JobFailed, Writer, WriterFull
+from ..common import codec
+from ..common.depth import DEPTH_HEADER_SIZE, depth_data, depth_image_bytes, read_depth_image
+from ..common.raw_store import RawStore
+from ..common.stats import StageStats
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial, wraps
+from google.protobuf.message import DecodeError
+from werkzeug.serving import make_server
+import grpc
 import json
 import logging
+import lzma
+import numpy as np
 import os
-import pika
-import pika.exceptions
 import pathlib
+import signal
+import struct
+import threading
+import time
+import zlib
 
 
 app = Flask(__name__)
@@ -18,11 +37,28 @@ PUBLISH_METHOD = None  # will be set to "message_queue" or "function"
 PUBLISH = None  # will contain the function / message queue address
 MQ_PORT = None
 MQ_TYPE = None
+PUBLISHER = None  # the pooled MQ publisher (see publisher.py), when publishing to a message queue
+INGEST_STAGES = ["parse", "extract", "envelope", "write", "publish"]  # see ingest_snapshots
+INGEST_STATS = StageStats(INGEST_STAGES)  # the time the server spent in every ingestion stage, see GET /api/stats
+WRITER = None  # the write-behind writer of raw files (see writer.py); files are written synchronously without it
+ACK_AFTER_WRITE = False  # whether REST uploads are answered only once their snapshots are written and published
+ADMISSION = Admission()  # the admission control of uploads to the REST API (see admission.py)
 EXCHANGE_NAME = "snapshot"  # will publish snapshots to this exchange
 USER_MESSAGE_EXCHANGE = "processed_data"  # will publish user meesages to this exchange
 USER_MESSAGE_TOPIC = "user_message"  # will publish user messages to this topic
+EXCHANGES = {EXCHANGE_NAME: 'direct', USER_MESSAGE_EXCHANGE: 'topic'}  # declared once by every MQ connection
+MESSAGE_CONTENT_TYPE = codec.DEFAULT_CONTENT_TYPE  # the codec of the messages published to the MQ
 RAW_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "files", "raw")
+CONTENT_ADDRESSED = False  # whether identical raw files are stored once (see cortex/common/raw_store.py)
+INLINE_THRESHOLD = 0  # images of up to this many bytes are embedded in the messages to the parsers; 0 disables it
 PUBLISH_METHODS = ["function", "message_queue"]  # available publishing methods the data
+FRAME_HEADER_SIZE = struct.calcsize('I')  # size of the length prefix of each snapshot in a batch
+MAX_DECODED_BODY = 256 * 1024 * 1024  # compressed request bodies may not inflate beyond this size
+RETRY_AFTER = 1  # seconds clients are asked to wait before retrying when the server is overloaded
+GRPC_WORKERS = 10  # number of gRPC streams served concurrently
+GRPC_MAX_MESSAGE_LENGTH = 64 * 1024 * 1024  # snapshots with full color images exceed the 4MB gRPC default
+GRPC_OPTIONS = [('grpc.max_receive_message_length', GRPC_MAX_MESSAGE_LENGTH),
+				('grpc.max_send_message_length', GRPC_MAX_MESSAGE_LENGTH)]
 
 
 def init_logger():
@@ -45,6 +81,23 @@ def init_logger():
 	logging.getLogger("pika").setLevel(logging.WARNING)
 
 
+def admitted(handler):
+	"""
+	a decorator which runs a request handler under the admission control of the server (see ADMISSION).
+	requests which are not admitted, or which find the queue of the write-behind WRITER full, are rejected with 503
+	and Retry-After (clients retry them).
+	"""
+	@wraps(handler)
+	def handle(*args, **kwargs):
+		try:
+			with ADMISSION.admit():
+				return handler(*args, **kwargs)
+		except (Overloaded, WriterFull) as e:
+			logging.warning("Rejected {} {}: {}".format(request.method, request.path, e))
+			return "Server is busy: {}".format(e), 503, {"Retry-After": str(RETRY_AFTER)}
+	return handle
+
+
 class GetSnapshotMessage(Resource):
 	"""
 	This class handles REST API for snapshots messages sent to the server.
@@ -52,50 +105,59 @@ class GetSnapshotMessage(Resource):
 	the class saves the raw data of the color image and depth image in files inside RAW_DIR.
 	it then deserializes and reserializes the snapshot as JSON, and publishes to MQ/function.
 	"""
+	@admitted
 	def post(self, user_id):
 		logging.debug("Got Snapshot for user {}".format(user_id))
 
-		# get snapshot from POST data and deserialize it
-		request.get_data()
-		data = request.data
-		snapshot_message = Snapshot()
-		snapshot_message.ParseFromString(data)
-
-		# re-serializing the snapshot into JSON, to de-couple the client-server protocol
-		# from the server-mq protocol.
-		pathlib.Path("{}".format(RAW_DIR)).mkdir(parents=True, exist_ok=True)
-		# save color image data as binary
-		color_image_path = "{}/{}_{}_color".format(RAW_DIR, user_id, snapshot_message.datetime)
+		# get snapshot from POST data
 		try:
-			with open(color_image_path, "wb") as f:
-				f.write(snapshot_message.color_image.data)
-		except EnvironmentError as e:
-			logging.error("Could not open {}: {}".format(color_image_path, e))
-			sys.exit(1)
-		# save depth image data as json string
-		depth_image_path = "{}/{}_{}_depth".format(RAW_DIR, user_id, snapshot_message.datetime)
+			ingest_snapshots([request_body()], user_id, wait=ACK_AFTER_WRITE)
+		except JobFailed as e:
+			logging.error("Could not store Snapshot for user {}: {}".format(user_id, e))
+			return "Could not store snapshot: {}".format(e), 503, {"Retry-After": str(RETRY_AFTER)}
+		except FileNotFoundError as e:
+			logging.error("Snapshot for user {} references a missing image: {}".format(user_id, e))
+			return "Unknown image reference: {}".format(e), 409
+		except ValueError as e:
+			return "Malformed snapshot: {}".format(e), 400
+		return 200
+
+	def get(self, user_id):
+		"""
+		returns the datetimes of the snapshots of the user which the server already holds (stored and published),
+		starting at the datetime given in the 'since' query parameter.
+		clients use it to resume interrupted uploads.
+		"""
+		since = request.args.get("since", 0, type=int)
+		return {"user_id": user_id, "datetimes": stored_datetimes(user_id, since)}
+
+
+class GetSnapshotBatch(Resource):
+	"""
+	This class handles REST API for batches of snapshot messages sent to the server.
+	each batch is sent to url /api/snapshot_batch/<user_id>, and contains several length-prefixed snapshots
+	(see split_frames). each snapshot is stored exactly like a single snapshot message,
+	and then the whole batch is published at once.
+	"""
+	@admitted
+	def post(self, user_id):
 		try:
-			with open(depth_image_path, "w") as f:
-				new_array = []
-				for item in snapshot_message.depth_image.data:
-					new_array.append(item)
-				result = {
-					"data": new_array,
-				}
-				serialized = json.dumps(result)
-				f.write(serialized)
-		except EnvironmentError as e:
-			exit_run("Could not open {}: {}".format(depth_image_path, e))
-
-		snapshot_json = snapshot_to_json(data, user_id)
-		if globals()["PUBLISH_METHOD"] == "message_queue":
-			logging.debug("Publishing Snapshot {} for user {} to MQ".format(snapshot_message.datetime, user_id))
-			publish_snapshot(snapshot_json)
-
-		elif globals()["PUBLISH_METHOD"] == "function":
-			logging.debug("Passing Snapshot {} for user {} to function.".format(snapshot_message.datetime, user_id))
-			globals()["PUBLISH"](snapshot_json)
+			frames = split_frames(request_body())
+		except ValueError as e:
+			logging.error("Malformed snapshot batch for user {}: {}".format(user_id, e))
+			return "Malformed snapshot batch: {}".format(e), 400
 
+		logging.debug("Got batch of {} snapshots for user {}".format(len(frames), user_id))
+		try:
+			ingest_snapshots(frames, user_id, wait=ACK_AFTER_WRITE)
+		except JobFailed as e:
+			logging.error("Could not store snapshot batch for user {}: {}".format(user_id, e))
+			return "Could not store snapshot batch: {}".format(e), 503, {"Retry-After": str(RETRY_AFTER)}
+		except FileNotFoundError as e:
+			logging.error("Snapshot batch for user {} references a missing image: {}".format(user_id, e))
+			return "Unknown image reference: {}".format(e), 409
+		except ValueError as e:
+			return "Malformed snapshot batch: {}".format(e), 400
 		return 200
 
 
@@ -105,85 +167,575 @@ class GetUserMessage(Resource):
 	each snapshot is sent to url /api/user_message/<user_id>
 	it then deserializes and reserializes the message as JSON, and publishes to MQ/function.
 	"""
+	@admitted
 	def post(self, user_id):
-		request.get_data()
 		logging.debug("Got user message for user {}".format(user_id))
-		data = request.data
-		user_json = user_to_json(data)
-		if globals()["PUBLISH_METHOD"] == "message_queue":
-			logging.debug("Publishing user message for user {} to MQ".format(user_id))
-			publish_user_message(user_json)
+		data = request_body()
+		publish_user(encode_message(user_envelope(data)), user_id)
+		return 200
 
-		elif globals()["PUBLISH_METHOD"] == "function":
-			logging.debug("Passing user message for user {} to function".format(user_id))
-			globals()["PUBLISH"](user_json)
 
-		return 200
+def request_body():
+	"""
+	returns the body of the current request, decompressed according to its Content-Encoding header:
+	"deflate" (zlib), "gzip" or "xz" (lzma). bodies without Content-Encoding (or "identity") are returned as they are.
+	aborts the request with 415 if the encoding is not supported, and with 400 if the body is malformed or
+	inflates beyond MAX_DECODED_BODY.
+	"""
+	data = request.get_data()
+	encoding = request.headers.get("Content-Encoding", "identity").strip().lower()
+	if encoding == "identity":
+		return data
+	if encoding == "deflate":
+		decompressor = zlib.decompressobj()
+	elif encoding == "gzip":
+		decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+	elif encoding == "xz":
+		decompressor = lzma.LZMADecompressor()
+	else:
+		logging.error("Unsupported Content-Encoding: {}".format(encoding))
+		abort(415, message="Unsupported Content-Encoding: {}".format(encoding))
+
+	try:
+		decoded = decompressor.decompress(data, MAX_DECODED_BODY + 1)
+	except (zlib.error, lzma.LZMAError) as e:
+		logging.error("Malformed {} request body: {}".format(encoding, e))
+		abort(400, message="Malformed {} request body: {}".format(encoding, e))
+	if len(decoded) > MAX_DECODED_BODY or not decompressor.eof:
+		logging.error("{} request body is truncated or exceeds {} bytes".format(encoding, MAX_DECODED_BODY))
+		abort(400, message="{} request body is truncated or exceeds {} bytes".format(encoding, MAX_DECODED_BODY))
+	return decoded
+
+
+class GetIngestStats(Resource):
+	"""
+	This class handles REST API for the ingestion statistics of the server, at url /api/stats:
+	the snapshots and bytes the server published since it started, and the time it spent in every ingestion stage
+	(see ingest_snapshots), with its count, total and mean, percentiles and maximum (seconds).
+	the depth of the queues which bound the load of the server is included: of the admission control (see
+	Admission.summary) and of the write-behind writer (see Writer.summary).
+	"""
+	def get(self):
+		summary = INGEST_STATS.summary()
+		summary["admission"] = ADMISSION.summary()
+		summary["writer"] = WRITER.summary() if WRITER is not None else None
+		summary["worker"] = os.getpid()  # the statistics are of the worker process which served the request
+		return summary
 
 
 api.add_resource(GetUserMessage, '/api/user_message/<user_id>')
 api.add_resource(GetSnapshotMessage, '/api/snapshot_message/<user_id>')
+api.add_resource(GetSnapshotBatch, '/api/snapshot_batch/<user_id>')
+api.add_resource(GetIngestStats, '/api/stats')
+
+
+class CortexServicer(cortex_pb2_grpc.CortexServicer):
+	"""
+	This class handles gRPC uploads (see run_grpc_server).
+	each call streams a serialized user message followed by serialized snapshots of that user,
+	which are handled exactly like user and snapshot messages sent to the REST API.
+	gRPC flow control applies to the stream, so a client can not send faster than the snapshots are handled.
+	"""
+	def UploadSample(self, request_iterator, context):
+		user_message = None
+		count = 0
+		jobs = []  # the writes of the snapshots run while later snapshots arrive, and are waited for at the end
+		for message in request_iterator:
+			if message.WhichOneof("message") == "user":
+				user_message = User()
+				user_message.ParseFromString(message.user)
+				logging.debug("Got user message for user {} over gRPC".format(user_message.user_id))
+				publish_user(encode_message(user_envelope(message.user)), user_message.user_id)
+
+			elif message.WhichOneof("message") == "snapshot":
+				if user_message is None:
+					context.abort(grpc.StatusCode.FAILED_PRECONDITION, "a user message must precede snapshots")
+				# the REST API receives the user id as a url string, and snapshots are documented with it as such
+				# gRPC flow control holds the client back while the writers' queue is full, instead of rejecting it
+				try:
+					jobs.append(ingest_snapshots([message.snapshot], str(user_message.user_id), block=True))
+				except FileNotFoundError as e:
+					context.abort(grpc.StatusCode.FAILED_PRECONDITION, "unknown image reference: {}".format(e))
+				except ValueError as e:
+					context.abort(grpc.StatusCode.INVALID_ARGUMENT, "malformed snapshot: {}".format(e))
+				count += 1
+
+		for job in jobs:
+			try:
+				if job is not None:
+					job.result()
+			except JobFailed as e:
+				context.abort(grpc.StatusCode.UNAVAILABLE, "could not store snapshots: {}".format(e))
+
+		user_id = user_message.user_id if user_message else 0
+		logging.debug("Finished gRPC upload for user {}: {} snapshots".format(user_id, count))
+		return UploadSummary(user_id=user_id, snapshots=count)
+
+
+def ingest_snapshots(snapshots, user_id, block=False, wait=False):
+	"""
+	receives raw serialized snapshot messages of a user, and runs them through the ingestion stages:
+	- parse: deserializing each snapshot, once (see store_snapshot)
+	- extract: resolving its image references, preparing the writes of its raw files and the images embedded in
+	  its message (see extract_blobs)
+	- envelope: re-serializing it as the message published to the parsers (see snapshot_envelope and
+	  encode_message)
+	- write: writing the raw files
+	- publish: publishing all snapshots at once, and only then recording them as held by the server
+	  (see stored_datetimes)
+	the time of every stage is measured in INGEST_STATS.
+	with a write-behind WRITER, the images are written, and the snapshots published and recorded, by its threads;
+	raises WriterFull if its queue is full, unless `block` is True. the function returns the future of the job as
+	soon as it is queued (see Writer.submit), unless `wait` is True, in which case it returns once the snapshots are
+	written, published and recorded, and raises JobFailed if they could not be.
+	"""
+	stored = [store_snapshot(data, user_id) for data in snapshots]
+	writes = [(path, timed("write", write)) for _, _, snapshot_writes in stored for path, write in snapshot_writes]
+
+	def publish():
+		started = time.perf_counter()
+		publish_snapshots([snapshot_json for _, snapshot_json, _ in stored])
+		record_snapshots(user_id, [snapshot_datetime for snapshot_datetime, _, _ in stored])
+		INGEST_STATS.add("publish", time.perf_counter() - started, len(snapshots), sum(map(len, snapshots)))
+
+	if WRITER is None:
+		for path, write in writes:
+			try:
+				write(path)
+			except EnvironmentError as e:
+				exit_run("Could not open {}: {}".format(path, e))
+		publish()
+		return None
+	job = WRITER.submit(writes, publish, block)
+	if wait:
+		job.result()
+	return job
+
+
+def store_snapshot(data, user_id):
+	"""
+	receives raw serialized data of a snapshot message sent from the client, and parses it once.
+	returns the snapshot datetime, the encoded message of the snapshot (see snapshot_envelope), and the writes which
+	save the raw data of its color image and depth image (see extract_blobs).
+	raises ValueError if the snapshot is malformed.
+	"""
+	with INGEST_STATS.timer("parse"):
+		snapshot_message = Snapshot()
+		try:
+			snapshot_message.ParseFromString(data)
+		except DecodeError as e:
+			raise ValueError("could not parse snapshot: {}".format(e))
+	with INGEST_STATS.timer("extract"):
+		writes, inlined = extract_blobs(snapshot_message, data, user_id)
+	with INGEST_STATS.timer("envelope"):
+		(color_image_path, _), (depth_image_path, _) = writes
+		envelope = encode_message(snapshot_envelope(snapshot_message, user_id, color_image_path, depth_image_path,
+													inlined))
+
+	logging.debug("Prepared Snapshot {} for user {}".format(snapshot_message.datetime, user_id))
+	return snapshot_message.datetime, envelope, writes
+
+
+def extract_blobs(snapshot_message, data, user_id):
+	"""
+	receives a parsed snapshot message along with its raw serialized data.
+	returns the writes which save the raw data of the color image and depth image in the raw store
+	(see raw_store), as (path, write) pairs, and the images which are embedded in the message of the snapshot
+	(see inline), as a dictionary of their kind ("color" or "depth") and data.
+	images are written even when they are embedded, since later snapshots may refer to them.
+	if the color image is a reference to the identical color image of an earlier snapshot of the user,
+	the stored image of that snapshot is reused (see RawStore.link) instead of being written again.
+	if the depth image is a delta against the depth image of an earlier snapshot of the user, the full image is
+	reconstructed (see reconstruct_depth_image), to be written in full.
+	referenced images which are still being written (see wait_for_write) are waited for.
+	raises FileNotFoundError if a referenced image is not held by the server,
+	and ValueError if a depth delta does not match its reference.
+	"""
+	store = raw_store()
+	inlined = {}
+	pathlib.Path("{}".format(RAW_DIR)).mkdir(parents=True, exist_ok=True)
+	# save color image data as binary
+	color_image_path = store.path(user_id, snapshot_message.datetime, "color")
+	if snapshot_message.color_image.reference:
+		wait_for_write(store.path(user_id, snapshot_message.color_image.reference, "color"))
+		reference_path = store.find(user_id, snapshot_message.color_image.reference, "color")
+		color_write = partial(store.link, reference_path)
+		if inline(os.path.getsize(reference_path)):
+			with open(reference_path, "rb") as f:
+				inlined["color"] = f.read()
+	else:
+		color_write = partial(store.write, data=snapshot_message.color_image.data)
+		if inline(len(snapshot_message.color_image.data)):
+			inlined["color"] = snapshot_message.color_image.data
+	# save depth image data as binary float32 values (see cortex.common.depth)
+	depth_image_path = store.path(user_id, snapshot_message.datetime, "depth")
+	if snapshot_message.depth_image.reference:
+		wait_for_write(store.path(user_id, snapshot_message.depth_image.reference, "depth"))
+		reference_path = store.find(user_id, snapshot_message.depth_image.reference, "depth")
+		depth_values = reconstruct_depth_image(reference_path, snapshot_message.depth_image)
+	else:
+		depth_values = depth_data(data)  # copied from the packed field as it was sent, without converting it
+	depth_image = depth_image_bytes(depth_values, snapshot_message.depth_image.width,
+									snapshot_message.depth_image.height)
+	depth_write = partial(store.write, data=depth_image)
+	if inline(len(depth_image) - DEPTH_HEADER_SIZE):
+		inlined["depth"] = depth_image[DEPTH_HEADER_SIZE:]  # the values, without the header of the raw file
+	return [(color_image_path, color_write), (depth_image_path, depth_write)], inlined
+
+
+def inline(size):
+	"""
+	returns whether an image of `size` bytes is embedded in the message of its snapshot, so parsers do not read
+	it from the raw store: images of up to INLINE_THRESHOLD bytes are.
+	"""
+	return 0 < INLINE_THRESHOLD and size <= INLINE_THRESHOLD
+
+
+def timed(stage, function):
+	"""
+	returns `function`, with the time of its calls added to `stage` of INGEST_STATS.
+	"""
+	def run(*args, **kwargs):
+		with INGEST_STATS.timer(stage):
+			return function(*args, **kwargs)
+	return run
+
+
+def raw_store():
+	return RawStore(RAW_DIR, content_addressed=CONTENT_ADDRESSED)
+
+
+def wait_for_write(path):
+	"""
+	waits until the write-behind WRITER wrote the file at `path`, if it is about to.
+	"""
+	if WRITER is not None:
+		WRITER.wait(path)
+
+
+def reconstruct_depth_image(reference_path, depth_image):
+	"""
+	returns the depth values (float32) of a depth image sent as quantized deltas: every value is the value of the
+	stored reference image plus delta * scale, computed in float64 and rounded to float32. the client computes the
+	same values the same way, and encodes its next deltas against them.
+	raises FileNotFoundError if there is no image at `reference_path`, and ValueError if the number of deltas
+	does not match it.
+	"""
+	reference_data = read_depth_image(reference_path)
+	if len(reference_data) != len(depth_image.delta):
+		raise ValueError("{} depth deltas for a reference image of {} values"
+						 .format(len(depth_image.delta), len(reference_data)))
+	deltas = np.array(depth_image.delta, dtype=np.float64)
+	return (reference_data.astype(np.float64) + deltas * depth_image.scale).astype(np.float32)
+
+
+def record_snapshots(user_id, datetimes):
+	"""
+	appends the datetimes of published snapshots to the users' snapshot list, <RAW_DIR>/<user_id>_snapshots.
+	each datetime is a single appended line, so concurrent requests of the same user do not overwrite each other.
+	"""
+	if not datetimes:
+		return
+	try:
+		with open(snapshot_list_path(user_id), "a") as f:
+			f.write("".join("{}\n".format(snapshot_datetime) for snapshot_datetime in datetimes))
+	except EnvironmentError as e:
+		logging.error("Could not record snapshots of user {}: {}".format(user_id, e))
 
 
-def run_server(host, port, publish, publish_method="function"):
+def stored_datetimes(user_id, since=0):
+	"""
+	returns a sorted list of the datetimes of the users' snapshots which the server holds, starting at `since`.
+	only the users' snapshot list is read, so the answer does not depend on the size of RAW_DIR.
+	"""
+	try:
+		with open(snapshot_list_path(user_id), "r") as f:
+			datetimes = {int(line) for line in f if line.strip()}
+	except FileNotFoundError:
+		return []
+	return sorted(snapshot_datetime for snapshot_datetime in datetimes if snapshot_datetime >= since)
+
+
+def snapshot_list_path(user_id):
+	return "{}/{}_snapshots".format(RAW_DIR, user_id)
+
+
+def split_frames(data):
+	"""
+	splits the body of a snapshot batch into the serialized snapshots it contains.
+	a batch is a sequence of (message size)(message) frames, with the size packed as struct 'I',
+	exactly like the messages inside a sample file.
+	raises ValueError if the body does not consist of complete frames.
+	"""
+	frames = []
+	offset = 0
+	while offset < len(data):
+		if offset + FRAME_HEADER_SIZE > len(data):
+			raise ValueError("truncated frame header at offset {}".format(offset))
+		frame_size = struct.unpack_from('I', data, offset)[0]
+		offset += FRAME_HEADER_SIZE
+		if offset + frame_size > len(data):
+			raise ValueError("frame at offset {} exceeds the batch size".format(offset - FRAME_HEADER_SIZE))
+		frames.append(data[offset:offset + frame_size])
+		offset += frame_size
+	return frames
+
+
+def publish_user(message, user_id):
+	"""
+	redirects an encoded user message (see encode_message) to the publishing method the server was initialized with.
+	"""
+	if globals()["PUBLISH_METHOD"] == "message_queue":
+		logging.debug("Publishing user message for user {} to MQ".format(user_id))
+		publish_user_message(message)
+
+	elif globals()["PUBLISH_METHOD"] == "function":
+		logging.debug("Passing user message for user {} to function".format(user_id))
+		globals()["PUBLISH"](message)
+
+
+def publish_snapshots(messages):
+	"""
+	redirects encoded snapshot messages (see encode_message) to the publishing method the server was initialized
+	with.
+	"""
+	if globals()["PUBLISH_METHOD"] == "message_queue":
+		logging.debug("Publishing {} Snapshots to MQ".format(len(messages)))
+		publish_snapshot(*messages)
+
+	elif globals()["PUBLISH_METHOD"] == "function":
+		logging.debug("Passing {} Snapshots to function.".format(len(messages)))
+		for message in messages:
+			globals()["PUBLISH"](message)
+
+
+def run_server(host, port, publish, publish_method="function", content_addressed=False,
+			   content_type=codec.DEFAULT_CONTENT_TYPE, inline_threshold=INLINE_THRESHOLD,
+			   concurrency=ADMISSION_CONCURRENCY, queue_size=ADMISSION_QUEUE_SIZE, workers=1, ack_after_write=False):
 	"""
 	This functions initializes the server.
 	publish - string, containing the MQ Address or function.
 	publish_method = string, "function" or "message_queue" - that is where the data will be redirected.
+	content_addressed - whether identical raw files are stored once (see cortex/common/raw_store.py).
+	content_type - the codec of the messages published to the MQ (see cortex/common/codec.py); functions receive
+	JSON strings.
+	inline_threshold - images of up to this many bytes are embedded in the messages to the parsers instead of
+	their paths (0 disables it). it requires publishing to the MQ with a codec which holds bytes (the envelope).
+	concurrency, queue_size - the uploads handled at once, and the uploads waiting for their turn beyond which
+	uploads are rejected with 503 (see admission.py).
+	ack_after_write - whether uploads are answered only once their snapshots are written and published, rather
+	than once they are queued for the writer (see ingest_snapshots).
+	workers - the number of server processes. with more than one, the server is pre-forked (see prefork.py and
+	serve_worker): every worker has its own MQ publisher, writer and admission control (concurrency and queue_size
+	apply to each of them), and SIGHUP restarts the workers gracefully.
 	"""
-	if host is None or port is None or publish is None:
-		print("None parameters not allowed: host={}, port={}, publish={}".format(host, port, publish))
-		sys.exit(1)
+	if workers > 1:
+		serve = partial(serve_worker, host, port, publish, publish_method, content_addressed, content_type,
+						inline_threshold, concurrency, queue_size, ack_after_write)
+		run_prefork(host, port, publish, publish_method, workers, serve)
+		return
+	configure_publishing(host, port, publish, publish_method, content_addressed, content_type, inline_threshold)
+	globals()["ADMISSION"] = Admission(concurrency, queue_size)
+	globals()["ACK_AFTER_WRITE"] = ack_after_write
+	try:
+		app.run(host=host, port=port, threaded=True)  # this is blocking!
 
-	if publish_method not in PUBLISH_METHODS:
-		print("Publish method {} is not allowed".format(publish_method))
-		sys.exit(1)
+	except Exception as e:
+		exit_run("Error: Could not start server: {}".format(e))
+
+	finally:
+		close_writer()
 
+
+def run_prefork(host, port, publish, publish_method, workers, serve):
+	"""
+	runs `workers` worker processes which run serve(ready), and restarts them on SIGHUP (see Prefork).
+	the parameters and the port are checked before the workers are forked, so they fail once rather than in every
+	worker.
+	"""
+	check_parameters(host, port, publish, publish_method)
+	init_logger()
+	try:
+		listening_socket(host, port, listen=False).close()
+	except OSError as e:
+		exit_run("Error: Could not start server: {}".format(e))
+	logging.debug("Starting {} workers on {}:{}".format(workers, host, port))
+	Prefork(workers, serve).run()
+
+
+def serve_worker(host, port, publish, publish_method, content_addressed, content_type, inline_threshold,
+				 concurrency, queue_size, ack_after_write, ready):
+	"""
+	serves the REST API in a worker process of a pre-forked server, on its own socket bound to the shared port
+	(see listening_socket), and calls ready() once it accepts connections. the MQ publisher, the writer and the
+	admission control of the worker are created here, after it was forked.
+	returns once it is asked to stop (SIGTERM or SIGINT), its listening socket is closed, and the requests it was
+	handling and its queued writes and messages completed.
+	"""
+	configure_publishing(host, port, publish, publish_method, content_addressed, content_type, inline_threshold)
+	globals()["ADMISSION"] = Admission(concurrency, queue_size)
+	globals()["ACK_AFTER_WRITE"] = ack_after_write
+	try:
+		listener = listening_socket(host, port)
+		http_server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+		listener.close()  # the server holds a duplicate of it
+	except OSError as e:
+		exit_run("Error: Could not start server worker: {}".format(e))
+	http_server.daemon_threads = False  # so closing the server waits for the requests it is handling
+	# shutdown waits for serve_forever to return, so it can not be called by the thread which runs it
+	signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=http_server.shutdown).start())
+	ready()
+	logging.debug("Worker {} serving on {}:{}".format(os.getpid(), host, port))
+	try:
+		http_server.serve_forever()  # this is blocking! returns on SIGINT as well
+	finally:
+		http_server.server_close()
+		close_writer()
+		close_publisher()
+		logging.debug("Worker {} stopped".format(os.getpid()))
+
+
+def run_grpc_server(host, port, publish, publish_method="function", workers=GRPC_WORKERS, content_addressed=False,
+					content_type=codec.DEFAULT_CONTENT_TYPE, inline_threshold=INLINE_THRESHOLD):
+	"""
+	This functions initializes the server with a gRPC transport instead of the REST API.
+	clients upload a user message followed by its snapshots over a single client-streaming call
+	(see cortex.proto), and every message is stored and published exactly like it is by the REST API.
+	publish, publish_method, content_addressed, content_type, inline_threshold - same as in run_server.
+	workers - the number of streams (clients) served concurrently.
+	"""
+	configure_publishing(host, port, publish, publish_method, content_addressed, content_type, inline_threshold)
+	try:
+		grpc_server, _ = create_grpc_server(host, port, workers)
+		grpc_server.start()
+		grpc_server.wait_for_termination()  # this is blocking!
+
+	except Exception as e:
+		exit_run("Error: Could not start gRPC server: {}".format(e))
+
+	finally:
+		close_writer()
+
+
+def create_grpc_server(host, port, workers=GRPC_WORKERS):
+	"""
+	creates a gRPC server serving CortexServicer on host:port.
+	returns the (not yet started) server and the port it is bound to.
+	"""
+	grpc_server = grpc.server(ThreadPoolExecutor(max_workers=workers), options=GRPC_OPTIONS)
+	cortex_pb2_grpc.add_CortexServicer_to_server(CortexServicer(), grpc_server)
+	bound_port = grpc_server.add_insecure_port("{}:{}".format(host, port))
+	if not bound_port:
+		raise RuntimeError("could not bind to {}:{}".format(host, port))
+	return grpc_server, bound_port
+
+
+def configure_publishing(host, port, publish, publish_method, content_addressed=False,
+						 content_type=codec.DEFAULT_CONTENT_TYPE, inline_threshold=INLINE_THRESHOLD):
+	"""
+	validates the server parameters, and sets the publishing method and destination used by all handlers,
+	as well as the way they store raw files.
+	"""
+	check_parameters(host, port, publish, publish_method)
 	init_logger()
 	logging.debug("Initiating Server.")
 	global_variables = globals()
 
 	#  if using MQ - verify MQ type and extract host, port
 	if publish_method == "message_queue":
-		mq_type, address = publish.split('://')
-		mq_host, mq_port = address.split(':')
-		mq_port = int(str(mq_port).rstrip('/'))
-		if mq_type not in SUPPORTED_QUEUE:
-			exit_run("MQ Type not supported. please use: {}".format(SUPPORTED_QUEUE))
+		mq_host, mq_port = mq_address(publish)
 		global_variables["PUBLISH"] = mq_host
 		global_variables["MQ_PORT"] = mq_port
+		global_variables["PUBLISHER"] = Publisher(mq_host, mq_port, EXCHANGES)
+		if not PUBLISHER.start():
+			logging.warning("MQ at {}:{} is not available yet, publishing will wait for it".format(mq_host, mq_port))
 
 	elif publish_method == "function":
 		global_variables["PUBLISH"] = publish
 
+	global_variables["CONTENT_ADDRESSED"] = content_addressed
+	global_variables["MESSAGE_CONTENT_TYPE"] = content_type
+	if inline_threshold and (publish_method != "message_queue" or not codec.get_codec(content_type).holds_bytes):
+		logging.warning("Images can only be embedded in binary MQ messages, sending their paths instead")
+		inline_threshold = 0
+	global_variables["INLINE_THRESHOLD"] = inline_threshold
+	global_variables["WRITER"] = Writer()
+	WRITER.start()
 	global_variables["PUBLISH_METHOD"] = publish_method
 	logging.debug("Publish Method: {}".format(publish_method))
 	logging.debug("Publish Destination: {}".format(publish))
+
+
+def check_parameters(host, port, publish, publish_method):
+	"""
+	exits if the server parameters are not valid.
+	"""
+	if host is None or port is None or publish is None:
+		print("None parameters not allowed: host={}, port={}, publish={}".format(host, port, publish))
+		sys.exit(1)
+
+	if publish_method not in PUBLISH_METHODS:
+		print("Publish method {} is not allowed".format(publish_method))
+		sys.exit(1)
+
+	if publish_method == "message_queue":
+		mq_address(publish)
+
+
+def mq_address(url):
+	"""
+	returns the host and port of a message queue URL (type://host:port). exits if its type is not supported.
+	"""
+	mq_type, address = url.split('://')
+	mq_host, mq_port = address.split(':')
+	mq_port = int(str(mq_port).rstrip('/'))
+	if mq_type not in SUPPORTED_QUEUE:
+		exit_run("MQ Type not supported. please use: {}".format(SUPPORTED_QUEUE))
+	return mq_host, mq_port
+
+
+def migrate_raw_store():
+	"""
+	moves the raw files which earlier servers wrote flat in RAW_DIR into the shards of the raw store.
+	"""
 	try:
-		app.run(host=host, port=port)  # this is blocking!
+		moved = raw_store().migrate()
+	except EnvironmentError as e:
+		exit_run("Could not migrate {}: {}".format(RAW_DIR, e))
+	print("Moved {} raw files into their shards in {}".format(moved, RAW_DIR))
 
-	except Exception as e:
-		exit_run("Error: Could not start server: {}".format(e))
+
+def close_writer():
+	"""
+	writes and publishes the snapshots which are still queued in the write-behind WRITER, and stops it.
+	"""
+	if WRITER is not None:
+		WRITER.close()
+		globals()["WRITER"] = None
+
+
+def close_publisher():
+	"""
+	closes the connections of the MQ publisher, once the messages handed to it were published.
+	"""
+	if PUBLISHER is not None:
+		PUBLISHER.close()
+		globals()["PUBLISHER"] = None
 
 
-def publish_snapshot(message):
+def publish_snapshot(*messages):
 	"""
-	publishes a snapshot message to the MQ.
-	a message is a serialized JSON message.
+	publishes snapshot messages to the MQ.
+	a message is a serialized JSON message. all messages are published together over one of the publishers'
+	pooled connections, and the function returns once the MQ confirmed all of them.
 	the function uses direct routing to an exchange called EXCHANGE_NAME.
 	all snapshot parsers register to this exchange and receive a copy of the message.
 	The use of a publishing function allows for easy addition of different MQ types in the future.
 	"""
 	try:
-		global_variables = globals()
-		connection = pika.BlockingConnection(pika.ConnectionParameters(global_variables["PUBLISH"], global_variables["MQ_PORT"]))
-		channel = connection.channel()
-		channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='direct')
-		channel.basic_publish(exchange=EXCHANGE_NAME, routing_key=EXCHANGE_NAME, body=message)
-		connection.close()
-
-	except (pika.exceptions.ConnectionClosed, pika.exceptions.AMQPChannelError, pika.exceptions.AMQPError,
-			pika.exceptions.NoFreeChannels, pika.exceptions.ConnectionWrongStateError) as e:
+		PUBLISHER.publish(EXCHANGE_NAME, EXCHANGE_NAME, messages, content_type=MESSAGE_CONTENT_TYPE)
+
+	except (ConnectionError, TimeoutError) as e:
 		exit_run("Error publishing snapshot to MQ: {}".format(e))
 
 
@@ -199,23 +751,24 @@ def publish_user_message(message):
 	The use of a publishing function allows for easy addition of different MQ types in the future.
 	"""
 	try:
-		global_variables = globals()
-		connection = pika.BlockingConnection(pika.ConnectionParameters(global_variables["PUBLISH"], global_variables["MQ_PORT"]))
-		publish_channel = connection.channel()
-		publish_channel.exchange_declare(exchange=USER_MESSAGE_EXCHANGE, exchange_type='topic')
-		routing_key = USER_MESSAGE_TOPIC
-		publish_channel.basic_publish(exchange=USER_MESSAGE_EXCHANGE, routing_key=routing_key, body=message)
-
-	except (pika.exceptions.ConnectionClosed, pika.exceptions.AMQPChannelError, pika.exceptions.AMQPError,
-			pika.exceptions.NoFreeChannels, pika.exceptions.ConnectionWrongStateError,
-			pika.exceptions.ConnectionClosedByBroker) as e:
+		PUBLISHER.publish(USER_MESSAGE_EXCHANGE, USER_MESSAGE_TOPIC, [message], content_type=MESSAGE_CONTENT_TYPE)
+
+	except (ConnectionError, TimeoutError) as e:
 		exit_run("Error publishing user message to MQ: {}".format(e))
 
 
 def user_to_json(data):
 	"""
-	receives raw serialized data of a user message sent from the client, and changes it to JSON.
-	returns a JSON string.
+	receives raw serialized data of a user message sent from the client, and changes it to JSON
+	(see user_envelope). returns a JSON string.
+	"""
+	return json.dumps(user_envelope(data))
+
+
+def user_envelope(data):
+	"""
+	receives raw serialized data of a user message sent from the client, and changes it to the message published
+	to the saver. returns a dictionary, to be encoded by encode_message.
 	"""
 	user_message = User()
 	user_message.ParseFromString(data)
@@ -225,19 +778,29 @@ def user_to_json(data):
 		"birthday": user_message.birthday,
 		"gender": user_message.gender,
 	}
-	return json.dumps(result)
+	return result
 
 
 def snapshot_to_json(data, user_id):
 	"""
-	receives raw serialized data of a snapshot message sent from the client, and chanegs it to JSON.
-	incorporates the user id into the JSON, alongside the paths for the color and depth image.
-	returns a JSON string.
+	receives raw serialized data of a snapshot message sent from the client, and chanegs it to JSON
+	(see snapshot_envelope). returns a JSON string.
 	"""
 	snapshot = Snapshot()
 	snapshot.ParseFromString(data)
-	color_path = "{}/{}_{}_color".format(RAW_DIR, user_id, snapshot.datetime)
-	depth_path = "{}/{}_{}_depth".format(RAW_DIR, user_id, snapshot.datetime)
+	store = raw_store()
+	return json.dumps(snapshot_envelope(snapshot, user_id, store.path(user_id, snapshot.datetime, "color"),
+										store.path(user_id, snapshot.datetime, "depth")))
+
+
+def snapshot_envelope(snapshot, user_id, color_path, depth_path, inlined=None):
+	"""
+	receives a parsed snapshot message, and changes it to the message published to the parsers.
+	incorporates the user id into the message, alongside the paths for the color and depth image.
+	images in `inlined` (see extract_blobs) are embedded in the message instead of their paths: the data of the
+	color image, and the float32 values of the depth image.
+	returns a dictionary, to be encoded by encode_message.
+	"""
 	result = {
 		"user_id": user_id,
 		"datetime": snapshot.datetime,
@@ -259,7 +822,20 @@ def snapshot_to_json(data, user_id):
 		"exhaustion": snapshot.feelings.exhaustion,
 		"happiness": snapshot.feelings.happiness,
 	}
-	return json.dumps(result)
+	for kind, data in (inlined or {}).items():
+		del result["{}_image_path".format(kind)]
+		result["{}_image_data".format(kind)] = data
+	return result
+
+
+def encode_message(message):
+	"""
+	encodes a message dictionary for the publishing method the server was initialized with:
+	by the codec of MESSAGE_CONTENT_TYPE for the MQ (see cortex/common/codec.py), and as a JSON string for functions.
+	"""
+	if globals()["PUBLISH_METHOD"] == "message_queue":
+		return codec.encode(message, MESSAGE_CONTENT_TYPE)
+	return json.dumps(message)
 
 
 def exit_run(message):
@@ -0,0 +1,125 @@
+from collections import Counter
+from concurrent.futures import Future
+import logging
+import queue
+import threading
+
+WRITER_THREADS = 4  # threads writing raw files to disk
+WRITER_QUEUE_SIZE = 64  # jobs (requests) waiting for a writer thread, beyond which new jobs are rejected
+
+
+class WriterFull(Exception):
+	"""
+	raised when a job is submitted to a Writer whose queue is full.
+	"""
+
+
+class JobFailed(Exception):
+	"""
+	raised by the future of a job whose write or callback failed.
+	"""
+
+
+class Writer:
+	"""
+	This class is a bounded write-behind stage: a pool of `threads` threads which write raw files to disk, fed by a
+	queue of up to `queue_size` jobs. a job is a list of writes, followed by a callback (publishing the messages which
+	refer to the files) which runs only once all of its writes completed.
+	request handlers submit jobs and return (or wait for them, see submit) while the threads write the jobs of
+	other requests, and new jobs are rejected while the queue is full, so a slow disk does not pile up requests
+	(and their data) in memory.
+	paths which are about to be written are tracked, so a request which refers to a file written by an earlier
+	request can wait for it (see wait).
+	"""
+	def __init__(self, threads=WRITER_THREADS, queue_size=WRITER_QUEUE_SIZE):
+		self.queue = queue.Queue(queue_size)
+		self.pending = Counter()  # path: number of queued or running writes to it
+		self.rejected = 0  # jobs submitted while the queue was full
+		self.condition = threading.Condition()
+		self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(threads)]
+
+	def start(self):
+		for thread in self.threads:
+			thread.start()
+
+	def submit(self, writes, then=None, block=False):
+		"""
+		queues a job: `writes` is a list of (path, write), where write(path) writes the file, and `then` is called
+		once all of them are written.
+		returns a Future of the job, which completes once `then` returned, or raises JobFailed if a write or `then`
+		failed. raises WriterFull if the queue is full, unless `block` is True, in which case it waits for room.
+		"""
+		future = Future()
+		with self.condition:
+			self.pending.update(path for path, _ in writes)
+		try:
+			self.queue.put((writes, then, future), block=block)
+		except queue.Full:
+			self._written(path for path, _ in writes)
+			with self.condition:
+				self.rejected += 1
+			raise WriterFull("{} jobs are waiting to be written".format(self.queue.maxsize))
+		return future
+
+	def wait(self, path):
+		"""
+		waits until the file at `path` is written, if it is about to be.
+		"""
+		with self.condition:
+			self.condition.wait_for(lambda: path not in self.pending)
+
+	def summary(self):
+		"""
+		returns the metrics of the queue: its size, the jobs waiting in it, the jobs rejected since the writer
+		started, and the files which are about to be written.
+		"""
+		with self.condition:
+			return {
+				"threads": len(self.threads),
+				"queue_size": self.queue.maxsize,
+				"queued": self.queue.qsize(),
+				"rejected": self.rejected,
+				"pending_files": len(self.pending),
+			}
+
+	def close(self):
+		"""
+		waits for all queued jobs to complete, and stops the threads.
+		"""
+		for _ in self.threads:
+			self.queue.put(None)
+		for thread in self.threads:
+			thread.join()
+
+	def _run(self):
+		"""
+		runs jobs until close. a job whose write fails is dropped: its callback is not called, and its future raises
+		JobFailed.
+		"""
+		while True:
+			job = self.queue.get()
+			if job is None:
+				return
+			writes, then, future = job
+			remaining = list(writes)
+			try:
+				while remaining:
+					path, write = remaining.pop(0)
+					try:
+						write(path)
+					finally:
+						self._written([path])
+				if then is not None:
+					then()
+				future.set_result(None)
+			except (Exception, SystemExit) as e:  # exit_run raises SystemExit, which must not end the thread
+				self._written(path for path, _ in remaining)
+				logging.error("Write-behind job failed: {}".format(e))
+				future.set_exception(JobFailed("{}".format(e)))
+
+	def _written(self, paths):
+		with self.condition:
+			self.pending.subtract(paths)
+			for path in [path for path, count in self.pending.items() if count <= 0]:
+				del self.pending[path]
+			self.condition.notify_all()
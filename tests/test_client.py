@@ -1,8 +1,25 @@
 from click.exceptions import UsageError
-from cortex.client import client
+from cortex.client import benchmark, bulk, client, compression, encoding, inspector
+from cortex.client import sample as sample_format
+from cortex.client.balancer import EndpointPool
+from cortex.common.depth import read_depth_image
+from cortex.common.raw_store import shard
+from cortex.common.stats import StageStats, percentile_of
+from cortex.server import server
 from .cortex_pb2 import *
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from werkzeug.serving import make_server
+import gzip
+import json
+import numpy as np
+import os
 import pytest
+import socket
+import struct
 import subprocess
+import threading
+import time
+import zlib
 
 HOST = "127.0.0.1"
 PORT = 8000
@@ -146,3 +163,729 @@ def test_upload_sample_file_1():
     with pytest.raises(SystemExit):
         client.upload_sample("127.0.0.1", 5000, "unreal.file")
 
+
+def write_sample(path, user_id=7, datetimes=(1000, 2000, 3000)):
+    """
+    writes a small sample file: a user message followed by one snapshot per datetime.
+    """
+    user_message = User()
+    user_message.user_id = user_id
+    user_message.username = "Test User"
+    with gzip.open(path, "wb") as f:
+        serialized = user_message.SerializeToString()
+        f.write(struct.pack('I', len(serialized)) + serialized)
+        for snapshot_datetime in datetimes:
+            snapshot = Snapshot()
+            snapshot.datetime = snapshot_datetime
+            snapshot.color_image.width = 1
+            snapshot.color_image.height = 1
+            snapshot.color_image.data = b"abc"
+            serialized = snapshot.SerializeToString()
+            f.write(struct.pack('I', len(serialized)) + serialized)
+
+
+@pytest.fixture
+def stub_server():
+    """
+    a local HTTP server which records every POST as (path, body) in arrival order, and acknowledges it,
+    unless it is a single snapshot whose datetime is in `reject`.
+    GET requests are answered with the datetimes of the single snapshots received so far.
+    """
+    received = []
+    reject = set()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            status = 200
+            if self.path.startswith("/api/snapshot_message/"):
+                snapshot = Snapshot()
+                snapshot.ParseFromString(body)
+                status = 500 if snapshot.datetime in reject else 200
+            if status == 200:
+                received.append((self.path, body))
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def do_GET(self):
+            datetimes = []
+            for path, body in received:
+                if path.startswith("/api/snapshot_message/"):
+                    snapshot = Snapshot()
+                    snapshot.ParseFromString(body)
+                    datetimes.append(snapshot.datetime)
+            response = json.dumps({"datetimes": datetimes}).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, *args):
+            pass
+
+    http_server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield http_server.server_address[1], received, reject
+    http_server.shutdown()
+
+
+@pytest.fixture
+def cortex_server(tmp_path, monkeypatch):
+    """
+    the REST API of cortex.server, served locally with its raw files in `tmp_path`.
+    yields its port and the list of the messages it published.
+    """
+    published = []
+    monkeypatch.setattr(server, "RAW_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "PUBLISH_METHOD", "function")
+    monkeypatch.setattr(server, "PUBLISH", published.append)
+    http_server = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    yield http_server.server_port, published
+    http_server.shutdown()
+
+
+def test_upload_sample_pipelined(tmp_path, stub_server):
+    port, received, _ = stub_server
+    sample = str(tmp_path / "sample.mind.gz")
+    write_sample(sample, datetimes=range(1, 21))
+    client.upload_sample("127.0.0.1", port, sample, workers=4, window=3)
+
+    assert received[0][0] == "/api/user_message/7"
+    snapshots = [body for path, body in received[1:] if path == "/api/snapshot_message/7"]
+    datetimes = set()
+    for body in snapshots:
+        snapshot = Snapshot()
+        snapshot.ParseFromString(body)
+        datetimes.add(snapshot.datetime)
+    assert datetimes == set(range(1, 21))
+
+
+def test_upload_sample_window():
+    with pytest.raises(SystemExit):
+        client.upload_sample("127.0.0.1", 5000, SAMPLE_FILE, window=0)
+
+
+def test_upload_sample_batches(tmp_path, stub_server):
+    port, received, _ = stub_server
+    sample = str(tmp_path / "sample.mind.gz")
+    write_sample(sample, datetimes=range(1, 8))
+    client.upload_sample("127.0.0.1", port, sample, batch_size=3)
+
+    batches = [body for path, body in received if path == "/api/snapshot_batch/7"]
+    assert len(batches) == 3
+    datetimes = set()
+    for body in batches:
+        offset = 0
+        while offset < len(body):
+            size = struct.unpack_from('I', body, offset)[0]
+            snapshot = Snapshot()
+            snapshot.ParseFromString(body[offset + 4:offset + 4 + size])
+            datetimes.add(snapshot.datetime)
+            offset += 4 + size
+    assert datetimes == set(range(1, 8))
+
+
+def test_upload_sample_batch_limits():
+    with pytest.raises(SystemExit):
+        client.upload_sample("127.0.0.1", 5000, SAMPLE_FILE, batch_bytes=0)
+
+
+def raw_path(tmp_path, name):
+    return tmp_path / shard(name) / name
+
+
+def test_upload_sample_grpc(tmp_path, monkeypatch):
+    published = []
+    monkeypatch.setattr(server, "RAW_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "PUBLISH_METHOD", "function")
+    monkeypatch.setattr(server, "PUBLISH", published.append)
+    grpc_server, port = server.create_grpc_server("127.0.0.1", 0)
+    grpc_server.start()
+    try:
+        sample = str(tmp_path / "sample.mind.gz")
+        write_sample(sample, datetimes=(10, 20, 30))
+        client.upload_sample("127.0.0.1", port, sample, transport="grpc")
+    finally:
+        grpc_server.stop(None)
+
+    messages = [json.loads(message) for message in published]
+    assert messages[0]["user_id"] == 7
+    assert [message["datetime"] for message in messages[1:]] == [10, 20, 30]
+    assert raw_path(tmp_path, "7_20_color").read_bytes() == b"abc"
+
+
+def test_upload_sample_transport():
+    with pytest.raises(SystemExit):
+        client.upload_sample("127.0.0.1", 5000, SAMPLE_FILE, transport="carrier-pigeon")
+
+
+def test_upload_sample_resume(tmp_path, stub_server):
+    port, received, reject = stub_server
+    sample = str(tmp_path / "sample.mind.gz")
+    write_sample(sample, datetimes=range(1, 31))
+    reject.add(20)
+    with pytest.raises(SystemExit):
+        client.upload_sample("127.0.0.1", port, sample, window=4)
+    assert os.path.exists(sample + client.CHECKPOINT_SUFFIX)
+    sent_before = len(received)
+
+    reject.clear()
+    client.upload_sample("127.0.0.1", port, sample, window=4, resume=True)
+    assert not os.path.exists(sample + client.CHECKPOINT_SUFFIX)
+
+    datetimes = []
+    for path, body in received[sent_before:]:
+        if path == "/api/snapshot_message/7":
+            snapshot = Snapshot()
+            snapshot.ParseFromString(body)
+            datetimes.append(snapshot.datetime)
+    # only the snapshots the server did not acknowledge before the failure are sent again
+    assert 20 in datetimes
+    assert not set(datetimes) & {datetime for datetime in range(1, 20)}
+    assert len(datetimes) == len(set(datetimes))
+
+
+def test_validate_snapshot():
+    snapshot = Snapshot()
+    snapshot.datetime = 1575446887339
+    snapshot.pose.translation.x = 0.5
+    snapshot.color_image.data = b"\x00" * 300
+    snapshot.depth_image.data.extend([0.5] * 100)
+    snapshot.feelings.hunger = -0.5
+    serialized = snapshot.SerializeToString()
+    assert client.validate_snapshot(serialized) == 1575446887339
+
+    with pytest.raises(ValueError):
+        client.validate_snapshot(serialized[:-1])
+    with pytest.raises(ValueError):
+        snapshot.ClearField("datetime")
+        client.validate_snapshot(snapshot.SerializeToString())
+    with pytest.raises(ValueError):
+        client.validate_snapshot(b"\x0a\x01\x00")  # datetime sent as a length-delimited field
+
+
+def test_upload_sample_passthrough(tmp_path, stub_server):
+    port, received, _ = stub_server
+    sample = str(tmp_path / "sample.mind.gz")
+    write_sample(sample, datetimes=(1, 2))
+    client.upload_sample("127.0.0.1", port, sample, passthrough=True)
+
+    with gzip.open(sample, "rb") as f:
+        user_size = struct.unpack('I', f.read(4))[0]
+        f.read(user_size)
+        raw_snapshots = []
+        while size_bin := f.read(4):
+            raw_snapshots.append(f.read(struct.unpack('I', size_bin)[0]))
+    assert sorted(body for path, body in received[1:]) == sorted(raw_snapshots)
+
+
+def test_upload_sample_truncated(tmp_path, stub_server):
+    port, _, _ = stub_server
+    sample = str(tmp_path / "sample.mind.gz")
+    write_sample(sample)
+    with gzip.open(sample, "rb") as f:
+        content = f.read()
+    with gzip.open(sample, "wb") as f:
+        f.write(content[:-2])
+    with pytest.raises(SystemExit):
+        client.upload_sample("127.0.0.1", port, sample, passthrough=True)
+
+
+def test_convert_sample(tmp_path):
+    source = str(tmp_path / "sample.mind.gz")
+    destination = str(tmp_path / "sample.mind")
+    write_sample(source, datetimes=range(1, 11))
+    assert sample_format.convert_sample(source, destination, block_snapshots=3) == 10
+
+    gzip_sample = sample_format.open_sample(source)
+    indexed = sample_format.open_sample(destination)
+    assert isinstance(indexed, sample_format.IndexedSample)
+    assert indexed.user == gzip_sample.user
+    assert indexed.metadata["count"] == 10
+    assert (indexed.metadata["first_datetime"], indexed.metadata["last_datetime"]) == (1, 10)
+    assert len(indexed.blocks) == 4
+    frames = list(indexed.frames())
+    assert [raw for raw, _, _ in frames] == [raw for raw, _, _ in gzip_sample.frames()]
+
+    # reading from the position after the fifth snapshot starts at the sixth, without reading earlier blocks
+    _, offset, block_offset = frames[4]
+    assert [raw for raw, _, _ in indexed.frames(offset, block_offset)] == [raw for raw, _, _ in frames[5:]]
+    assert [datetime for _, datetime in indexed.between(4, 7)] == [4, 5, 6, 7]
+    indexed.close()
+    gzip_sample.close()
+
+
+def test_upload_indexed_sample(tmp_path, stub_server):
+    port, received, reject = stub_server
+    source = str(tmp_path / "sample.mind.gz")
+    sample = str(tmp_path / "sample.mind")
+    write_sample(source, datetimes=range(1, 31))
+    sample_format.convert_sample(source, sample, block_snapshots=4)
+    reject.add(20)
+    with pytest.raises(SystemExit):
+        client.upload_sample("127.0.0.1", port, sample, window=4)
+    sent_before = len(received)
+
+    reject.clear()
+    client.upload_sample("127.0.0.1", port, sample, window=4, resume=True)
+    datetimes = []
+    for path, body in received[sent_before:]:
+        if path == "/api/snapshot_message/7":
+            snapshot = Snapshot()
+            snapshot.ParseFromString(body)
+            datetimes.append(snapshot.datetime)
+    assert 20 in datetimes and 30 in datetimes
+    assert not set(datetimes) & set(range(1, 20))
+
+
+def test_cli_convert(tmp_path):
+    source = str(tmp_path / "sample.mind.gz")
+    destination = str(tmp_path / "sample.mind")
+    write_sample(source)
+    process = subprocess.Popen(
+        ['python', "-m", "cortex.client", "convert", "--block-snapshots", "2", source, destination],
+        stdout=subprocess.PIPE,
+    )
+    stdout, _ = process.communicate()
+    assert process.returncode == 0
+    assert b'Converted 3 snapshots' in stdout
+
+
+def test_upload_samples(tmp_path, stub_server):
+    port, received, _ = stub_server
+    for user_id in range(1, 5):
+        write_sample(str(tmp_path / "{}.mind.gz".format(user_id)), user_id=user_id, datetimes=(1, 2, 3))
+    (tmp_path / "notes.txt").write_text("not a sample")
+    report = bulk.upload_samples("127.0.0.1", port, str(tmp_path), processes=2, max_connections=2)
+    assert (report["files"], report["uploaded"], report["snapshots"]) == (4, 4, 12)
+    assert report["failed"] == []
+    assert sorted(path for path, _ in received if path.startswith("/api/user_message/")) == \
+        ["/api/user_message/{}".format(user_id) for user_id in range(1, 5)]
+
+
+def test_upload_samples_failed(tmp_path, stub_server):
+    port, _, _ = stub_server
+    write_sample(str(tmp_path / "1.mind.gz"), user_id=1)
+    (tmp_path / "2.mind.gz").write_bytes(b"not a sample")
+    report = bulk.upload_samples("127.0.0.1", port, str(tmp_path / "*.mind.gz"), processes=2)
+    assert report["uploaded"] == 1
+    assert report["failed"] == [str(tmp_path / "2.mind.gz")]
+
+
+def test_iter_snapshots(tmp_path):
+    sample = str(tmp_path / "sample.mind.gz")
+    write_sample(sample, datetimes=range(1, 101))
+    gzip_sample = sample_format.open_sample(sample)
+    expected = list(gzip_sample.frames())
+    gzip_sample.close()
+    assert list(sample_format.iter_snapshots(sample, read_ahead=4)) == expected
+
+    # closing the generator early stops the reading thread
+    threads = threading.active_count()
+    snapshots = sample_format.iter_snapshots(sample, read_ahead=2)
+    assert next(snapshots) == expected[0]
+    assert threading.active_count() == threads + 1
+    snapshots.close()
+    assert threading.active_count() == threads
+
+
+def test_iter_snapshots_truncated(tmp_path):
+    sample = str(tmp_path / "sample.mind.gz")
+    write_sample(sample)
+    with gzip.open(sample, "rb") as f:
+        content = f.read()
+    with gzip.open(sample, "wb") as f:
+        f.write(content[:-2])
+    snapshots = sample_format.iter_snapshots(sample)
+    assert len([next(snapshots), next(snapshots)]) == 2
+    with pytest.raises(ValueError):
+        next(snapshots)
+
+
+def test_retry_after():
+    class Response:
+        def __init__(self, headers):
+            self.headers = headers
+
+    assert client.retry_after(Response({"Retry-After": "2"})) == 2
+    assert client.retry_after(Response({"Retry-After": "100000"})) == client.BACKOFF_MAX
+    assert client.retry_after(Response({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0
+    assert client.retry_after(Response({"Retry-After": "soon"})) is None
+    assert client.retry_after(Response({})) is None
+    assert all(0 <= client.backoff(attempt) <= client.BACKOFF_MAX for attempt in range(20))
+
+
+def test_upload_sample_throttled(tmp_path):
+    """
+    the server throttles the first snapshot requests with 503 and Retry-After: every snapshot is still uploaded,
+    in order, and the window shrinks.
+    """
+    received = []
+    throttled = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            if self.path.startswith("/api/snapshot_message/") and len(throttled) < 6:
+                throttled.append(self.path)
+                self.send_response(503)
+                self.send_header('Retry-After', '0')
+            else:
+                received.append((self.path, body))
+                self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    http_server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    try:
+        sample = str(tmp_path / "sample.mind.gz")
+        write_sample(sample, datetimes=range(1, 21))
+        summary = client.upload_sample("127.0.0.1", http_server.server_address[1], sample, window=8)
+    finally:
+        http_server.shutdown()
+    assert summary["snapshots"] == 20
+    datetimes = set()
+    for path, body in received[1:]:
+        snapshot = Snapshot()
+        snapshot.ParseFromString(body)
+        datetimes.add(snapshot.datetime)
+    assert datetimes == set(range(1, 21))
+
+
+def test_uploader_window():
+    user_message = User()
+    uploader = client.SnapshotUploader(None, "http://127.0.0.1:0", user_message, window=16)
+    uploader.sequence = 10
+    uploader._throttle(5)
+    assert uploader.limit == 8
+    uploader._throttle(6)  # in flight before the window was shrunk
+    assert uploader.limit == 8
+    uploader._throttle(11)
+    assert uploader.limit == 4
+    for _ in range(200):
+        uploader._grow()
+    assert uploader.limit == 16
+    uploader.close()
+
+
+def test_uploader_reordered():
+    class Response:
+        ok = True
+        status_code = 201
+
+    class Session:
+        def __init__(self):
+            self.completed = []
+            self.lock = threading.Lock()
+
+        def request(self, method, url, data=None, **kwargs):
+            snapshot = Snapshot()
+            snapshot.ParseFromString(data)
+            if snapshot.datetime % 2:
+                time.sleep(0.05)  # odd snapshots complete after the even snapshots sent right after them
+            with self.lock:
+                self.completed.append(snapshot.datetime)
+            return Response()
+
+    class Checkpoint:
+        def __init__(self):
+            self.count = 0
+            self.acknowledged = []
+
+        def advance(self, record):
+            self.acknowledged.append(record.datetime)
+
+        def save(self):
+            pass
+
+    session = Session()
+    checkpoint = Checkpoint()
+    uploader = client.SnapshotUploader(session, "http://127.0.0.1:0", User(user_id=7), workers=4, window=4,
+                                       checkpoint=checkpoint)
+    for datetime in range(1, 21):
+        snapshot = Snapshot(datetime=datetime)
+        uploader.submit(client.SnapshotRecord(snapshot.SerializeToString(), datetime, datetime, datetime))
+    uploader.close()
+
+    assert sorted(session.completed) == list(range(1, 21))
+    assert session.completed != sorted(session.completed)
+    assert checkpoint.acknowledged == list(range(1, 21))
+    assert uploader.count == 20
+
+
+def test_upload_stats(tmp_path, stub_server):
+    port, _, _ = stub_server
+    sample = str(tmp_path / "sample.mind.gz")
+    stats_path = str(tmp_path / "stats.json")
+    write_sample(sample, datetimes=range(1, 11))
+    summary = client.upload_sample("127.0.0.1", port, sample, batch_size=4, stats_path=stats_path)
+    with open(stats_path) as f:
+        stats = json.load(f)
+    assert stats["snapshots"] == 10
+    assert stats["stages"]["read"]["count"] == 11  # including the end of the file
+    assert stats["stages"]["parse"]["count"] == stats["stages"]["reserialize"]["count"] == 10
+    assert stats["stages"]["send"]["count"] == 3
+    assert stats["stages"]["send"]["p50_seconds"] <= stats["stages"]["send"]["max_seconds"]
+    assert summary["stats"]["bytes"] == stats["bytes"] > 0
+
+
+def test_percentile_of():
+    samples = list(range(1, 101))
+    assert percentile_of(samples, 50) == 50
+    assert percentile_of(samples, 99) == 99
+    assert percentile_of([7], 90) == 7
+    assert percentile_of([], 50) == 0
+
+
+def test_stage_stats_max(monkeypatch):
+    monkeypatch.setattr("cortex.common.stats.RESERVOIR_SIZE", 10)  # the maximum is soon evicted from the reservoir
+    stage_stats = StageStats(["send"])
+    stage_stats.add("send", 5.0)
+    for _ in range(1000):
+        stage_stats.add("send", 0.1)
+    summary = stage_stats.summary()["stages"]["send"]
+    assert summary["count"] == 1001
+    assert summary["max_seconds"] == 5.0
+
+
+def test_generate_sample(tmp_path):
+    sample = str(tmp_path / "synthetic.mind.gz")
+    assert benchmark.generate_sample(sample, snapshots=3, color_size=(8, 4), depth_size=(5, 2), seed=1) == 3
+    frames = list(sample_format.iter_snapshots(sample))
+    assert len(frames) == 3
+    snapshot = Snapshot()
+    snapshot.ParseFromString(frames[1][0])
+    assert snapshot.datetime == benchmark.FIRST_DATETIME + benchmark.SNAPSHOT_INTERVAL
+    assert len(snapshot.color_image.data) == 8 * 4 * 3
+    assert len(snapshot.depth_image.data) == 5 * 2
+
+    other = str(tmp_path / "other.mind.gz")
+    benchmark.generate_sample(other, snapshots=3, color_size=(8, 4), depth_size=(5, 2), seed=1)
+    assert [raw for raw, _, _ in sample_format.iter_snapshots(other)] == [raw for raw, _, _ in frames]
+
+
+@pytest.mark.parametrize("mode", ["sink", "http"])
+def test_benchmark(tmp_path, mode):
+    sample = str(tmp_path / "synthetic.mind.gz")
+    benchmark.generate_sample(sample, snapshots=5, color_size=(16, 8), depth_size=(4, 4))
+    summary = benchmark.benchmark(sample, mode, batch_size=2)
+    assert summary["snapshots"] == 5
+    assert summary["stats"]["snapshots"] == 5
+    assert summary["stats"]["stages"]["reserialize"]["count"] == 5
+
+
+def test_endpoint_pool():
+    pool = EndpointPool(["a:1", "b:1", "c:1"], failures=2, cooldown=60)
+    assert {pool.choose() for _ in range(3)} == {"a:1", "b:1", "c:1"}
+
+    pool.failed("b:1")
+    assert "b:1" in pool.healthy()
+    pool.failed("b:1")
+    assert pool.healthy() == ["a:1", "c:1"]
+    assert {pool.choose() for _ in range(10)} == {"a:1", "c:1"}
+    assert pool.choose(exclude=["a:1"]) == "c:1"
+
+    pool.ejected_until["b:1"] = 0  # the cooldown is over
+    assert "b:1" in pool.healthy()
+
+
+def test_endpoint_pool_throttled():
+    class Response:
+        def __init__(self, status_code):
+            self.status_code = status_code
+
+    pool = EndpointPool(["a:1", "b:1", "c:1"], sticky=True, failures=1)
+    endpoint = pool.choose(7)
+    sent = []
+
+    def send(status_code):
+        return lambda chosen: sent.append(chosen) or Response(status_code)
+
+    # an endpoint which sheds load keeps its users, and is not ejected
+    for status_code in (503, 429, 503):
+        assert pool.request(send(status_code), 7).status_code == status_code
+    assert sent == [endpoint] * 3
+    assert pool.healthy() == ["a:1", "b:1", "c:1"]
+
+    # other 5xx answers fail the request over to another endpoint
+    sent.clear()
+    assert pool.request(send(500), 7).status_code == 500
+    assert sent[0] == endpoint and len(sent) == 3
+    assert pool.ejected_until[endpoint] > 0
+
+
+def test_endpoint_pool_sticky():
+    pool = EndpointPool(["a:1", "b:1", "c:1"], sticky=True, failures=1)
+    placement = {user_id: pool.choose(user_id) for user_id in range(30)}
+    assert len(set(placement.values())) > 1
+    assert all(pool.choose(user_id) == endpoint for user_id, endpoint in placement.items())
+    # every process places users the same way
+    assert all(EndpointPool(["c:1", "a:1", "b:1"], sticky=True).choose(user_id) == endpoint
+               for user_id, endpoint in placement.items())
+
+    # ejecting an endpoint moves only the users placed on it
+    pool.failed("a:1")
+    for user_id, endpoint in placement.items():
+        assert pool.choose(user_id) != "a:1"
+        if endpoint != "a:1":
+            assert pool.choose(user_id) == endpoint
+
+
+def test_upload_sample_endpoints(tmp_path, stub_server):
+    port, received, _ = stub_server
+    with socket.socket() as unused:
+        unused.bind(("127.0.0.1", 0))
+        dead_port = unused.getsockname()[1]
+    sample = str(tmp_path / "sample.mind.gz")
+    write_sample(sample, datetimes=range(1, 11))
+    summary = client.upload_sample(None, None, sample, retries=0,
+                                   endpoints=["127.0.0.1:{}".format(dead_port), "127.0.0.1:{}".format(port)])
+    assert summary["snapshots"] == 10
+    assert len([path for path, _ in received if path == "/api/snapshot_message/7"]) == 10
+
+
+def test_request_compressor():
+    compressor = compression.RequestCompressor("deflate")
+    body, headers = compressor.encode(b"a" * 1000, client.HEADERS)
+    assert headers["Content-Encoding"] == "deflate"
+    assert zlib.decompress(body) == b"a" * 1000
+    assert "Content-Encoding" not in client.HEADERS
+
+    # incompressible bodies turn compression off, and it is still probed from time to time
+    random_body = os.urandom(1000)
+    for _ in range(compression.PROBE_INTERVAL):
+        body, headers = compressor.encode(random_body, client.HEADERS)
+    assert not compressor.enabled
+    assert body == random_body and "Content-Encoding" not in headers
+    while not compressor.enabled:
+        compressor.encode(b"a" * 1000, client.HEADERS)
+    assert compressor.encode(b"b" * 1000, client.HEADERS)[1]["Content-Encoding"] == "deflate"
+    with pytest.raises(ValueError):
+        compression.RequestCompressor("xz", 10)
+
+
+def test_compression_level(tmp_path):
+    sample = str(tmp_path / "sample.mind.gz")
+    write_sample(sample)
+    # rejected before the sample is opened or any request is made
+    with pytest.raises(SystemExit):
+        client.upload_sample("127.0.0.1", 1, sample, compression="deflate", compression_level=12)
+    with pytest.raises(SystemExit):
+        client.upload_sample("127.0.0.1", 1, sample, compression="xz", compression_level=-1)
+
+
+@pytest.mark.parametrize("compression", ["deflate", "xz"])
+def test_upload_sample_compressed(tmp_path, cortex_server, compression):
+    port, published = cortex_server
+    sample = str(tmp_path / "sample.mind.gz")
+    write_sample(sample, datetimes=(1, 2, 3, 4, 5))
+    summary = client.upload_sample("127.0.0.1", port, sample, batch_size=2, compression=compression)
+    assert json.loads(published[0])["user_id"] == 7
+    assert sorted(json.loads(message)["datetime"] for message in published[1:]) == [1, 2, 3, 4, 5]
+    assert summary["stats"]["compression"]["encoding"] == compression
+    assert summary["stats"]["stages"]["compress"]["count"] == 3
+
+
+def test_upload_sample_dedup(tmp_path, cortex_server):
+    port, published = cortex_server
+    sample = str(tmp_path / "sample.mind.gz")
+    write_sample(sample, datetimes=(1, 2, 3, 4, 5))
+    summary = client.upload_sample("127.0.0.1", port, sample, window=1, dedup=True)
+    assert sorted(json.loads(message)["datetime"] for message in published[1:]) == [1, 2, 3, 4, 5]
+    assert summary["stats"]["deduplication"]["deduplicated"] >= 3
+    for snapshot_datetime in (1, 2, 3, 4, 5):
+        assert raw_path(tmp_path, "7_{}_color".format(snapshot_datetime)).read_bytes() == b"abc"
+        assert json.loads(published[snapshot_datetime])["color_image_width"] == 1
+
+
+def test_dedup_options(tmp_path):
+    sample = str(tmp_path / "sample.mind.gz")
+    write_sample(sample)
+    with pytest.raises(SystemExit):
+        client.upload_sample(None, None, sample, passthrough=True, dedup=True, dry_run=True)
+    with pytest.raises(SystemExit):
+        client.upload_sample(None, None, sample, endpoints=["a:1", "b:2"], dedup=True)
+
+
+def test_depth_delta_encoder():
+    rng = np.random.default_rng(0)
+    encoder = encoding.DepthDeltaEncoder()
+    scene = rng.uniform(0.5, 7.0, 64)
+    for index in range(20):
+        snapshot = Snapshot()
+        snapshot.datetime = index + 1
+        # the scene drifts by less than half a quantization step per snapshot, so only a closed loop follows it
+        snapshot.depth_image.data.extend((scene + index * 0.0004).tolist())
+        snapshot.depth_image.data[3] = float("nan") if index == 5 else snapshot.depth_image.data[3]
+        parts = encoding.split_snapshot(snapshot)
+        record = encoder.encode(client.SnapshotRecord(parts.base + parts.color + parts.depth, index + 1, 0, 0, parts))
+        received = Snapshot()
+        received.ParseFromString(record.data)
+        if index in (0, 5, 6):
+            assert not received.depth_image.reference
+            values = np.array(received.depth_image.data, dtype=np.float32)
+        else:
+            assert received.depth_image.reference == index
+            values = encoding.apply_depth_delta(values, list(received.depth_image.delta), received.depth_image.scale)
+            assert np.abs(values[4:] - (scene[4:] + index * 0.0004)).max() <= encoding.DEPTH_DELTA_SCALE / 2 + 1e-6
+            assert len(record.data) < len(parts.base + parts.color + parts.depth)
+        encoder.held(record)
+    assert encoder.summary()["deltas"] == 17 and encoder.summary()["full"] == 3  # the first, the NaN and the next
+    assert encoder.summary()["encoded_bytes"] < encoder.summary()["original_bytes"]
+
+
+def test_zigzag_varints():
+    deltas = [0, 1, -1, 63, -64, 64, -65, 300, -70000, 2 ** 31 - 1, -2 ** 31 + 1]
+    snapshot = Snapshot()
+    snapshot.depth_image.delta.extend(deltas)
+    assert encoding.packed_field(4, encoding.packed_field(6, encoding.zigzag_varints(deltas))) == \
+        snapshot.SerializeToString()
+
+
+def test_upload_sample_depth_delta(tmp_path, cortex_server):
+    port, _ = cortex_server
+    sample = str(tmp_path / "synthetic.mind.gz")
+    benchmark.generate_sample(sample, snapshots=6, color_size=(4, 2), depth_size=(16, 8), user_id=3)
+    summary = client.upload_sample("127.0.0.1", port, sample, window=1, depth_delta=True)
+    assert summary["stats"]["depth_delta"]["deltas"] >= 4
+    assert summary["stats"]["depth_delta"]["encoded_bytes"] < summary["stats"]["depth_delta"]["original_bytes"]
+    for raw, _, _ in sample_format.iter_snapshots(sample):
+        snapshot = Snapshot()
+        snapshot.ParseFromString(raw)
+        stored = read_depth_image(str(raw_path(tmp_path, "3_{}_depth".format(snapshot.datetime))))
+        assert max(abs(value - original) for value, original in zip(stored, snapshot.depth_image.data)) <= 0.0005001
+
+
+def test_inspect_sample(tmp_path):
+    source = str(tmp_path / "sample.mind.gz")
+    write_sample(source, datetimes=(3000, 1000, 2000))
+    report = inspector.inspect_sample(source)
+    assert (report["format"], report["source"]) == ("gzip", "stream")
+    assert report["user"]["user_id"] == 7 and report["user"]["username"] == "Test User"
+    assert report["snapshots"] == 3
+    assert (report["first_datetime"], report["last_datetime"], report["span_seconds"]) == (1000, 3000, 2.0)
+    assert report["image_sizes"]["color_image"] == {"1x1": 3}
+    assert report["field_bytes"]["color_image"] == 3 * 11  # key, length, width, height and data fields
+    assert report["field_bytes"]["framing"] == 3 * 4
+    assert sum(report["field_bytes"].values()) == report["snapshot_bytes"] + report["field_bytes"]["framing"]
+
+    # indexed sample files are answered from their footer, with the same statistics
+    destination = str(tmp_path / "sample.mind")
+    sample_format.convert_sample(source, destination, block_snapshots=2)
+    indexed_report = inspector.inspect_sample(destination)
+    assert (indexed_report["format"], indexed_report["source"]) == ("indexed", "footer")
+    for key in ("user", "snapshots", "first_datetime", "span_seconds", "field_bytes", "image_sizes"):
+        assert indexed_report[key] == report[key]
+
+    process = subprocess.Popen(['python', "-m", "cortex.client", "inspect", source], stdout=subprocess.PIPE)
+    stdout, _ = process.communicate()
+    assert process.returncode == 0
+    assert b'Snapshots: 3' in stdout and b'1x1 (3 snapshots)' in stdout
+
@@ -1,6 +1,8 @@
 import json
+import struct
 import subprocess
 import os
+from cortex.common import codec
 from cortex.parsers import parsers
 
 
@@ -170,6 +172,67 @@ def test_feelings_2():
     assert result is None
 
 
+def test_feelings_envelope():
+    """
+    test feelings success with a binary envelope message, and failure with a malformed one.
+    """
+    result = parsers.run_parser("feelings", codec.encode(correct_data, codec.ENVELOPE), codec.ENVELOPE)
+    result_dict = codec.decode(result, codec.ENVELOPE)
+    assert result_dict["user_id"] == 50
+    assert result_dict["happiness"] == 4
+    assert parsers.run_parser("feelings", correct_data_json, codec.ENVELOPE) is None
+
+
+def test_parser_service_codec(monkeypatch):
+    """
+    test the parser service answers in the codec of the message it parsed, and in its own codec if it has none.
+    """
+    published = []
+
+    class Channel:
+        def __getattr__(self, name):
+            return lambda *args, **kwargs: None
+
+        def basic_consume(self, queue, on_message_callback, auto_ack):
+            self.callback = on_message_callback
+
+        def basic_publish(self, exchange, routing_key, body, properties):
+            published.append((properties.content_type, codec.decode(body, properties.content_type)))
+
+        def start_consuming(self):
+            for content_type in (codec.JSON, codec.ENVELOPE, None):
+                body = codec.encode(correct_data, content_type or codec.JSON)
+                self.callback(self, None, parsers.pika.BasicProperties(content_type=content_type), body)
+
+    class Connection:
+        def __init__(self, parameters):
+            self.consuming_channel = Channel()
+
+        def channel(self):
+            return self.consuming_channel
+
+    monkeypatch.setattr(parsers.pika, "BlockingConnection", Connection)
+    parsers.run_parser_service("feelings", "127.0.0.1", 5672, codec.ENVELOPE)
+    assert [content_type for content_type, _ in published] == [codec.JSON, codec.ENVELOPE, codec.ENVELOPE]
+    assert all(result["happiness"] == 4 for _, result in published)
+
+
+def test_inline_images():
+    """
+    test color image and depth image success with images embedded in the message instead of their paths.
+    """
+    data = dict(correct_data, color_image_width=2, color_image_height=1, color_image_data=bytes(range(6)),
+                depth_image_width=2, depth_image_height=2, depth_image_data=struct.pack('<4f', 0, 1, 2, 3))
+    del data["color_image_path"], data["depth_image_path"]
+    for parser_name in ("color_image", "depth_image"):
+        result_dict = codec.decode(parsers.run_parser(parser_name, codec.encode(data), codec.ENVELOPE),
+                                   codec.ENVELOPE)
+        assert result_dict["width"] == 2
+        os.remove(result_dict["{}_path".format(parser_name)])
+    data["depth_image_data"] = data["depth_image_data"][:-1]
+    assert parsers.run_parser("depth_image", codec.encode(data), codec.ENVELOPE) is None
+
+
 def test_cli_error_1():
     """
     wrong parser name.
@@ -1,8 +1,16 @@
 from cortex.server import server
+from cortex.common.depth import read_depth_image, write_depth_image
+from cortex.common.raw_store import shard
 from .cortex_pb2 import *
+import gzip
 import pytest
 import json
+import lzma
+import numpy as np
+import struct
 import subprocess
+import time
+import zlib
 
 HOST = "127.0.0.1"
 PORT = 8000
@@ -109,3 +117,620 @@ def test_run_server_4():
     """
     with pytest.raises(SystemExit):
         server.run_server("127.0.0.1", 8000, MQ_URL, publish_method="test")
+
+
+def frame(message):
+    return struct.pack('I', len(message)) + message
+
+
+def test_split_frames():
+    frames = [b"first", b"", b"third snapshot"]
+    assert server.split_frames(b"".join(frame(item) for item in frames)) == frames
+
+
+def test_split_frames_truncated():
+    with pytest.raises(ValueError):
+        server.split_frames(frame(b"snapshot")[:-1])
+    with pytest.raises(ValueError):
+        server.split_frames(frame(b"snapshot") + b"\x01")
+
+
+def raw_path(tmp_path, name):
+    return tmp_path / shard(name) / name
+
+
+def test_snapshot_batch(tmp_path, monkeypatch):
+    published = []
+    monkeypatch.setattr(server, "RAW_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "PUBLISH_METHOD", "function")
+    monkeypatch.setattr(server, "PUBLISH", published.append)
+
+    body = b""
+    for snapshot_datetime in (1, 2, 3):
+        snapshot = Snapshot()
+        snapshot.datetime = snapshot_datetime
+        snapshot.color_image.data = b"color"
+        body += frame(snapshot.SerializeToString())
+    response = server.app.test_client().post("/api/snapshot_batch/5", data=body)
+
+    assert response.status_code == 200
+    assert [json.loads(message)["datetime"] for message in published] == [1, 2, 3]
+    assert raw_path(tmp_path, "5_2_color").read_bytes() == b"color"
+
+
+def test_snapshot_batch_malformed(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "RAW_DIR", str(tmp_path))
+    response = server.app.test_client().post("/api/snapshot_batch/5", data=b"\x05\x00")
+    assert response.status_code == 400
+
+
+def test_snapshot_corrupt(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "RAW_DIR", str(tmp_path))
+    test_client = server.app.test_client()
+    assert test_client.post("/api/snapshot_message/1", data=b"\xff\xff\xff").status_code == 400
+    assert test_client.post("/api/snapshot_batch/1", data=frame(b"\xff\xff\xff")).status_code == 400
+
+
+def test_grpc_snapshot_before_user(monkeypatch):
+    import grpc
+    from cortex.server import cortex_pb2_grpc
+    grpc_server, port = server.create_grpc_server("127.0.0.1", 0)
+    grpc_server.start()
+    channel = grpc.insecure_channel("127.0.0.1:{}".format(port))
+    try:
+        with pytest.raises(grpc.RpcError) as e:
+            cortex_pb2_grpc.CortexStub(channel).UploadSample(iter([UploadMessage(snapshot=b"")]))
+        assert e.value.code() == grpc.StatusCode.FAILED_PRECONDITION
+    finally:
+        channel.close()
+        grpc_server.stop(None)
+
+
+def test_stored_datetimes(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "RAW_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "PUBLISH_METHOD", "function")
+    monkeypatch.setattr(server, "PUBLISH", lambda message: None)
+    test_client = server.app.test_client()
+    for snapshot_datetime in (30, 10, 20, 10):
+        snapshot = Snapshot()
+        snapshot.datetime = snapshot_datetime
+        test_client.post("/api/snapshot_message/5", data=snapshot.SerializeToString())
+
+    assert test_client.get("/api/snapshot_message/5").get_json()["datetimes"] == [10, 20, 30]
+    assert test_client.get("/api/snapshot_message/5?since=20").get_json()["datetimes"] == [20, 30]
+    assert test_client.get("/api/snapshot_message/6").get_json()["datetimes"] == []
+
+
+@pytest.mark.parametrize("encoding, compress", [
+    ("deflate", zlib.compress),
+    ("gzip", gzip.compress),
+    ("xz", lzma.compress),
+])
+def test_snapshot_content_encoding(tmp_path, monkeypatch, encoding, compress):
+    published = []
+    monkeypatch.setattr(server, "RAW_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "PUBLISH_METHOD", "function")
+    monkeypatch.setattr(server, "PUBLISH", published.append)
+
+    snapshot = Snapshot()
+    snapshot.datetime = 4
+    snapshot.color_image.data = b"color" * 100
+    response = server.app.test_client().post("/api/snapshot_message/5", data=compress(snapshot.SerializeToString()),
+                                             headers={"Content-Encoding": encoding})
+    assert response.status_code == 200
+    assert json.loads(published[0])["datetime"] == 4
+    assert raw_path(tmp_path, "5_4_color").read_bytes() == b"color" * 100
+
+
+def test_content_encoding_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "RAW_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "PUBLISH_METHOD", "function")
+    monkeypatch.setattr(server, "PUBLISH", lambda message: None)
+    test_client = server.app.test_client()
+    response = test_client.post("/api/snapshot_message/5", data=b"data", headers={"Content-Encoding": "br"})
+    assert response.status_code == 415
+    response = test_client.post("/api/snapshot_message/5", data=b"not deflate", headers={"Content-Encoding": "deflate"})
+    assert response.status_code == 400
+    truncated = zlib.compress(b"\x08\x01" * 100)[:-3]
+    response = test_client.post("/api/snapshot_message/5", data=truncated, headers={"Content-Encoding": "deflate"})
+    assert response.status_code == 400
+    monkeypatch.setattr(server, "MAX_DECODED_BODY", 10)
+    response = test_client.post("/api/snapshot_message/5", data=zlib.compress(b"\x08\x01" * 100),
+                                headers={"Content-Encoding": "deflate"})
+    assert response.status_code == 400
+
+
+def test_color_image_reference(tmp_path, monkeypatch):
+    published = []
+    monkeypatch.setattr(server, "RAW_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "PUBLISH_METHOD", "function")
+    monkeypatch.setattr(server, "PUBLISH", published.append)
+    test_client = server.app.test_client()
+    snapshot = Snapshot()
+    snapshot.datetime = 1
+    snapshot.color_image.data = b"color"
+    assert test_client.post("/api/snapshot_message/5", data=snapshot.SerializeToString()).status_code == 200
+
+    snapshot = Snapshot()
+    snapshot.datetime = 2
+    snapshot.color_image.reference = 1
+    assert test_client.post("/api/snapshot_message/5", data=snapshot.SerializeToString()).status_code == 200
+    assert raw_path(tmp_path, "5_2_color").read_bytes() == b"color"
+    assert json.loads(published[1])["color_image_path"].endswith("5_2_color")
+
+    snapshot.datetime = 3
+    snapshot.color_image.reference = 9
+    assert test_client.post("/api/snapshot_message/5", data=snapshot.SerializeToString()).status_code == 409
+
+
+def test_depth_image_delta(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "RAW_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "PUBLISH_METHOD", "function")
+    monkeypatch.setattr(server, "PUBLISH", lambda message: None)
+    test_client = server.app.test_client()
+    snapshot = Snapshot()
+    snapshot.datetime = 1
+    snapshot.depth_image.data.extend([1.5, 0.0, 2.25])
+    assert test_client.post("/api/snapshot_message/5", data=snapshot.SerializeToString()).status_code == 200
+
+    snapshot = Snapshot()
+    snapshot.datetime = 2
+    snapshot.depth_image.reference = 1
+    snapshot.depth_image.scale = 0.5
+    snapshot.depth_image.delta.extend([1, 4, -2])
+    assert test_client.post("/api/snapshot_message/5", data=snapshot.SerializeToString()).status_code == 200
+    assert read_depth_image(str(raw_path(tmp_path, "5_2_depth"))).tolist() == [2.0, 2.0, 1.25]
+
+    snapshot.datetime = 3
+    snapshot.depth_image.delta.append(1)
+    assert test_client.post("/api/snapshot_message/5", data=snapshot.SerializeToString()).status_code == 400
+    snapshot.depth_image.reference = 9
+    assert test_client.post("/api/snapshot_message/5", data=snapshot.SerializeToString()).status_code == 409
+
+
+def test_publisher_confirms():
+    import pika.frame
+    import pika.spec
+    from cortex.server.publisher import PublisherConnection
+    published = []
+
+    class Channel:
+        def basic_publish(self, exchange, routing_key, body, properties=None):
+            published.append((exchange, routing_key, body))
+            assert properties.content_type == "application/json"
+
+    class IOLoop:
+        def stop(self):
+            pass
+
+    connection = PublisherConnection("localhost", 5672, server.EXCHANGES)
+    futures = connection.publish("snapshot", "snapshot", [b"1", b"2", b"3"], "application/json")
+    connection._flush()  # not connected yet: the messages wait
+    assert not published
+    connection.channel = Channel()
+    connection._on_confirm_mode(None)
+    assert [body for _, _, body in published] == [b"1", b"2", b"3"]
+
+    # a single confirm acknowledges several messages
+    connection._on_confirmation(pika.frame.Method(1, pika.spec.Basic.Ack(delivery_tag=2, multiple=True)))
+    assert [future.done() for future in futures] == [True, True, False]
+    connection._on_confirmation(pika.frame.Method(1, pika.spec.Basic.Nack(delivery_tag=3)))
+    with pytest.raises(ConnectionError):
+        futures[2].result()
+
+    # messages which were not confirmed when the connection closed are published again after reconnecting
+    futures = connection.publish("snapshot", "snapshot", [b"4", b"5"], "application/json")
+    connection._flush()
+    connection._on_confirmation(pika.frame.Method(1, pika.spec.Basic.Ack(delivery_tag=4)))
+    connection._on_close(type("Connection", (), {"ioloop": IOLoop()})(), "connection lost")
+    connection.channel = Channel()
+    connection._on_confirm_mode(None)
+    assert [body for _, _, body in published] == [b"1", b"2", b"3", b"4", b"5", b"5"]
+    connection._on_confirmation(pika.frame.Method(1, pika.spec.Basic.Ack(delivery_tag=1)))
+    assert futures[0].done() and futures[1].done()
+
+
+def test_publisher_unavailable():
+    import socket
+    from cortex.server.publisher import Publisher
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]  # nothing listens on this port
+    publisher = Publisher("127.0.0.1", port, server.EXCHANGES, connections=2)
+    assert not publisher.start(timeout=0.2)
+    with pytest.raises(TimeoutError):
+        publisher.publish(server.EXCHANGE_NAME, server.EXCHANGE_NAME, [b"snapshot"], timeout=0.2)
+    publisher.close()
+
+
+def test_depth_image_format(tmp_path):
+    path = str(tmp_path / "depth")
+    values = [1.5, 0.0, float("inf"), -2.25, 3.0, 0.125]
+    write_depth_image(path, struct.pack("<6f", *values), 3, 2)
+    assert read_depth_image(path).tolist() == values
+    assert read_depth_image(path, mmap=True).tolist() == values
+    write_depth_image(path, [])
+    assert read_depth_image(path, mmap=True).tolist() == []
+    with open(path, "w") as f:
+        json.dump({"data": values[:2]}, f)  # written by earlier servers
+    assert read_depth_image(path).tolist() == values[:2]
+    with open(path, "ab") as f:
+        f.write(b"\x00")
+    with pytest.raises(ValueError):
+        read_depth_image(path)
+
+
+def test_depth_data():
+    from cortex.common.depth import depth_data
+    snapshot = Snapshot()
+    snapshot.datetime = 1
+    snapshot.depth_image.width = 2
+    snapshot.depth_image.data.extend([1.5, -0.25])
+    raw = snapshot.SerializeToString()
+    assert depth_data(raw) == struct.pack("<2f", 1.5, -0.25)
+    split = Snapshot()
+    split.depth_image.data.append(4.0)
+    # a second depth image message is merged into the first one by protobuf, and so are its values
+    assert depth_data(raw + split.SerializeToString()) == struct.pack("<3f", 1.5, -0.25, 4.0)
+    assert depth_data(Snapshot().SerializeToString()) == b""
+
+
+def test_writer():
+    from cortex.server.writer import JobFailed, Writer, WriterFull
+    import threading
+    running, release = threading.Event(), threading.Event()
+    written = []
+    writer = Writer(threads=1, queue_size=1)
+    writer.start()
+    first = writer.submit([("a", lambda path: running.set() or release.wait(5)), ("b", written.append)],
+                          then=lambda: written.append("then"))
+    running.wait(5)
+    writer.submit([("c", written.append)])  # queued while the first job is blocked
+    with pytest.raises(WriterFull):
+        writer.submit([("d", written.append)])
+    assert "d" not in writer.pending
+    waiter = threading.Thread(target=writer.wait, args=("b",))
+    waiter.start()
+    waiter.join(0.1)
+    assert waiter.is_alive() and written == []
+    release.set()
+    waiter.join(5)
+    assert not waiter.is_alive()
+
+    def fail(path):
+        raise OSError("disk full")
+    failed = writer.submit([("e", fail), ("f", written.append)], then=lambda: written.append("not called"))
+    writer.close()
+    assert written == ["b", "then", "c"]
+    assert not writer.pending
+    assert first.result() is None
+    with pytest.raises(JobFailed, match="disk full"):
+        failed.result()
+
+
+def test_write_behind(tmp_path, monkeypatch):
+    from cortex.server.writer import Writer
+    import threading
+    published = []
+    writer = Writer(threads=1, queue_size=1)
+    monkeypatch.setattr(server, "RAW_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "PUBLISH_METHOD", "function")
+    monkeypatch.setattr(server, "PUBLISH", published.append)
+    monkeypatch.setattr(server, "WRITER", writer)
+    test_client = server.app.test_client()
+    running, release = threading.Event(), threading.Event()
+    writer.start()
+    writer.submit([("blocker", lambda path: running.set() or release.wait(5))])  # holds the only writer thread
+    running.wait(5)
+
+    # a snapshot is acknowledged once it is queued, before its files are written
+    snapshot = Snapshot()
+    snapshot.datetime = 1
+    snapshot.color_image.data = b"color"
+    response = test_client.post("/api/snapshot_message/5", data=snapshot.SerializeToString())
+    assert response.status_code == 200
+    assert not raw_path(tmp_path, "5_1_color").exists() and published == []
+    assert server.stored_datetimes("5") == []
+    snapshot = Snapshot()
+    snapshot.datetime = 2
+    snapshot.color_image.data = b"color"
+    response = test_client.post("/api/snapshot_message/5", data=snapshot.SerializeToString())
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+
+    # a reference to an image which is still queued waits for it to be written
+    responses = []
+    snapshot.color_image.reference = 1
+    reference = threading.Thread(target=lambda: responses.append(
+        test_client.post("/api/snapshot_message/5", data=snapshot.SerializeToString()).status_code))
+    reference.start()
+    reference.join(0.1)
+    assert reference.is_alive()
+    release.set()
+    reference.join(5)
+    assert responses == [200]
+    deadline = time.monotonic() + 5
+    while len(published) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    # snapshots whose files could not be written are neither published nor recorded
+    def fail(self, path, data):
+        raise OSError("disk full")
+    monkeypatch.setattr(server.RawStore, "write", fail)
+    snapshot = Snapshot()
+    snapshot.datetime = 3
+    response = test_client.post("/api/snapshot_message/5", data=snapshot.SerializeToString())
+    assert response.status_code == 200
+    server.close_writer()
+    assert raw_path(tmp_path, "5_2_color").read_bytes() == b"color"
+    assert [json.loads(message)["datetime"] for message in published] == [1, 2]
+    assert server.stored_datetimes("5") == [1, 2]
+
+
+def test_ack_after_write(tmp_path, monkeypatch):
+    from cortex.server.writer import Writer
+    import threading
+    published = []
+    writer = Writer(threads=1, queue_size=1)
+    monkeypatch.setattr(server, "RAW_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "PUBLISH_METHOD", "function")
+    monkeypatch.setattr(server, "PUBLISH", published.append)
+    monkeypatch.setattr(server, "WRITER", writer)
+    monkeypatch.setattr(server, "ACK_AFTER_WRITE", True)
+    test_client = server.app.test_client()
+    running, release = threading.Event(), threading.Event()
+    writer.start()
+    writer.submit([("blocker", lambda path: running.set() or release.wait(5))])  # holds the only writer thread
+    running.wait(5)
+
+    # a snapshot is acknowledged only once its files are written
+    responses = []
+    snapshot = Snapshot()
+    snapshot.datetime = 1
+    snapshot.color_image.data = b"color"
+    queued = threading.Thread(target=lambda: responses.append(
+        test_client.post("/api/snapshot_message/5", data=snapshot.SerializeToString()).status_code))
+    queued.start()
+    queued.join(0.1)
+    assert queued.is_alive() and responses == []
+    release.set()
+    queued.join(5)
+    assert responses == [200]
+    assert raw_path(tmp_path, "5_1_color").read_bytes() == b"color" and server.stored_datetimes("5") == [1]
+
+    # snapshots whose files could not be written are not acknowledged
+    def fail(self, path, data):
+        raise OSError("disk full")
+    monkeypatch.setattr(server.RawStore, "write", fail)
+    snapshot = Snapshot()
+    snapshot.datetime = 2
+    response = test_client.post("/api/snapshot_message/5", data=snapshot.SerializeToString())
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+    server.close_writer()
+    assert len(published) == 1 and server.stored_datetimes("5") == [1]
+
+
+def test_admission(monkeypatch):
+    from cortex.server.admission import Admission
+    import threading
+    published = []
+    admission = Admission(concurrency=1, queue_size=1, timeout=5)
+    monkeypatch.setattr(server, "ADMISSION", admission)
+    monkeypatch.setattr(server, "PUBLISH_METHOD", "function")
+    monkeypatch.setattr(server, "PUBLISH", published.append)
+    test_client = server.app.test_client()
+    user = User()
+    user.user_id = 3
+    responses = []
+    queued = threading.Thread(target=lambda: responses.append(
+        test_client.post("/api/user_message/3", data=user.SerializeToString()).status_code))
+
+    with admission.admit():  # holds the only slot
+        queued.start()
+        deadline = time.monotonic() + 5
+        while admission.queued == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        response = test_client.post("/api/user_message/3", data=user.SerializeToString())
+        assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+        assert published == []
+    queued.join(5)
+    assert responses == [200] and len(published) == 1
+
+    stats = test_client.get("/api/stats").get_json()["admission"]
+    assert (stats["admitted"], stats["rejected"], stats["max_queued"], stats["running"]) == (2, 1, 1, 0)
+
+    admission.timeout = 0.01
+    with admission.admit():
+        assert test_client.post("/api/user_message/3", data=user.SerializeToString()).status_code == 503
+    assert admission.timed_out == 1
+
+
+def test_raw_store(tmp_path):
+    from cortex.common.raw_store import RawStore, locate
+    import os
+    store = RawStore(str(tmp_path), content_addressed=True)
+    first, second = store.path(5, 1, "color"), store.path(6, 2, "color")
+    assert first == str(raw_path(tmp_path, "5_1_color")) and os.path.dirname(first) != os.path.dirname(second)
+    store.write(first, b"color")
+    store.write(second, b"color")
+    assert os.path.samefile(first, second)  # identical images are stored once
+    store.write(second, b"other")
+    assert open(first, "rb").read() == b"color" and open(second, "rb").read() == b"other"
+    store.link(first, second)
+    assert open(second, "rb").read() == b"color"
+    with pytest.raises(FileNotFoundError):
+        store.find(5, 3, "color")
+
+    # files written flat by earlier servers are found, and keep their published paths once they are moved
+    legacy = tmp_path / "5_3_depth"
+    legacy.write_bytes(b"depth")
+    (tmp_path / "5_snapshots").write_text("3\n")
+    assert store.find(5, 3, "depth") == str(legacy)
+    assert store.migrate() == 1
+    assert store.find(5, 3, "depth") == store.path(5, 3, "depth")
+    assert open(locate(str(legacy)), "rb").read() == b"depth"
+    assert (tmp_path / "5_snapshots").exists()
+
+
+def test_ingest_stages(tmp_path, monkeypatch):
+    from cortex.common.stats import StageStats
+    monkeypatch.setattr(server, "RAW_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "PUBLISH_METHOD", "function")
+    monkeypatch.setattr(server, "PUBLISH", lambda message: None)
+    monkeypatch.setattr(server, "INGEST_STATS", StageStats(server.INGEST_STAGES))
+    created = []
+    monkeypatch.setattr(server, "Snapshot", lambda: created.append(1) or Snapshot())
+    test_client = server.app.test_client()
+    snapshot = Snapshot()
+    snapshot.datetime = 1
+    snapshot.color_image.data = b"color"
+    data = snapshot.SerializeToString()
+    assert test_client.post("/api/snapshot_message/5", data=data).status_code == 200
+    assert len(created) == 1  # every snapshot is parsed once
+
+    stats = test_client.get("/api/stats").get_json()
+    assert stats["snapshots"] == 1 and stats["bytes"] == len(data)
+    assert {stage: stats["stages"][stage]["count"] for stage in server.INGEST_STAGES} == \
+        {"parse": 1, "extract": 1, "envelope": 1, "write": 2, "publish": 1}
+
+
+def test_codecs():
+    from cortex.common import codec
+    from cortex.common.benchmark import benchmark_codecs, MESSAGES
+    message = dict(MESSAGES["snapshot"], unknown_field=-(2 ** 40), flag=True, empty="")
+    for content_type in (codec.JSON, codec.ENVELOPE):
+        assert codec.decode(codec.encode(message, content_type), content_type) == message
+    body = codec.encode(message)
+    assert len(body) < len(codec.encode(message, codec.JSON)) / 2
+    envelope = Envelope()  # envelopes are plain protobuf messages
+    envelope.ParseFromString(body)
+    assert envelope.fields[0].key == 1 and envelope.fields[0].string_value == "42"
+    assert envelope.fields[-1].name == "empty" and envelope.fields[-1].WhichOneof("value") == "string_value"
+    assert codec.decode(codec.encode({"blob": b"\x00\xff"}), codec.ENVELOPE) == {"blob": b"\x00\xff"}
+
+    assert codec.decode(b'{"user_id": 1}') == {"user_id": 1}  # messages of earlier versions have no content type
+    for body, content_type in [(body[:-1], codec.ENVELOPE), (b"\x0a\x02\x08\x63", codec.ENVELOPE),
+                               (b"[1]", codec.JSON), (b"{}", "text/plain")]:
+        with pytest.raises(ValueError):
+            codec.decode(body, content_type)
+    with pytest.raises(TypeError):
+        codec.encode({"user_id": None})
+
+    results = benchmark_codecs(repeat=1)
+    assert results[codec.ENVELOPE]["user"]["bytes"] < results[codec.JSON]["user"]["bytes"]
+
+
+def test_publish_content_type(monkeypatch):
+    from cortex.common import codec
+    published = []
+
+    class Publisher:
+        def publish(self, exchange, routing_key, messages, content_type=None):
+            published.extend((exchange, content_type, codec.decode(message, content_type)) for message in messages)
+
+    monkeypatch.setattr(server, "PUBLISHER", Publisher())
+    monkeypatch.setattr(server, "PUBLISH_METHOD", "message_queue")
+    user = User()
+    user.user_id = 3
+    user.username = "Test User"
+    test_client = server.app.test_client()
+    assert test_client.post("/api/user_message/3", data=user.SerializeToString()).status_code == 200
+    monkeypatch.setattr(server, "MESSAGE_CONTENT_TYPE", codec.JSON)
+    assert test_client.post("/api/user_message/3", data=user.SerializeToString()).status_code == 200
+    assert [(exchange, content_type) for exchange, content_type, _ in published] == \
+        [(server.USER_MESSAGE_EXCHANGE, codec.ENVELOPE), (server.USER_MESSAGE_EXCHANGE, codec.JSON)]
+    assert published[0][2] == published[1][2] == {"user_id": 3, "username": "Test User", "birthday": 0, "gender": 0}
+
+
+def test_inline_blobs(tmp_path, monkeypatch):
+    from cortex.common import codec
+    published = []
+
+    class Publisher:
+        def publish(self, exchange, routing_key, messages, content_type=None):
+            published.extend(codec.decode(message, content_type) for message in messages)
+
+    monkeypatch.setattr(server, "RAW_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "PUBLISHER", Publisher())
+    monkeypatch.setattr(server, "PUBLISH_METHOD", "message_queue")
+    monkeypatch.setattr(server, "INLINE_THRESHOLD", 16)
+    test_client = server.app.test_client()
+    snapshot = Snapshot()
+    snapshot.datetime = 1
+    snapshot.color_image.data = b"color"
+    snapshot.depth_image.data.extend([1.5, 0.0, 2.25, 1.0, 0.5])
+    assert test_client.post("/api/snapshot_message/5", data=snapshot.SerializeToString()).status_code == 200
+    snapshot = Snapshot()
+    snapshot.datetime = 2
+    snapshot.color_image.reference = 1
+    snapshot.depth_image.data.extend([1.5, 0.0, 2.25])
+    assert test_client.post("/api/snapshot_message/5", data=snapshot.SerializeToString()).status_code == 200
+
+    assert published[0]["color_image_data"] == b"color" and "color_image_path" not in published[0]
+    assert published[0]["depth_image_path"].endswith("5_1_depth") and "depth_image_data" not in published[0]
+    assert published[1]["color_image_data"] == b"color"
+    assert np.frombuffer(published[1]["depth_image_data"], dtype="<f4").tolist() == [1.5, 0.0, 2.25]
+    assert read_depth_image(str(raw_path(tmp_path, "5_2_depth"))).tolist() == [1.5, 0.0, 2.25]
+
+
+def test_prefork(tmp_path):
+    from cortex.server.prefork import Prefork, listening_socket
+    import os
+    import signal
+    first = listening_socket("127.0.0.1", 0)
+    port = first.getsockname()[1]
+    second = listening_socket("127.0.0.1", port)  # workers share the port
+    first.close(), second.close()
+
+    started = tmp_path / "started"
+
+    def serve(ready):
+        with open(started, "a") as f:
+            f.write("{}\n".format(os.getpid()))
+        ready()
+        signal.pause()
+
+    def workers(count):
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            pids = started.read_text().split() if started.exists() else []
+            if len(pids) >= count:
+                return [int(pid) for pid in pids]
+            time.sleep(0.05)
+        raise TimeoutError("{} workers did not start".format(count))
+
+    master = os.fork()
+    if master == 0:
+        try:
+            Prefork(2, serve).run()
+        finally:
+            os._exit(0)
+    first_generation = workers(2)
+    os.kill(master, signal.SIGHUP)  # forks 2 new workers, then stops the old ones
+    second_generation = workers(4)[2:]
+    os.kill(second_generation[0], signal.SIGKILL)  # a worker which exits unexpectedly is replaced
+    replaced = workers(5)[4]
+    os.kill(master, signal.SIGTERM)
+    assert os.waitpid(master, 0)[1] == 0
+    for pid in first_generation + second_generation + [replaced]:
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
+
+
+def test_prefork_worker_status():
+    from cortex.server.prefork import Prefork
+    import os
+
+    def status(error):
+        def serve(ready):
+            raise error
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            Prefork(1, serve)._run_worker(write_fd)
+        os.close(read_fd), os.close(write_fd)
+        return os.WEXITSTATUS(os.waitpid(pid, 0)[1])
+
+    assert status(KeyboardInterrupt()) == 0  # Ctrl-C stops the workers cleanly
+    assert status(SystemExit(0)) == 0
+    assert status(SystemExit(2)) == 2
+    assert status(RuntimeError("failed")) == 1